@@ -1,16 +1,248 @@
 from decouple import config
 import openai
 from openai import AsyncOpenAI
+import asyncio
+import heapq
+import itertools
 import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
 from db_modules.controller import DatabaseController
-from .tools import handle_tool_output
+from settings import get
+from .tools import run_tool_calls
+from .stream import StreamedResponse, consume_stream
+
+
+# Классы приоритета запросов к модели (меньше — важнее)
+LIVE = 0        # ответ клиенту, который сейчас пишет
+FOLLOWUP = 1    # напоминание молчащему клиенту
+GREETING = 2    # первое сообщение из periodic_greeting
+
+_CLASS_NAMES = {LIVE: "live", FOLLOWUP: "followup", GREETING: "greeting"}
+
+
+class AdmissionRejected(Exception):
+    """Запрос низкого приоритета не допущен к модели: лимиты заняты более важной работой."""
+
+
+class _Ticket:
+    """Допуск к модели: учитывает фактически потраченные токены и повторные вызовы (раунды инструментов)."""
+
+    def __init__(self, ctrl: "AdmissionController", priority: int, reserved: int):
+        self._ctrl = ctrl
+        self.priority = priority
+        self.reserved = reserved
+        self.calls = 0
+
+    def charge(self, response) -> None:
+        usage = getattr(response, "usage", None)
+        tokens = int(getattr(usage, "total_tokens", 0) or 0)
+        self._ctrl._charge(self, tokens)
+
+
+class AdmissionController:
+    """
+    Допуск запросов к OpenAI по приоритетам с учётом бюджетов.
+    - не больше `concurrency` одновременных запросов, из них часть держим под LIVE;
+    - скользящее окно в 60 с на запросы (RPM) и токены (TPM), низким классам доступна только доля бюджета;
+    - очередь общая, выдаётся строго по приоритету, внутри класса — по порядку прихода;
+    - FOLLOWUP и GREETING ждут не дольше max_wait, GREETING при живой очереди сразу отбрасывается.
+    """
+
+    def __init__(self, *, concurrency: int = 8, rpm: int = 500, tpm: int = 200_000,
+                 max_wait: Dict[int, Optional[float]] = None):
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        # доля лимитов, доступная классу: остаток — запас под живые ответы
+        self._share = {LIVE: 1.0, FOLLOWUP: 0.75, GREETING: 0.5}
+        self.max_wait = {LIVE: None, FOLLOWUP: 120.0, GREETING: 30.0}
+        if max_wait:
+            self.max_wait.update(max_wait)
+
+        self._in_flight = 0
+        self._requests: deque = deque()            # (ts, 1) в окне 60 с
+        self._tokens: deque = deque()              # [ts, tokens] в окне 60 с
+        self._tokens_sum = 0
+        self._waiters: list = []                   # heap (priority, seq, future, est_tokens)
+        self._waiting = 0                          # живые ожидающие (в куче могут лежать отменённые)
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # счётчики по классам
+        self._stats = {
+            p: {"queued": 0, "in_flight": 0, "admitted": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for p in _CLASS_NAMES
+        }
+
+
+    # ---- окно RPM/TPM ----
+    def _trim(self, now: float) -> None:
+        while self._requests and self._requests[0][0] <= now - 60.0:
+            self._requests.popleft()
+        while self._tokens and self._tokens[0][0] <= now - 60.0:
+            self._tokens_sum -= self._tokens.popleft()[1]
+
+
+    def _can_admit(self, priority: int, est_tokens: int, now: float) -> bool:
+        share = self._share[priority]
+        if self._in_flight >= max(1, int(self.concurrency * share)):
+            return False
+        if len(self._requests) + 1 > self.rpm * share:
+            return False
+        # одиночный запрос больше бюджета всё равно пропускаем, если окно пустое
+        if self._tokens_sum and self._tokens_sum + est_tokens > self.tpm * share:
+            return False
+        return True
+
+
+    def _admit(self, priority: int, est_tokens: int, now: float) -> _Ticket:
+        self._in_flight += 1
+        self._stats[priority]["in_flight"] += 1
+        self._stats[priority]["admitted"] += 1
+        self._requests.append((now, 1))
+        self._tokens.append([now, est_tokens])
+        self._tokens_sum += est_tokens
+        return _Ticket(self, priority, est_tokens)
+
+
+    def _charge(self, ticket: _Ticket, tokens: int) -> None:
+        """Первый вызов уточняет зарезервированную оценку, следующие добавляются в окно."""
+        now = time.monotonic()
+        ticket.calls += 1
+        if ticket.calls == 1:
+            delta = tokens - ticket.reserved
+            self._tokens.append([now, delta])
+            self._tokens_sum += delta
+        else:
+            self._requests.append((now, 1))
+            self._tokens.append([now, tokens])
+            self._tokens_sum += tokens
+
+
+    def _release(self, ticket: _Ticket) -> None:
+        self._in_flight -= 1
+        self._stats[ticket.priority]["in_flight"] -= 1
+        self._dispatch()
+
+
+    def _dispatch(self) -> None:
+        """Выдать допуски ожидающим, пока позволяют лимиты; иначе — проснуться, когда окно освободится."""
+        now = time.monotonic()
+        self._trim(now)
+        while self._waiters:
+            priority, _, fut, est = self._waiters[0]
+            if fut.done():                       # ожидание отменено или истекло
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit(priority, est, now):
+                break
+            heapq.heappop(self._waiters)
+            self._waiting -= 1
+            self._stats[priority]["queued"] -= 1
+            fut.set_result(self._admit(priority, est, now))
+
+        if self._waiters and self._timer is None:
+            oldest = min((q[0][0] for q in (self._requests, self._tokens) if q), default=now)
+            delay = max(0.05, oldest + 60.0 - now)
+            self._timer = asyncio.get_running_loop().call_later(min(delay, 1.0), self._on_timer)
+
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+
+    def _cancel_wait(self, fut: asyncio.Future, st: dict) -> None:
+        """Снять ожидание: отменённый элемент уходит из головы кучи, следующий может получить допуск."""
+        fut.cancel()
+        self._waiting -= 1
+        st["queued"] -= 1
+        self._dispatch()
+
+
+    async def acquire(self, priority: int, est_tokens: int) -> _Ticket:
+        now = time.monotonic()
+        self._dispatch()   # заодно убирает отменённые ожидания из головы кучи
+        st = self._stats[priority]
+
+        # более важные уже ждут — не обгоняем их
+        ahead = bool(self._waiters) and self._waiters[0][0] <= priority
+        if not ahead and self._can_admit(priority, est_tokens, now):
+            return self._admit(priority, est_tokens, now)
+
+        # приветствия не копим в очереди, если кто-то уже ждёт
+        if priority == GREETING and self._waiting:
+            st["rejected"] += 1
+            raise AdmissionRejected(f"{_CLASS_NAMES[priority]}: очередь занята ({self._waiting})")
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut, est_tokens))
+        self._waiting += 1
+        st["queued"] += 1
+        self._dispatch()
+        try:
+            ticket = await asyncio.wait_for(asyncio.shield(fut), self.max_wait[priority])
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():    # допуск успели выдать в последний момент
+                ticket = fut.result()
+            else:
+                self._cancel_wait(fut, st)
+                st["rejected"] += 1
+                raise AdmissionRejected(f"{_CLASS_NAMES[priority]}: ожидание дольше {self.max_wait[priority]} с")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release(fut.result())
+            else:
+                self._cancel_wait(fut, st)
+            raise
+
+        waited = time.monotonic() - now
+        st["wait_total"] += waited
+        st["wait_max"] = max(st["wait_max"], waited)
+        return ticket
+
+
+    @asynccontextmanager
+    async def slot(self, priority: int, est_tokens: int):
+        ticket = await self.acquire(priority, est_tokens)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+
+    def stats(self) -> Dict[str, dict]:
+        """Глубина очереди, занятые слоты, отказы и ожидание по классам."""
+        out = {}
+        for p, st in self._stats.items():
+            admitted = st["admitted"] or 1
+            out[_CLASS_NAMES[p]] = {
+                "queued": st["queued"],
+                "in_flight": st["in_flight"],
+                "admitted": st["admitted"],
+                "rejected": st["rejected"],
+                "wait_avg": round(st["wait_total"] / admitted, 3),
+                "wait_max": round(st["wait_max"], 3),
+            }
+        out["window"] = {"requests": len(self._requests), "tokens": self._tokens_sum}
+        return out
 
 
 class Assistant:
     def __init__(self, model: str, db: DatabaseController):
         self.db = db
-        self.client = AsyncOpenAI(api_key=config('OPENAI_API_KEY'))
+        # base_url можно подменить (прокси, локальная заглушка с записанными SSE-потоками)
+        self.client = AsyncOpenAI(api_key=config('OPENAI_API_KEY'), base_url=config('OPENAI_BASE_URL', default=None))
         self.model = model
+        self.admission = AdmissionController(
+            concurrency=int(get("OPENAI_CONCURRENCY") or 8),
+            rpm=int(get("OPENAI_RPM") or 500),
+            tpm=int(get("OPENAI_TPM") or 200_000),
+        )
+        self._avg_tokens = 4000.0   # скользящая оценка токенов на запрос (для резерва TPM)
         self.prompt = self.get_prompt()
         self.tools = self.load_assistant_component('tools')
         self.response_format = self.load_assistant_component('response_format')
@@ -29,22 +261,37 @@ class Assistant:
     
 
     async def get_or_create_conversation(self, user_id: int) -> str:
-        async with self.db.users() as users_repo:
-            conv_id = await users_repo.get_user_param(user_id, "conversation")
-
-            if conv_id and conv_id != '0':
-                return conv_id
-            
-            conversation = await self.client.conversations.create(
-                metadata = {'user': str(user_id)}
-            )
-            conv_id = conversation.id
-            await users_repo.update_user_param(user_id, "conversation", conv_id)
+        conv_id = await self.db.get_user_param(user_id, "conversation")
 
+        if conv_id and conv_id != '0':
             return conv_id
         
+        conversation = await self.client.conversations.create(
+            metadata = {'user': str(user_id)}
+        )
+        conv_id = conversation.id
+        await self.db.update_user_param(user_id, "conversation", conv_id)
+
+        return conv_id
+        
     
-    async def submit_tools(self, response, conv_id, user_id: int):
+    async def _create(self, ticket: Optional[_Ticket], **kwargs):
+        """
+        Один вызов responses.create. При OPENAI_STREAM ответ читается потоком:
+        возвращается StreamedResponse с отметкой первого токена (см. assistant/stream.py).
+        """
+        if get("OPENAI_STREAM"):
+            started = time.monotonic()
+            events = await self.client.responses.create(**kwargs, stream=True)
+            response = await consume_stream(events, started_at=started)
+        else:
+            response = await self.client.responses.create(**kwargs)
+        if ticket is not None:
+            ticket.charge(response)
+        return response
+
+
+    async def submit_tools(self, response, conv_id, user_id: int, ticket: _Ticket = None):
         input_list = []
         input_list += (response.output or [])
 
@@ -53,21 +300,24 @@ class Assistant:
             if not tool_calls:
                 return response
 
-            tool_outputs = []
+            calls = []
             for call in tool_calls:
                 try:
                     args = json.loads(call.arguments or "{}")
                 except Exception:
                     args = {}
+                calls.append((call.name, args))
 
-                out = await handle_tool_output(self.db, call.name, args, user_id)
+            # вызовы одного хода выполняются параллельно (см. run_tool_calls)
+            outputs = await run_tool_calls(self.db, calls, user_id)
 
-                if out is None:
-                    out = ""
-
-                tool_outputs.append({'type': 'function_call_output', 'call_id': call.call_id, 'output': out})
+            tool_outputs = [
+                {'type': 'function_call_output', 'call_id': call.call_id, 'output': out}
+                for call, out in zip(tool_calls, outputs)
+            ]
             
-            response = await self.client.responses.create(
+            response = await self._create(
+                ticket,
                 model = self.model,
                 instructions = self.prompt,
                 conversation = conv_id,
@@ -82,22 +332,32 @@ class Assistant:
             input_list += (response.output or [])
         
     
-    async def get_assistant_response(self, user_input: str, user_id: int):
+    async def get_assistant_response(self, user_input: str, user_id: int, priority: int = LIVE):
+        """
+        Ответ ассистента. priority — класс запроса (LIVE / FOLLOWUP / GREETING),
+        при перегрузке низкие классы получают AdmissionRejected.
+        В потоковом режиме возвращается StreamedResponse (есть first_token_at).
+        """
         conv_id = await self.get_or_create_conversation(user_id)
 
-        response = await self.client.responses.create(
-            model = self.model,
-            instructions = self.prompt,
-            conversation = conv_id,
-            input = [{'role': 'user', 'content': user_input}],
-            tools = self.tools,
-            text = self.response_format,
-            parallel_tool_calls=True,
-            temperature=1,
-            store=True,
-        )
+        async with self.admission.slot(priority, int(self._avg_tokens)) as ticket:
+            response = await self._create(
+                ticket,
+                model = self.model,
+                instructions = self.prompt,
+                conversation = conv_id,
+                input = [{'role': 'user', 'content': user_input}],
+                tools = self.tools,
+                text = self.response_format,
+                parallel_tool_calls=True,
+                temperature=1,
+                store=True,
+            )
+            used = int(getattr(getattr(response, "usage", None), "total_tokens", 0) or 0)
+            if used:
+                self._avg_tokens = 0.9 * self._avg_tokens + 0.1 * used
 
-        response_after_tools = await self.submit_tools(response, conv_id, user_id)
+            response_after_tools = await self.submit_tools(response, conv_id, user_id, ticket)
 
         if response.output_text:
             return response
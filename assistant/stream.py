@@ -0,0 +1,57 @@
+import time
+from typing import Any, AsyncIterable, Optional
+
+
+class StreamedResponse:
+    """
+    Итог потокового вызова Responses API.
+    Атрибуты итогового Response (output, output_text, usage…) доступны как есть,
+    плюс отметка времени первого токена (time.monotonic): с неё logic.py начинает «печать».
+    """
+
+    def __init__(self, started_at: float):
+        self.response: Any = None
+        self.started_at = started_at
+        self.first_token_at: Optional[float] = None
+        self.text = ""
+
+    def __getattr__(self, name):
+        response = self.__dict__.get("response")
+        if response is None:
+            raise AttributeError(name)
+        return getattr(response, name)
+
+    @property
+    def output_text(self) -> str:
+        if self.response is not None:
+            return self.response.output_text
+        return self.text
+
+    def timings(self) -> dict:
+        """Задержки от начала запроса, в секундах."""
+        def since(ts):
+            return None if ts is None else round(ts - self.started_at, 3)
+        return {"first_token": since(self.first_token_at)}
+
+
+async def consume_stream(events: AsyncIterable, *, started_at: float = None) -> StreamedResponse:
+    """
+    Читает поток событий responses.create(stream=True) до конца.
+    Текст копится по мере прихода, итоговый Response берётся из response.completed.
+    """
+    result = StreamedResponse(time.monotonic() if started_at is None else started_at)
+
+    async for event in events:
+        kind = getattr(event, "type", None)
+        if kind == "response.output_text.delta":
+            if result.first_token_at is None:
+                result.first_token_at = time.monotonic()
+            result.text += event.delta
+        elif kind == "response.completed":
+            result.response = event.response
+        elif kind in ("response.failed", "response.incomplete", "error"):
+            raise RuntimeError(f"stream {kind}: {getattr(event, 'response', None) or getattr(event, 'message', '')}")
+
+    if result.response is None:
+        raise RuntimeError("stream закончился без response.completed")
+    return result
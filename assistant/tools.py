@@ -1,5 +1,6 @@
 import json
 import asyncio
+import time
 from crm import*
 from db_modules.controller import DatabaseController
 
@@ -8,6 +9,21 @@ with open("data/links.json", "r", encoding="utf-8") as f:
     LINKS_DB = json.load(f)
 
 
+# Таймауты инструментов, с (остальным — DEFAULT_TOOL_TIMEOUT)
+DEFAULT_TOOL_TIMEOUT = 10.0
+TOOL_TIMEOUTS = {
+    "process_user_agreement": 30.0,
+}
+
+# Инструмент ждёт перечисленные, если модель вызвала их в том же ходе
+TOOL_DEPENDENCIES = {
+    "process_user_agreement": ("save_user_phone", "save_user_name"),
+}
+
+# Задержки инструментов: name -> {calls, errors, timeouts, total, max}
+TOOL_STATS: dict[str, dict] = {}
+
+
 def get_link(*keys):
     current = LINKS_DB
     for key in keys:
@@ -41,22 +57,16 @@ async def ban_user(db: DatabaseController, user_id: int):
 
 
 async def process_user_agreement(db: DatabaseController, user_id: int, summary: str):
-    async with db.users() as users_repo:
-        await users_repo.update_user_param(user_id, "summary", summary)
+    await db.update_user_param(user_id, "summary", summary)
 
-        user = await users_repo.get_user(user_id)
-        username, phone, name = user['username'], user['phone'], user['name']
-        if name == '':
-            name = username
+    user = await db.get_user(user_id)
+    username, phone, name = user['username'], user['phone'], user['name']
+    if name == '':
+        name = username
 
-        success = send_to_crm(name=name, phone=phone, note=summary, telegram=username)
-
-        if success:
-            await users_repo.update_user_param(user_id, "crm", True)
-            return "Пользователь отмечен как согласный на звонок, данные отправлены в CRM."
-        else:
-            print(f"Failed to add to CRM: {user_id, username}")
-            return "Ошибка добавления в CRM, попробуй еще раз"
+    # доставку в amoCRM (с повторами) делает services/crm_worker.py; users.crm ставится после подтверждения
+    await db.enqueue_crm(user_id, name=name, phone=phone, note=summary, telegram=username)
+    return "Пользователь отмечен как согласный на звонок, данные переданы в CRM."
 
 
 async def handle_tool_output(db: DatabaseController, function_name, args, user_id) -> str:
@@ -87,6 +97,66 @@ async def handle_tool_output(db: DatabaseController, function_name, args, user_i
     return output
 
 
+def _record(name: str, elapsed: float, *, error: bool = False, timeout: bool = False) -> None:
+    st = TOOL_STATS.setdefault(name, {"calls": 0, "errors": 0, "timeouts": 0, "total": 0.0, "max": 0.0})
+    st["calls"] += 1
+    st["errors"] += error
+    st["timeouts"] += timeout
+    st["total"] += elapsed
+    st["max"] = max(st["max"], elapsed)
+
+
+def tool_stats() -> dict:
+    """Вызовы, ошибки, таймауты и задержки (средняя/максимальная, с) по инструментам."""
+    return {
+        name: {
+            "calls": st["calls"],
+            "errors": st["errors"],
+            "timeouts": st["timeouts"],
+            "avg": round(st["total"] / st["calls"], 3) if st["calls"] else 0.0,
+            "max": round(st["max"], 3),
+        }
+        for name, st in TOOL_STATS.items()
+    }
+
+
+async def run_tool_calls(db: DatabaseController, calls: list[tuple[str, dict]], user_id) -> list[str]:
+    """
+    Выполняет вызовы инструментов одного хода параллельно, с таймаутом на каждый.
+    Вызов из TOOL_DEPENDENCIES сначала дожидается своих зависимостей из этого же хода
+    (process_user_agreement должен видеть только что сохранённые имя и телефон).
+    Возвращает выводы в порядке calls.
+    """
+    tasks: dict[str, list[asyncio.Task]] = {}
+
+    async def run_one(name: str, args: dict) -> str:
+        deps = [t for dep in TOOL_DEPENDENCIES.get(name, ()) for t in tasks.get(dep, ())]
+        if deps:
+            await asyncio.gather(*deps, return_exceptions=True)
+
+        t0 = time.monotonic()
+        try:
+            out = await asyncio.wait_for(handle_tool_output(db, name, args, user_id),
+                                         TOOL_TIMEOUTS.get(name, DEFAULT_TOOL_TIMEOUT))
+            _record(name, time.monotonic() - t0)
+            return out or ""
+        except asyncio.TimeoutError:
+            _record(name, time.monotonic() - t0, timeout=True)
+            print(f"[TOOLS] [{name}] [user {user_id}] таймаут")
+            return json.dumps({"function_name": "Инструмент не ответил вовремя, попробуй еще раз"}, ensure_ascii=False)
+        except Exception as e:
+            _record(name, time.monotonic() - t0, error=True)
+            print(f"[TOOLS] [{name}] [user {user_id}] {e}")
+            return json.dumps({"function_name": f"Ошибка инструмента: {e}"}, ensure_ascii=False)
+
+    ordered = []
+    for name, args in calls:
+        task = asyncio.create_task(run_one(name, args))
+        tasks.setdefault(name, []).append(task)
+        ordered.append(task)
+    return list(await asyncio.gather(*ordered))
+
+
 import re
 
 
@@ -0,0 +1,155 @@
+"""
+Доставка заявок в CRM на локальной заглушке forms.amocrm.ru/queue/add.
+Заглушка работает в отдельном потоке, отвечает с задержкой и отклоняет часть запросов (HTTP 503).
+
+Сравнивается:
+- старый путь: блокирующий requests.post прямо в корутине;
+- очередь crm_queue + CRMClient (httpx) с повторами.
+Для каждого режима — время доставки всех заявок и максимальная задержка цикла событий
+(насколько «замерзают» остальные исполнители).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_crm_delivery --leads 40 --latency 0.2 --fail 0.3
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+from sqlalchemy import select, func
+from tabulate import tabulate
+
+from crm import CRMClient, build_form
+from db_modules.controller import DatabaseController
+from services import crm_worker
+
+
+def _start_stub(latency: float, fail: float) -> tuple[str, asyncio.AbstractEventLoop]:
+    """Поднимает заглушку в своём потоке (чтобы блокирующий режим не мешал ей отвечать)."""
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    box = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(_serve(latency, fail))
+        box["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{box['port']}/queue/add", loop
+
+
+async def _serve(latency: float, fail: float):
+    """Заглушка формы amoCRM: POST /queue/add -> 200 или 503."""
+    rnd = random.Random(1)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.decode("latin-1").split("\r\n"):
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                await reader.readexactly(length)
+                await asyncio.sleep(latency)
+                if rnd.random() < fail:
+                    writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+                else:
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def _lag_probe(stop: asyncio.Event, step: float = 0.01) -> float:
+    """Максимальное опоздание пробуждения цикла событий, с."""
+    worst = 0.0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(step)
+        worst = max(worst, time.perf_counter() - t0 - step)
+    return worst
+
+
+async def _blocking(url: str, leads: int) -> int:
+    """Прежний путь: requests.post в корутине, без повторов."""
+    ok = 0
+    for i in range(leads):
+        response = requests.post(url, data=build_form(f"name{i}", "+70000000000", "note", f"tg{i}"))
+        ok += response.status_code == 200
+    return ok
+
+
+async def _queued(url: str, leads: int) -> int:
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db = DatabaseController(f"sqlite+aiosqlite:///{path}")
+    client = CRMClient(base_url=url)
+    try:
+        await db.init_db()
+        async with db.users() as users_repo:
+            for uid in range(1, leads + 1):
+                users_repo.session.add(users_repo.model(user_id=uid, info=""))
+            await users_repo.session.commit()
+        for uid in range(1, leads + 1):
+            await db.enqueue_crm(uid, name=f"name{uid}", phone="+70000000000", note="note", telegram=f"tg{uid}")
+
+        # в бенчмарке повторяем сразу, а не через минуты
+        crm_worker.retry_delay = lambda attempts, **kw: 0.0
+        delivered = 0
+        while delivered < leads:
+            delivered += await crm_worker.deliver_due_leads(db, client, batch=leads)
+        async with db.users() as users_repo:
+            marked = await users_repo.session.scalar(
+                select(func.count()).where(users_repo.model.crm.is_(True))
+            )
+        assert marked == delivered, "users.crm должен совпадать с принятыми заявками"
+        return delivered
+    finally:
+        await client.aclose()
+        await db.close()
+        os.remove(path)
+
+
+async def _run(mode: str, url: str, leads: int) -> list:
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_lag_probe(stop))
+    await asyncio.sleep(0)   # пробник должен успеть заснуть до начала замера
+    t0 = time.perf_counter()
+    delivered = await (_blocking(url, leads) if mode == "blocking" else _queued(url, leads))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    lag = await probe
+    return [mode, leads, delivered, round(elapsed, 2), round(lag * 1000, 1)]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка ответа заглушки, с")
+    parser.add_argument("--fail", type=float, default=0.3, help="доля ответов 503")
+    args = parser.parse_args()
+
+    url, stub_loop = _start_stub(args.latency, args.fail)
+    try:
+        rows = [await _run(mode, url, args.leads) for mode in ("blocking", "queued")]
+    finally:
+        stub_loop.call_soon_threadsafe(stub_loop.stop)
+    print(tabulate(rows, headers=["mode", "leads", "delivered", "seconds", "max loop lag ms"], tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+Выбор кандидатов на приветствие: старый вариант (вся очередь в Python)
+против выборки по частичному индексу (UsersRepo.pop_users_to_greet).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_greet_query --sizes 10000 100000 1000000 --executors 50
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import select
+from tabulate import tabulate
+
+from db_modules.controller import DatabaseController
+
+
+async def _legacy_pop(users_repo, limit: int) -> list[tuple[int, int, int]]:
+    """Прежняя реализация: грузим всех неконтактных и фильтруем в цикле."""
+    m = users_repo.model
+    stmt = (
+        select(m.user_id, m.executor_id, m.access_hash)
+        .where(m.contact.is_(False), m.problem.is_(False), m.access_hash.is_not(None), m.executor_id.is_not(None))
+        .order_by(m.problems_count.asc(), m.user_id.asc())
+    )
+    res = await users_repo.session.execute(stmt)
+    picked, seen = [], set()
+    for uid, eid, ah in res.all():
+        if eid in seen:
+            continue
+        picked.append((uid, eid, ah))
+        seen.add(eid)
+        if len(picked) >= limit:
+            break
+    return picked
+
+
+def _fill(path: str, n: int, executors: int) -> None:
+    rnd = random.Random(n)
+    conn = sqlite3.connect(path)
+    rows = (
+        (
+            uid,
+            rnd.randint(1, executors) if rnd.random() > 0.05 else None,
+            rnd.getrandbits(62) if rnd.random() > 0.1 else None,
+            int(rnd.random() < 0.3),
+            int(rnd.random() < 0.05),
+            rnd.randint(0, 4),
+        )
+        for uid in range(1, n + 1)
+    )
+    conn.executemany(
+        "INSERT INTO executors (executor_id, name, api_id, api_hash, session_string, status, users, active_users) "
+        "VALUES (?, ?, ?, ?, ?, 'active', 0, 0)",
+        ((eid, f"exec_{eid}", eid, f"hash_{eid}", f"session_{eid}") for eid in range(1, executors + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO users (user_id, executor_id, access_hash, contact, problem, problems_count, banned, crm, info) "
+        "VALUES (?, ?, ?, ?, ?, ?, 0, 0, '')",
+        rows,
+    )
+    conn.commit()
+    conn.close()
+
+
+async def _measure(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+async def _run(n: int, executors: int, limit: int, repeat: int) -> list:
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db = DatabaseController(f"sqlite+aiosqlite:///{path}")
+    try:
+        await db.init_db()
+        _fill(path, n, executors)
+
+        async with db.users() as users_repo:
+            legacy = await _legacy_pop(users_repo, limit)
+            fresh = await users_repo.pop_users_to_greet(limit)
+            assert legacy == fresh, "результаты старого и нового запроса расходятся"
+
+            legacy_ms = await _measure(lambda: _legacy_pop(users_repo, limit), repeat)
+            indexed_ms = await _measure(lambda: users_repo.pop_users_to_greet(limit), repeat)
+
+        return [n, len(fresh), round(legacy_ms, 2), round(indexed_ms, 2), round(legacy_ms / indexed_ms, 1)]
+    finally:
+        await db.close()
+        os.remove(path)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--executors", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = [await _run(n, args.executors, args.limit, args.repeat) for n in args.sizes]
+    print(tabulate(rows, headers=["users", "picked", "legacy ms", "indexed ms", "speedup"], tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
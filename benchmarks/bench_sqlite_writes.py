@@ -0,0 +1,79 @@
+"""
+Сравнение пропускной способности записи в SQLite:
+обычный движок (каждый метод коммитит сам) против режима одного писателя.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_sqlite_writes --users 2000 --workers 50 --ops 40
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from db_modules.controller import DatabaseController
+
+
+async def _run(single_writer: bool, users: int, workers: int, ops: int) -> dict:
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db = DatabaseController(f"sqlite+aiosqlite:///{path}", single_writer=single_writer)
+    try:
+        await db.init_db()
+        await db.add_users_bulk([{"user_id": uid, "info": ""} for uid in range(1, users + 1)])
+
+        errors = 0
+
+        async def worker():
+            nonlocal errors
+            for _ in range(ops):
+                uid = random.randint(1, users)
+                try:
+                    if random.random() < 0.5:
+                        await db.update_user_param(uid, "summary", f"s{random.random()}")
+                    else:
+                        await db.rotate_user_down(uid)
+                except Exception:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        elapsed = time.perf_counter() - t0
+
+        total = workers * ops
+        commits = db.writer.commits if db.writer else total
+        return {
+            "mode": "single_writer" if single_writer else "default",
+            "ops": total,
+            "errors": errors,
+            "seconds": round(elapsed, 3),
+            "ops/sec": round(total / elapsed, 1),
+            "commits": commits,
+            "commits/sec": round(commits / elapsed, 1),
+        }
+    finally:
+        await db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=40)
+    args = parser.parse_args()
+
+    rows = []
+    for single_writer in (False, True):
+        rows.append(await _run(single_writer, args.users, args.workers, args.ops))
+    print(tabulate([list(r.values()) for r in rows], headers=list(rows[0].keys()), tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
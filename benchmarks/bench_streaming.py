@@ -0,0 +1,140 @@
+"""
+Потоковый ответ ассистента против обычного на локальной заглушке Responses API.
+Заглушка проигрывает записанный SSE-поток (файл с блоками `event:`/`data:`)
+с заданной паузой между событиями; без файла — синтетический поток.
+
+Сравнивается, когда клиент получит сообщение:
+- обычный режим: весь ответ + min(len(answer) * TYPING_DELAY, 10);
+- потоковый: «печать» начинается с первого токена и идёт параллельно генерации.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_streaming --delay 0.02 --typing 0.03
+    python -m benchmarks.bench_streaming --sse recorded.sse
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from openai import AsyncOpenAI
+from tabulate import tabulate
+
+from assistant.stream import consume_stream
+
+
+_ANSWER = {
+    "answer": "Здравствуйте! Да, \"доставка\" есть по всей России, срок 2–5 дней. Пришлю каталог?",
+    "send": True,
+    "file": False,
+    "wait": True,
+    "reply": 0,
+}
+
+
+def _synthetic_stream(chunk: int = 4) -> list[str]:
+    """SSE-поток в формате Responses API: created, куски текста, completed."""
+    text = json.dumps(_ANSWER, ensure_ascii=False)
+    response = {
+        "id": "resp_local", "object": "response", "created_at": 0, "model": "local", "status": "completed",
+        "output": [{
+            "id": "msg_local", "type": "message", "role": "assistant", "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "usage": {"input_tokens": 100, "output_tokens": len(text) // chunk, "total_tokens": 100 + len(text) // chunk},
+        "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+    }
+    events = [("response.created", {"type": "response.created", "sequence_number": 0,
+                                     "response": dict(response, status="in_progress", output=[])})]
+    for i in range(0, len(text), chunk):
+        events.append(("response.output_text.delta", {
+            "type": "response.output_text.delta", "sequence_number": len(events), "item_id": "msg_local",
+            "output_index": 0, "content_index": 0, "delta": text[i:i + chunk], "logprobs": [],
+        }))
+    events.append(("response.completed", {"type": "response.completed", "sequence_number": len(events),
+                                          "response": response}))
+    return [f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n" for name, data in events]
+
+
+def _load_sse(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        blocks = f.read().replace("\r\n", "\n").split("\n\n")
+    return [b.strip("\n") + "\n\n" for b in blocks if b.strip()]
+
+
+async def _serve(blocks: list[str], delay: float, port: int = 0):
+    """Минимальный HTTP-сервер: на любой POST отдаёт поток (stream=true) или итоговый Response."""
+    final = json.loads(blocks[-1].split("data: ", 1)[1])["response"]
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in head.decode("latin-1").split("\r\n"):
+            if line.lower().startswith("content-length:"):
+                length = int(line.split(":", 1)[1])
+        body = json.loads(await reader.readexactly(length) or b"{}")
+
+        if body.get("stream"):
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+            for block in blocks:
+                await asyncio.sleep(delay)
+                writer.write(block.encode("utf-8"))
+                await writer.drain()
+        else:
+            await asyncio.sleep(delay * len(blocks))   # столько же, сколько занял бы поток
+            payload = json.dumps(final, ensure_ascii=False).encode("utf-8")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                         + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", port)
+
+
+async def _measure(client: AsyncOpenAI, stream: bool, typing_delay: float) -> dict:
+    kwargs = dict(model="local", input=[{"role": "user", "content": "Привет"}])
+    t0 = time.monotonic()
+    if stream:
+        response = await consume_stream(await client.responses.create(**kwargs, stream=True), started_at=t0)
+        first = response.first_token_at - t0
+    else:
+        response = await client.responses.create(**kwargs)
+        first = time.monotonic() - t0
+    done = time.monotonic() - t0
+
+    answer = json.loads(response.output_text)["answer"]
+    typing = min(len(answer) * typing_delay, 10.0)
+    if stream:
+        sent_at = max(done, first + typing)
+    else:
+        sent_at = done + typing
+    return {
+        "mode": "stream" if stream else "blocking",
+        "first token s": round(first, 3),
+        "completed s": round(done, 3),
+        "message sent s": round(sent_at, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sse", help="файл с записанным SSE-потоком Responses API")
+    parser.add_argument("--delay", type=float, default=0.02, help="пауза между событиями потока, с")
+    parser.add_argument("--typing", type=float, default=0.03, help="TYPING_DELAY, с на символ")
+    args = parser.parse_args()
+
+    blocks = _load_sse(args.sse) if args.sse else _synthetic_stream()
+    server = await _serve(blocks, args.delay)
+    port = server.sockets[0].getsockname()[1]
+    client = AsyncOpenAI(api_key="local", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    try:
+        rows = [await _measure(client, stream, args.typing) for stream in (False, True)]
+    finally:
+        await client.close()
+        server.close()
+        await server.wait_closed()
+    print(tabulate([list(r.values()) for r in rows], headers=list(rows[0].keys()), tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
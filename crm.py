@@ -1,42 +1,64 @@
-import requests
+import httpx
 import uuid
 import datetime
 import json
 from decouple import config
 
-# URL формы amoCRM
-url = "https://forms.amocrm.ru/queue/add"
+# URL формы amoCRM (можно подменить, например на локальную заглушку)
+url = config('CRM_URL', default="https://forms.amocrm.ru/queue/add")
 form_id = config('CRM_FORM_ID')
 hash = config('CRM_HASH')
 referer = config('CRM_REFERER')
 
 
-def send_to_crm(name: str, phone: str, note: str, telegram: str) -> bool:
-    try:
-        data = {
-            "fields[name_1]": name,
-            "fields[581821_1][521181]": phone,
-            "fields[note_2]": note,
-            "fields[656491_1]": telegram,
-            "form_id": form_id,
-            "hash": hash,
-            "user_origin": json.dumps({
-                "datetime": datetime.datetime.now().strftime('%a %b %d %Y %H:%M:%S GMT%z'),
-                "timezone": "Europe/Moscow",
-                "referer": "https://yyvladelets.amocrm.ru/"
-            }),
-            "visitor_uid": str(uuid.uuid4()),              
-            "form_request_id": str(uuid.uuid4()),          
-            "gso_session_uid": str(uuid.uuid4()),          
-        }
-
-        headers = {
-            "Origin": "https://forms.amocrm.ru",
-            "Referer": referer
-        }
-
-        response = requests.post(url, data=data, headers=headers)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"CRM Error: {e}")
-        return False
\ No newline at end of file
+def build_form(name: str, phone: str, note: str, telegram: str) -> dict:
+    """Поля формы amoCRM для одной заявки."""
+    return {
+        "fields[name_1]": name,
+        "fields[581821_1][521181]": phone,
+        "fields[note_2]": note,
+        "fields[656491_1]": telegram,
+        "form_id": form_id,
+        "hash": hash,
+        "user_origin": json.dumps({
+            "datetime": datetime.datetime.now().strftime('%a %b %d %Y %H:%M:%S GMT%z'),
+            "timezone": "Europe/Moscow",
+            "referer": "https://yyvladelets.amocrm.ru/"
+        }),
+        "visitor_uid": str(uuid.uuid4()),
+        "form_request_id": str(uuid.uuid4()),
+        "gso_session_uid": str(uuid.uuid4()),
+    }
+
+
+class CRMClient:
+    """
+    Асинхронный клиент формы amoCRM: одно keep-alive соединение на всё приложение
+    и ограниченные таймауты, чтобы медленная CRM не держала цикл событий.
+    """
+
+    def __init__(self, *, base_url: str = None, timeout: float = 10.0, max_connections: int = 4):
+        self.url = base_url or url
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={"Origin": "https://forms.amocrm.ru", "Referer": referer},
+        )
+
+
+    async def send(self, name: str, phone: str, note: str, telegram: str) -> tuple[bool, str | None]:
+        """
+        Отправить заявку. Возвращает (принято, ошибка).
+        Сетевые ошибки и таймауты не бросает — их обрабатывает очередь повторов.
+        """
+        try:
+            response = await self._client.post(self.url, data=build_form(name, phone, note, telegram))
+        except httpx.HTTPError as e:
+            return False, f"{type(e).__name__}: {e}"
+        if response.status_code == 200:
+            return True, None
+        return False, f"HTTP {response.status_code}"
+
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
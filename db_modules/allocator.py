@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import select, update, bindparam, func
+from .executors import Executor
+
+
+# множитель нагрузки по состоянию прокси (services/proxy_health.py); dead — не назначаем вовсе
+PROXY_WEIGHTS = {"ok": 1.0, "slow": 2.0}
+
+
+class ExecutorAllocator:
+    """
+    Выдача исполнителей новым пользователям без гонок и повторов.
+    Нагрузки (active_users) держатся в памяти, наименее загруженный берётся из кучи
+    по эффективной нагрузке (active_users + 1) * вес. Вес >= 1 растёт при плохом здоровье:
+    медленный прокси (PROXY_WEIGHTS) и штраф от пула (penalty: сон после FloodWait, backoff).
+    Приращения счётчиков пишутся в executors пачками — по таймеру и при close().
+    Раз в refresh секунд нагрузки и веса перечитываются из БД (новые, удалённые, выключенные исполнители).
+    """
+
+    def __init__(self, db, *, refresh: float = 60.0, interval: float = 2.0):
+        self.db = db
+        self.refresh = refresh
+        self.interval = interval
+        # штраф исполнителя от пула (BotPool выставляет свой), 1.0 — здоров
+        self.penalty: Callable[[int], float] = lambda executor_id: 1.0
+
+        self._loads: Dict[int, int] = {}          # executor_id -> active_users с учётом незаписанного
+        self._weights: Dict[int, float] = {}      # только исполнители, которым можно назначать
+        self._heap: List[Tuple[float, int, int]] = []   # (оценка, executor_id, версия)
+        self._versions: Dict[int, int] = {}
+        self._deltas: Dict[int, int] = {}         # ещё не записанные приращения active_users/users
+        self._seeded_at = 0.0
+        self._seed_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # счётчики
+        self.assigned = 0
+        self.flushes = 0
+
+
+    # ---- куча ----
+
+    def _push(self, executor_id: int) -> None:
+        """Кладёт актуальную оценку исполнителя; старые записи в куче становятся устаревшими."""
+        version = self._versions.get(executor_id, 0) + 1
+        self._versions[executor_id] = version
+        weight = self._weights.get(executor_id)
+        if weight is None:
+            return
+        score = (self._loads.get(executor_id, 0) + 1) * weight
+        heapq.heappush(self._heap, (score, executor_id, version))
+
+
+    def _pop_least_loaded(self) -> Optional[int]:
+        while self._heap:
+            _, executor_id, version = heapq.heappop(self._heap)
+            if self._versions.get(executor_id) == version and executor_id in self._weights:
+                return executor_id
+        return None
+
+
+    # ---- засев из БД ----
+
+    async def _seed(self, *, force: bool = False) -> None:
+        if not force and time.monotonic() - self._seeded_at < self.refresh:
+            return
+        async with self._seed_lock:
+            if not force and time.monotonic() - self._seeded_at < self.refresh:
+                return
+            # под _flush_lock: пока пачка приращений пишется, её нет ни в _deltas, ни в прочитанных active_users
+            async with self._flush_lock:
+                async with self.db.executors() as executors_repo:
+                    rows = await executors_repo.allocation_rows()
+                self._loads = {row["executor_id"]: (row["active_users"] or 0) + self._deltas.get(row["executor_id"], 0)
+                               for row in rows}
+
+            self._weights = {}
+            for row in rows:
+                weight = self._weight(row)
+                if weight is not None:
+                    self._weights[row["executor_id"]] = weight
+
+            self._heap = []
+            self._versions = {}
+            for executor_id in self._weights:
+                self._push(executor_id)
+            self._seeded_at = time.monotonic()
+
+
+    def _weight(self, row: dict) -> Optional[float]:
+        """Вес исполнителя по строке executors и штрафу пула. None — назначать нельзя."""
+        if row["status"] != "active":
+            return None
+        weight = PROXY_WEIGHTS.get(row["proxy_state"] or "ok")
+        if weight is None:
+            return None
+        try:
+            weight *= max(1.0, float(self.penalty(row["executor_id"])))
+        except Exception:
+            pass
+        return weight
+
+
+    def invalidate(self) -> None:
+        """Перечитать исполнителей из БД при следующем назначении (добавили, удалили, сменили статус)."""
+        self._seeded_at = 0.0
+
+
+    # ---- назначение ----
+
+    async def acquire(self, executor_id: int = None) -> Optional[int]:
+        """
+        Назначение одного пользователя: +1 к нагрузке исполнителя.
+        executor_id=None — наименее загруженный из допустимых, иначе указанный (если он есть в executors).
+        """
+        await self._seed()
+        if executor_id is None:
+            executor_id = self._pop_least_loaded()
+            if executor_id is None:
+                return None
+        elif executor_id not in self._loads:
+            await self._seed(force=True)
+            if executor_id not in self._loads:
+                return None
+
+        self._loads[executor_id] = self._loads.get(executor_id, 0) + 1
+        self._deltas[executor_id] = self._deltas.get(executor_id, 0) + 1
+        self._push(executor_id)
+        self.assigned += 1
+        self._ensure_task()
+        return executor_id
+
+
+    def release(self, executor_id: int) -> None:
+        """Откатить назначение, которое не удалось записать пользователю."""
+        if executor_id not in self._loads:
+            return
+        self._loads[executor_id] = max(0, self._loads[executor_id] - 1)
+        self._deltas[executor_id] = self._deltas.get(executor_id, 0) - 1
+        self._push(executor_id)
+
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "assigned": self.assigned,
+            "pending": sum(abs(d) for d in self._deltas.values()),
+            "flushes": self.flushes,
+            "eligible": len(self._weights),
+            "loads": {eid: self._loads[eid] for eid in self._weights},
+        }
+
+
+    # ---- запись счётчиков ----
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+
+    async def _run(self) -> None:
+        while self._deltas:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[DB] [allocator] flush failed: {e}")
+
+
+    async def flush(self) -> int:
+        """Пишет накопленные приращения одним executemany. При ошибке возвращает их в буфер."""
+        async with self._flush_lock:
+            batch = {eid: d for eid, d in self._deltas.items() if d}
+            self._deltas = {}
+            if not batch:
+                return 0
+
+            params = [{"b_id": eid, "b_delta": d} for eid, d in batch.items()]
+
+            async def write(s):
+                t = Executor.__table__
+                stmt = (
+                    update(t)
+                    .where(t.c.executor_id == bindparam("b_id"))
+                    .values(
+                        active_users=func.max(0, func.coalesce(t.c.active_users, 0) + bindparam("b_delta")),
+                        users=func.max(0, func.coalesce(t.c.users, 0) + bindparam("b_delta")),
+                    )
+                )
+                await s.execute(stmt, params)
+                await s.commit()
+
+            try:
+                await self.db.write(write)
+            except BaseException:
+                for eid, d in batch.items():
+                    self._deltas[eid] = self._deltas.get(eid, 0) + d
+                raise
+
+            self.flushes += 1
+            return len(batch)
+
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
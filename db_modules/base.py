@@ -122,7 +122,6 @@ class BaseRepo:
     async def get_one_by(self, **filters):
         stmt = select(self.model).where(self._where_by(**filters))
         res = await self.session.execute(stmt)
-        print(res)
         return res.scalar_one_or_none()
     
 
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Ограниченный LRU-кеш с временем жизни записей.
+    При переполнении вытесняется давно не используемая запись.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+        # счётчики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.expired += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
+    def patch(self, key: Hashable, fields: Dict[str, Any]) -> bool:
+        """
+        Обновляет поля закешированной строки-словаря, если она есть.
+        Возвращает True, если запись была в кеше.
+        """
+        item = self._data.get(key)
+        if item is None or not isinstance(item[1], dict):
+            return False
+        item[1].update(fields)
+        return True
+
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
@@ -1,24 +1,119 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import inspect
 from typing import Optional, Dict, List, Tuple
 from sqlalchemy.orm import declarative_base
 from contextlib import asynccontextmanager
 import time
 from .base import Base
-from .users import UsersRepo
+from .users import UsersRepo, User
 from .executors import ExecutorsRepo
+from .media import MediaRepo
+from .outbox import OutboxRepo, Outbox
+from .crm_queue import CrmQueueRepo, CrmLead
+from .watermarks import WatermarksRepo
+from .writebehind import WriteBehindBuffer
+from .allocator import ExecutorAllocator
+from .cache import TTLCache
+from .writer import SQLiteWriter, WriteOp, tune_sqlite
+
+
+_MISSING = object()
+_USER_COLUMNS = frozenset(User.__table__.columns.keys())
+# колонки executors, от которых зависит выбор исполнителя (ExecutorAllocator)
+_ALLOCATION_COLUMNS = frozenset({"status", "proxy_state", "active_users"})
+
+
+def _add_missing_columns(conn) -> None:
+    """create_all не добавляет новые колонки в уже существующие таблицы — ALTER TABLE ADD COLUMN."""
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=conn.dialect)}"
+            default = getattr(col.default, "arg", None)
+            if isinstance(default, bool):
+                ddl += f" DEFAULT {int(default)}"
+            elif isinstance(default, (int, float)):
+                ddl += f" DEFAULT {default}"
+            elif isinstance(default, str):
+                ddl += " DEFAULT '{}'".format(default.replace("'", "''"))
+            conn.exec_driver_sql(ddl)
+            print(f"[DB] добавлена колонка {table.name}.{col.name}")
+
+
+def _create_missing_indexes(conn) -> None:
+    """create_all не добавляет новые индексы в уже существующие таблицы — догоняем."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
 
 
 class DatabaseController:
-    def __init__(self, db_url: str, echo: bool = False):
-        self.engine = create_async_engine(db_url, echo=echo, future=True)
+    def __init__(self, db_url: str, echo: bool = False, *, single_writer: bool = False,
+                 read_pool_size: int = 4, writer_batch: int = 200, writer_delay: float = 0.005):
+        """
+        single_writer=True — режим одного писателя для SQLite:
+        запись идёт через очередь в отдельное соединение и коммитится пачками
+        (см. SQLiteWriter), чтение — через пул соединений с WAL.
+        Соединения пула чтения — только для чтения (query_only): репозитории из users()/executors()/…
+        годятся лишь для запросов, всё пишущее идёт через write().
+        """
+        self.writer: Optional[SQLiteWriter] = None
+        if single_writer:
+            self.engine = create_async_engine(db_url, echo=echo, future=True, poolclass=AsyncAdaptedQueuePool,
+                                              pool_size=read_pool_size, max_overflow=0)
+            tune_sqlite(self.engine, read_only=True)
+            self.write_engine = create_async_engine(db_url, echo=echo, future=True, poolclass=AsyncAdaptedQueuePool,
+                                                    pool_size=1, max_overflow=0)
+            tune_sqlite(self.write_engine, writer=True)
+            self.writer = SQLiteWriter(self.write_engine, max_batch=writer_batch, max_delay=writer_delay)
+        else:
+            self.engine = create_async_engine(db_url, echo=echo, future=True)
+            self.write_engine = self.engine
         self.Session = async_sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        # отметки времени пишутся пачками в фоне
+        self.timestamps = WriteBehindBuffer(self)
+        # нагрузка исполнителей в памяти: назначение без гонок, счётчики пишутся пачками
+        self.allocator = ExecutorAllocator(self)
+        # кеш строк users: горячие чтения не ходят в SQLite
+        self.user_cache = TTLCache(maxsize=5000, ttl=300.0)
+        self._user_writes = 0  # счётчик записей в users (защита кеша от гонки чтение/запись)
 
     async def init_db(self):
-        async with self.engine.begin() as conn:
+        # схема — через соединение писателя (в режиме одного писателя пул чтения только читает)
+        async with self.write_engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(_add_missing_columns)
+            await conn.run_sync(_create_missing_indexes)
+
+    async def flush(self):
+        """Дописать в БД всё, что лежит в буферах отложенной записи."""
+        await self.allocator.flush()
+        await self.timestamps.flush()
 
     async def close(self):
-        await self.engine.dispose() 
+        await self.allocator.close()
+        await self.timestamps.close()
+        if self.writer is not None:
+            await self.writer.close()
+            await self.write_engine.dispose()
+        await self.engine.dispose()
+
+    async def write(self, fn: WriteOp):
+        """
+        Выполнить операцию записи fn(session).
+        В режиме одного писателя она уходит в очередь SQLiteWriter,
+        иначе — в отдельной сессии, как раньше.
+        """
+        if self.writer is not None:
+            return await self.writer.submit(fn)
+        async with self.session() as s:
+            return await fn(s)
 
     @asynccontextmanager
     async def session(self):
@@ -38,18 +133,63 @@ class DatabaseController:
         async with self.session() as s:
             yield ExecutorsRepo(s)
 
+    @asynccontextmanager
+    async def media(self):
+        async with self.session() as s:
+            yield MediaRepo(s)
+
+    @asynccontextmanager
+    async def outbox(self):
+        async with self.session() as s:
+            yield OutboxRepo(s)
+
+    @asynccontextmanager
+    async def crm_queue(self):
+        async with self.session() as s:
+            yield CrmQueueRepo(s)
+
+    @asynccontextmanager
+    async def watermarks(self):
+        async with self.session() as s:
+            yield WatermarksRepo(s)
+
     # ===========================
     # Executors
     # ===========================
 
     async def get_executor(self, *, executor_id=None, name=None):
         async with self.executors() as executors_repo:
-            return await executors_repo.get_executor(executor_id=executor_id, name=name)
+            row = await executors_repo.get_executor(executor_id=executor_id, name=name)
+        return self.timestamps.overlay("executors", row)
         
 
     async def update_executor_param(self, executor_id: int, column: str, value):
-        async with self.executors() as executors_repo:
-            await executors_repo.update_param(key='executor_id', target=executor_id, column=column, value=value)
+        await self.write(lambda s: ExecutorsRepo(s).update_param(key='executor_id', target=executor_id, column=column, value=value))
+        if column in _ALLOCATION_COLUMNS:
+            self.allocator.invalidate()
+
+
+    async def add_executor(self, name: str, api_id: int, api_hash: str, **kwargs) -> Optional[int]:
+        """Новый исполнитель (проверки на дубликаты — в ExecutorsRepo.add_executor). Возвращает executor_id."""
+        executor_id = await self.write(lambda s: ExecutorsRepo(s).add_executor(name, api_id, api_hash, **kwargs))
+        self.allocator.invalidate()
+        return executor_id
+
+
+    async def delete_executor(self, *, executor_id: int = None, name: str = None) -> bool:
+        """Удаляет исполнителя; его пользователи помечаются забаненными в той же записи."""
+        deleted = await self.write(lambda s: ExecutorsRepo(s).delete_executor(executor_id=executor_id, name=name))
+        # пользователи исполнителя помечены забаненными прямо в БД — кеш строк больше не актуален
+        self.invalidate_user()
+        self.allocator.invalidate()
+        return deleted
+
+
+    async def update_executor_fields(self, executor_id: int, **values):
+        """Несколько колонок исполнителя одним UPDATE."""
+        await self.write(lambda s: ExecutorsRepo(s).update_executor_fields(executor_id, **values))
+        if _ALLOCATION_COLUMNS.intersection(values):
+            self.allocator.invalidate()
 
 
     async def executors_table(self, limit: int = 20, order_by: str = None, asc: bool = True, columns: List[str] = None) -> str:
@@ -61,11 +201,10 @@ class DatabaseController:
     async def executor_timestamp(self, executor_id: int, *, column: str = "last_message", ts: int = None) -> int:
         """
         Поставить исполнителю временную метку в колонку `column` (по умолчанию last_message).
-        Возвращает установленное значение (UNIX ts).
+        Запись отложенная (см. WriteBehindBuffer). Возвращает установленное значение (UNIX ts).
         """
         value = int(time.time()) if ts is None else int(ts)
-        async with self.executors() as executors_repo:
-            await executors_repo.update_param(key="executor_id", target=executor_id, column=column, value=value)
+        self.timestamps.put("executors", executor_id, column, value)
         return value
 
     # ===========================
@@ -73,29 +212,122 @@ class DatabaseController:
     # ===========================
 
     async def add_user(self, **kwargs) -> int:
-        async with self.users() as users_repo:
-            uid = await users_repo.add_user(**kwargs)
+        uid = await self.write(lambda s: UsersRepo(s).add_user(**kwargs))
+        self.invalidate_user(kwargs.get('user_id'))
         return uid
 
 
-    async def delete_user(self, *, user_id: int = None, username: str = None) -> bool:
+    async def add_users_bulk(self, rows: List[dict]) -> List[int]:
+        """Пачка новых пользователей одним INSERT OR IGNORE. Возвращает user_id вставленных."""
+        inserted = await self.write(lambda s: UsersRepo(s).add_users_bulk(rows))
+        for uid in inserted:
+            self.invalidate_user(uid)
+        return inserted
+
+
+    async def missing_users(self, user_ids: List[int]) -> List[int]:
+        """Кого из user_ids ещё нет в users (одним запросом)."""
         async with self.users() as users_repo:
-            return await users_repo.delete_user(user_id=user_id, username=username)
+            return await users_repo.missing_ids(user_ids)
+
+
+    async def delete_user(self, *, user_id: int = None, username: str = None) -> bool:
+        ok = await self.write(lambda s: UsersRepo(s).delete_user(user_id=user_id, username=username))
+        # delete_user снимает пользователя с исполнителя (dec_active) — нагрузки аллокатора устарели
+        self.allocator.invalidate()
+        if user_id is None:
+            self.invalidate_user()
+        else:
+            self.invalidate_user(user_id)
+        return ok
 
 
     async def update_user_param(self, user_id: int, column: str, value):
-        async with self.users() as users_repo:
-            await users_repo.update_param(key='user_id', target=user_id, column=column, value=value)
+        await self.write(lambda s: UsersRepo(s).update_param(key='user_id', target=user_id, column=column, value=value))
+        self._user_writes += 1
+        self.user_cache.patch(user_id, {column: value})
+
+
+    async def update_user_fields(self, user_id: int, **values):
+        """Несколько колонок пользователя одним UPDATE."""
+        if not values:
+            return
+        await self.write(lambda s: UsersRepo(s).update_user_fields(user_id, **values))
+        self._user_writes += 1
+        self.user_cache.patch(user_id, values)
+
+
+    async def get_user(self, user_id: int) -> Optional[dict]:
+        """
+        Строка пользователя (dict) или None. Читает через кеш строк,
+        поверх накладываются ещё не записанные отметки времени.
+        """
+        row = self.user_cache.get(user_id, _MISSING)
+        if row is _MISSING:
+            writes = self._user_writes
+            async with self.users() as users_repo:
+                row = await users_repo.get_user(user_id)
+            # если за время чтения строку успели поменять — не кешируем устаревшее
+            if writes == self._user_writes:
+                self.user_cache.set(user_id, row)
+        if row is None:
+            return None
+        return self.timestamps.overlay("users", dict(row))
 
     
     async def get_user_param(self, user_id: int, column: str):
-        async with self.users() as users_repo:
-            return await users_repo.get_param(key='user_id', target=user_id, column=column)
+        if column not in _USER_COLUMNS:
+            raise ValueError(f"Недопустимое имя колонки (column): {column}")
+        pending = self.timestamps.get("users", user_id, column)
+        if pending is not None:
+            return pending
+        row = await self.get_user(user_id)
+        return row[column] if row else None
 
 
-    async def assign_executor(self, user_id: int, executor_id: int = None, max_retries: int = 5, sleep: float = 0.5) -> int:
-        async with self.users() as users_repo:
-            return await users_repo.assign_executor(user_id, executor_id, max_retries, sleep)
+    async def access_hashes(self, user_ids: List[int]) -> Dict[int, int]:
+        """access_hash сразу для многих пользователей: из кеша строк, остальные — одним запросом."""
+        found, rest = {}, []
+        for uid in user_ids:
+            row = self.user_cache.get(uid, _MISSING)
+            if row is _MISSING:
+                rest.append(uid)
+            elif row and row.get("access_hash") is not None:
+                found[uid] = row["access_hash"]
+        if rest:
+            async with self.users() as users_repo:
+                found.update(await users_repo.get_access_hashes(rest))
+        return found
+
+
+    async def inbound_gate(self, user_id: int) -> Optional[dict]:
+        """
+        executor_id, banned, access_hash пользователя одним чтением (обычно из кеша).
+        None — пользователя нет в БД.
+        """
+        row = await self.get_user(user_id)
+        if row is None:
+            return None
+        return {"executor_id": row["executor_id"], "banned": bool(row["banned"]), "access_hash": row["access_hash"]}
+
+
+    async def assign_executor(self, user_id: int, executor_id: int = None) -> Optional[int]:
+        """
+        Назначает пользователю исполнителя: наименее загруженного с учётом здоровья
+        (ExecutorAllocator, без повторов) или указанного. Возвращает executor_id или None.
+        """
+        eid = await self.allocator.acquire(executor_id)
+        if eid is None:
+            print("Нет доступных исполнителей со статусом 'active'" if executor_id is None
+                  else f"Исполнитель с id={executor_id} не найден")
+            return None
+        if not await self.write(lambda s: UsersRepo(s).set_executor(user_id, eid)):
+            self.allocator.release(eid)
+            print(f"Пользователь {user_id} не найден")
+            return None
+        self._user_writes += 1
+        self.user_cache.patch(user_id, {"executor_id": eid})
+        return eid
 
     
     async def users_table(self, limit: int = 20, order_by: str = None, asc: bool = True, columns: List[str] = None) -> str:
@@ -107,14 +339,168 @@ class DatabaseController:
     async def user_timestamp(self, user_id: int, *, column: str = "last_message", ts: int = None,) -> int:
         """
         Поставить пользователю временную метку в колонку `column` (по умолчанию last_message).
-        Возвращает установленное значение (UNIX ts).
+        Запись отложенная (см. WriteBehindBuffer). Возвращает установленное значение (UNIX ts).
         """
         value = int(time.time()) if ts is None else int(ts)
-        async with self.users() as users_repo:
-            await users_repo.update_param(key="user_id", target=user_id, column=column, value=value)
+        self.timestamps.put("users", user_id, column, value)
         return value
 
 
     async def rotate_user_down(self, user_id: int):
+        await self.write(lambda s: UsersRepo(s).rotate_user_down(user_id))
+        self.invalidate_user(user_id)
+
+
+    async def forget_user(self, user_id: int):
+        await self.write(lambda s: UsersRepo(s).forget_user(user_id))
+        self.invalidate_user(user_id)
+
+
+    async def schedule_followup(self, user_id: int, due_at: int, *, first: bool = False):
+        """Назначить напоминание клиенту на момент due_at (UNIX ts)."""
+        await self.update_user_fields(user_id, followup_at=int(due_at), followup_first=bool(first))
+
+
+    async def cancel_followup(self, user_id: int):
+        """Снять напоминание (клиент ответил). Без записи, если его и не было."""
+        row = await self.get_user(user_id)
+        if row and row.get("followup_at") is not None:
+            await self.update_user_param(user_id, "followup_at", None)
+
+
+    async def get_due_followups(self, *, due_before: int = None, limit: int = 100, after: Tuple[int, int] = (0, 0)) -> List[User]:
         async with self.users() as users_repo:
-            await users_repo.rotate_user_down(user_id)
+            return await users_repo.get_inactive_users(due_before=due_before, limit=limit, after=after)
+
+
+    async def claim_followup(self, user_id: int, due_at: int) -> bool:
+        ok = await self.write(lambda s: UsersRepo(s).claim_followup(user_id, due_at))
+        if ok:
+            self._user_writes += 1
+            self.user_cache.patch(user_id, {"followup_at": None})
+        else:
+            # напоминание сняли или перенесли — в кеше может лежать устаревший срок
+            self.invalidate_user(user_id)
+        return ok
+
+
+    def invalidate_user(self, user_id: int = None) -> None:
+        """Сбросить строку пользователя из кеша (без user_id — весь кеш)."""
+        self._user_writes += 1
+        if user_id is None:
+            self.user_cache.clear()
+        else:
+            self.user_cache.pop(user_id)
+
+
+    def cache_stats(self) -> dict:
+        stats = {"users": self.user_cache.stats(), "timestamps": self.timestamps.stats()}
+        if self.writer is not None:
+            stats["writer"] = self.writer.stats()
+        return stats
+
+    # ===========================
+    # Media
+    # ===========================
+
+    async def get_media(self, executor_id: int, path: str, file_hash: str) -> Optional[dict]:
+        async with self.media() as media_repo:
+            return await media_repo.get_media(executor_id, path, file_hash)
+
+
+    async def save_media(self, executor_id: int, path: str, file_hash: str, *,
+                         doc_id: int, access_hash: int, file_reference: bytes) -> None:
+        await self.write(lambda s: MediaRepo(s).save_media(executor_id, path, file_hash, doc_id, access_hash, file_reference))
+
+
+    async def drop_media(self, executor_id: int, path: str) -> None:
+        await self.write(lambda s: MediaRepo(s).drop_media(executor_id, path))
+
+    # ===========================
+    # Outbox
+    # ===========================
+
+    async def enqueue_outbox(self, *, executor_id: int, user_id: int, kind: str, payload: str, idem_key: str,
+                             priority: int = 0, not_before: int = 0, status: str = "pending") -> Optional[int]:
+        return await self.write(lambda s: OutboxRepo(s).enqueue(
+            executor_id=executor_id, user_id=user_id, kind=kind, payload=payload, idem_key=idem_key,
+            priority=priority, not_before=not_before, status=status))
+
+
+    async def next_outbox(self, executor_id: int, *, limit: int = 50) -> List[Outbox]:
+        async with self.outbox() as outbox_repo:
+            return await outbox_repo.next_batch(executor_id, limit=limit)
+
+
+    async def outbox_status(self, idem_key: str) -> Optional[str]:
+        async with self.outbox() as outbox_repo:
+            return await outbox_repo.get_status(idem_key)
+
+
+    async def outbox_earliest(self, executor_id: int) -> Optional[int]:
+        async with self.outbox() as outbox_repo:
+            return await outbox_repo.earliest_pending(executor_id)
+
+
+    async def outbox_executors(self) -> List[int]:
+        async with self.outbox() as outbox_repo:
+            return await outbox_repo.pending_executors()
+
+
+    async def claim_outbox(self, row_id: int) -> bool:
+        return await self.write(lambda s: OutboxRepo(s).claim(row_id))
+
+
+    async def finish_outbox(self, row_id: int, status: str, error: str = None) -> None:
+        await self.write(lambda s: OutboxRepo(s).finish(row_id, status, error))
+
+
+    async def release_outbox(self, row_id: int, *, not_before: int, error: str = None) -> str:
+        return await self.write(lambda s: OutboxRepo(s).release(row_id, not_before=not_before, error=error))
+
+
+    async def recover_outbox(self) -> int:
+        return await self.write(lambda s: OutboxRepo(s).recover())
+
+
+    async def drop_outbox(self, executor_id: int) -> int:
+        return await self.write(lambda s: OutboxRepo(s).drop_executor(executor_id))
+
+    # ===========================
+    # CRM queue
+    # ===========================
+
+    async def enqueue_crm(self, user_id: int, *, name: str, phone: str, note: str, telegram: str) -> int:
+        return await self.write(lambda s: CrmQueueRepo(s).enqueue(user_id, name=name, phone=phone, note=note, telegram=telegram))
+
+
+    async def due_crm(self, *, limit: int = 20) -> List[CrmLead]:
+        async with self.crm_queue() as crm_repo:
+            return await crm_repo.due(limit=limit)
+
+
+    async def crm_delivered(self, lead_id: int, user_id: int, version: int = None) -> bool:
+        """
+        Заявка принята amoCRM — только теперь пользователь помечается users.crm.
+        False — пока шла отправка, данные заявки обновились: она осталась в очереди с новыми данными.
+        """
+        ok = await self.write(lambda s: CrmQueueRepo(s).mark_sent(lead_id, version))
+        await self.update_user_param(user_id, "crm", True)
+        return ok
+
+
+    async def crm_retry_later(self, lead_id: int, *, next_try_at: int, error: str = None, version: int = None) -> str:
+        return await self.write(lambda s: CrmQueueRepo(s).retry_later(lead_id, next_try_at=next_try_at, error=error,
+                                                                       version=version))
+
+    # ===========================
+    # Watermarks
+    # ===========================
+
+    async def get_watermark(self, name: str) -> int:
+        async with self.watermarks() as watermarks_repo:
+            return await watermarks_repo.get_value(name)
+
+
+    async def set_watermark(self, name: str, value: int) -> None:
+        await self.write(lambda s: WatermarksRepo(s).set_value(name, value))
@@ -0,0 +1,149 @@
+import time
+from typing import List, Optional
+from sqlalchemy import Column, Integer, String, Text, Index, select, update, func
+from .base import BaseRepo, Base
+
+
+# статусы заявки
+PENDING = "pending"   # ждёт доставки (или повтора)
+SENT    = "sent"      # amoCRM принял заявку
+FAILED  = "failed"    # исчерпаны попытки
+
+
+class CrmLead(Base):
+    """
+    Заявка для amoCRM. Пишется сразу из process_user_agreement,
+    доставляется фоновым воркером (services/crm_worker.py) с повторами.
+    """
+    __tablename__ = "crm_queue"
+
+    id          = Column(Integer, primary_key=True)
+    user_id     = Column(Integer, nullable=False)
+    name        = Column(String)
+    phone       = Column(String)
+    note        = Column(Text)
+    telegram    = Column(String)
+    status      = Column(String, nullable=False, default=PENDING)
+    attempts    = Column(Integer, default=0)
+    next_try_at = Column(Integer, default=0)
+    last_error  = Column(String)
+    version     = Column(Integer, default=0)   # растёт при каждом обновлении данных заявки (enqueue)
+    created_at  = Column(Integer, default=time.time)
+    updated_at  = Column(Integer, default=time.time)
+
+    __table_args__ = (
+        Index("ix_crm_queue_due", "next_try_at", "id", sqlite_where=(status == PENDING)),
+    )
+
+
+
+class CrmQueueRepo(BaseRepo):
+    def __init__(self, session):
+        super().__init__(session, CrmLead)
+
+    # ===========================
+    # Queries
+    # ===========================
+
+    async def due(self, *, now: int = None, limit: int = 20) -> List[CrmLead]:
+        """Заявки, которые пора (пере)отправить."""
+        now = int(time.time()) if now is None else now
+        m = self.model
+        stmt = (
+            select(m)
+            .where(m.status == PENDING, m.next_try_at <= now)
+            .order_by(m.next_try_at.asc(), m.id.asc())
+            .limit(limit)
+        )
+        res = await self.session.scalars(stmt)
+        return list(res.all())
+
+
+    async def counts(self) -> dict:
+        m = self.model
+        res = await self.session.execute(select(m.status, func.count()).group_by(m.status))
+        return {status: n for status, n in res.all()}
+
+    # ===========================
+    # CRUD
+    # ===========================
+
+    async def enqueue(self, user_id: int, *, name: str, phone: str, note: str, telegram: str) -> int:
+        """
+        Ставит заявку в очередь. Если у пользователя уже есть недоставленная —
+        обновляет её данные (и version), чтобы в CRM не ушло две заявки.
+        Если эту заявку прямо сейчас отправляет воркер, mark_sent/retry_later увидят новую version
+        и оставят её в очереди — обновлённые данные уйдут следующей попыткой.
+        """
+        m = self.model
+        now = int(time.time())
+        values = dict(name=name, phone=phone, note=note, telegram=telegram, updated_at=now)
+
+        row_id: Optional[int] = await self.session.scalar(
+            select(m.id).where(m.user_id == user_id, m.status == PENDING).limit(1)
+        )
+        if row_id is None:
+            obj = m(user_id=user_id, status=PENDING, attempts=0, next_try_at=0, created_at=now, **values)
+            self.session.add(obj)
+            await self.session.flush()
+            row_id = obj.id
+        else:
+            await self.session.execute(
+                update(m).where(m.id == row_id).values(next_try_at=0, version=func.coalesce(m.version, 0) + 1, **values)
+            )
+        await self.session.commit()
+        return row_id
+
+
+    async def mark_sent(self, lead_id: int, version: int = None) -> bool:
+        """
+        Заявка принята. version — значение, прочитанное воркером перед отправкой:
+        если данные с тех пор обновились, строка остаётся pending. Возвращает, помечена ли она sent.
+        """
+        m = self.model
+        now = int(time.time())
+        stmt = (
+            update(m)
+            .where(m.id == lead_id, func.coalesce(m.version, 0) == (version or 0))
+            .values(status=SENT, attempts=m.attempts + 1, last_error=None, updated_at=now)
+        )
+        res = await self.session.execute(stmt)
+        if res.rowcount == 0:
+            # ушла старая версия — новые данные отправим следующей попыткой
+            await self.session.execute(
+                update(m).where(m.id == lead_id).values(attempts=m.attempts + 1, updated_at=now)
+            )
+        await self.session.commit()
+        return res.rowcount > 0
+
+
+    async def retry_later(self, lead_id: int, *, next_try_at: int, error: str = None, max_attempts: int = 20,
+                          version: int = None) -> str:
+        """
+        Отложить повтор. После max_attempts попыток заявка помечается failed. Возвращает новый статус.
+        Если данные обновились после чтения (version не совпала), заявка остаётся pending с новым сроком из enqueue.
+        """
+        m = self.model
+        row = (await self.session.execute(
+            select(m.attempts, m.version).where(m.id == lead_id)
+        )).first()
+        if row is None:
+            return FAILED
+        attempts = (row.attempts or 0) + 1
+        if (row.version or 0) != (version or 0):
+            await self.session.execute(
+                update(m).where(m.id == lead_id).values(attempts=attempts, last_error=error, updated_at=int(time.time()))
+            )
+            await self.session.commit()
+            return PENDING
+
+        status = FAILED if attempts >= max_attempts else PENDING
+        stmt = (
+            update(m)
+            .where(m.id == lead_id, func.coalesce(m.version, 0) == (version or 0))
+            .values(status=status, attempts=attempts, next_try_at=int(next_try_at),
+                    last_error=error, updated_at=int(time.time()))
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+        return status
@@ -2,7 +2,7 @@ import asyncio
 import time
 from typing import Optional, List, Dict, Any
 from sqlalchemy import (
-    Column, Integer, String, Text, UniqueConstraint, select, update, delete
+    Column, Integer, Float, String, Text, UniqueConstraint, select, update, delete, func
 )
 from sqlalchemy.ext.asyncio import (
     create_async_engine, async_sessionmaker, AsyncSession
@@ -37,6 +37,22 @@ class Executor(Base):
     proxy_user     = Column(String, default=config('PROXY_USER'))
     proxy_pass     = Column(String, default=config('PROXY_PASS'))
 
+    # здоровье прокси (services/proxy_health.py), задержки в мс
+    proxy_state       = Column(String, default='ok')   # ok | slow | dead
+    proxy_fail_streak = Column(Integer, default=0)
+    proxy_connect_p50 = Column(Integer)
+    proxy_connect_p95 = Column(Integer)
+    proxy_read_p50    = Column(Integer)
+    proxy_read_p95    = Column(Integer)
+    proxy_checked_at  = Column(Integer)
+
+    # ограничения Telegram, переживают перезапуск (BasePool.restore_limits)
+    sleep_until   = Column(Integer)   # до какого момента (unix) исполнитель спит после FloodWait/PeerFlood
+    flood_backoff = Column(Integer)   # текущая ступень backoff после PeerFlood, сек
+    send_rate     = Column(Float)     # выученный темп отправок (SendPacer.rate), сообщений/сек
+    first_rate    = Column(Float)     # выученный темп первых контактов (SendPacer.first_rate)
+    flood_hours   = Column(Text)      # JSON {час: [штраф, когда обновлён]} — опасные часы (SendPacer)
+
     # Уникальность пары api_id + api_hash
     __table_args__ = (UniqueConstraint("api_id", "api_hash", name="ux_executors_api"),)
 
@@ -147,6 +163,20 @@ class ExecutorsRepo(BaseRepo):
         return await self.get_all(order_by="name", asc=True)
     
 
+    async def update_executor_fields(self, executor_id: int, **values) -> None:
+        """
+        Обновляет сразу несколько колонок исполнителя одним UPDATE.
+        """
+        if not values:
+            return
+        bad = [c for c in values if c not in self._columns]
+        if bad:
+            raise ValueError(f"Недопустимое имя колонки: {bad}")
+        stmt = update(self.model).where(self.model.executor_id == executor_id).values(**values)
+        await self.session.execute(stmt)
+        await self.session.commit()
+
+
     async def get_ids(self) -> List[int]:
         """
         озвращает список всех executor_id
@@ -159,29 +189,13 @@ class ExecutorsRepo(BaseRepo):
     # Users
     # ===========================
     
-    async def pick_least_loaded(self) -> Executor:
-        stmt = (
-            select(Executor)
-            .where(Executor.status == "active")
-            .order_by(Executor.active_users.asc(), Executor.executor_id.asc())
-            .limit(1)
+    async def allocation_rows(self) -> list[dict]:
+        """Нагрузка и здоровье всех исполнителей — для ExecutorAllocator."""
+        stmt = select(
+            Executor.executor_id, Executor.status, Executor.active_users, Executor.proxy_state,
         )
         res = await self.session.execute(stmt)
-        return res.scalars().first()
-
-    # безопасно увеличить active_users на 1 (с защитой от гонок)
-    async def try_inc_active(self, executor_id: int, expected_active: int) -> bool:
-        stmt = (
-            update(Executor)
-            .where(
-                (Executor.executor_id == executor_id) &
-                (Executor.active_users == expected_active)
-            )
-            .values(active_users=Executor.active_users + 1, users=Executor.users + 1)
-        )
-        res = await self.session.execute(stmt)
-        await self.session.commit()
-        return bool(res.rowcount and res.rowcount > 0)
+        return [dict(row._mapping) for row in res.all()]
 
     # симметричное уменьшение
     async def dec_active(self, executor_id: int) -> None:
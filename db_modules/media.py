@@ -0,0 +1,80 @@
+import time
+from sqlalchemy import Column, Integer, String, LargeBinary, UniqueConstraint, select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .base import BaseRepo, Base
+
+
+class Media(Base):
+    """
+    Ссылка на уже загруженный в Telegram документ.
+    Документ привязан к аккаунту исполнителя, поэтому ключ — (executor_id, path),
+    а file_hash позволяет заметить, что файл на диске поменялся.
+    """
+    __tablename__ = "media_cache"
+
+    id             = Column(Integer, primary_key=True)
+    executor_id    = Column(Integer, nullable=False)
+    path           = Column(String, nullable=False)
+    file_hash      = Column(String, nullable=False)
+    doc_id         = Column(Integer, nullable=False)
+    access_hash    = Column(Integer, nullable=False)
+    file_reference = Column(LargeBinary, nullable=False)
+    uploaded_at    = Column(Integer, default=time.time)
+
+    __table_args__ = (UniqueConstraint("executor_id", "path", name="ux_media_executor_path"),)
+
+
+
+class MediaRepo(BaseRepo):
+    def __init__(self, session):
+        super().__init__(session, Media)
+
+    # ===========================
+    # Queries
+    # ===========================
+
+    async def get_media(self, executor_id: int, path: str, file_hash: str) -> dict | None:
+        """
+        Возвращает сохранённую ссылку на документ или None,
+        если файл ещё не загружался этим исполнителем либо изменился.
+        """
+        stmt = select(self.model).where(
+            self.model.executor_id == executor_id,
+            self.model.path == path,
+            self.model.file_hash == file_hash,
+        ).limit(1)
+        obj = await self.session.scalar(stmt)
+        return self.to_dict(obj) if obj else None
+
+    # ===========================
+    # CRUD
+    # ===========================
+
+    async def save_media(self, executor_id: int, path: str, file_hash: str,
+                         doc_id: int, access_hash: int, file_reference: bytes) -> None:
+        """
+        Сохраняет (или перезаписывает) ссылку на документ для пары (executor_id, path).
+        """
+        values = dict(
+            executor_id=executor_id,
+            path=path,
+            file_hash=file_hash,
+            doc_id=doc_id,
+            access_hash=access_hash,
+            file_reference=file_reference,
+            uploaded_at=int(time.time()),
+        )
+        stmt = sqlite_insert(self.model).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.model.executor_id, self.model.path],
+            set_={k: stmt.excluded[k] for k in ("file_hash", "doc_id", "access_hash", "file_reference", "uploaded_at")},
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+
+
+    async def drop_media(self, executor_id: int, path: str) -> int:
+        stmt = delete(self.model).where(self.model.executor_id == executor_id, self.model.path == path)
+        res = await self.session.execute(stmt)
+        await self.session.commit()
+        return int(res.rowcount or 0)
@@ -0,0 +1,174 @@
+import time
+from typing import List, Optional
+from sqlalchemy import Column, Integer, String, Text, Index, select, update, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .base import BaseRepo, Base
+
+
+# статусы строки outbox
+PENDING = "pending"   # ждёт отправки
+SENDING = "sending"   # забрана дрейнером, идёт отправка
+SENT    = "sent"      # доставлена
+FAILED  = "failed"    # отправить не удалось (или исход неизвестен после падения)
+
+
+class Outbox(Base):
+    """
+    Отложенная отправка исполнителя (текст или документ).
+    Переживает перезапуск: дрейнер пула вычитывает строки после пробуждения исполнителя.
+    idem_key уникален — повторная постановка той же отправки не создаёт дубль.
+    """
+    __tablename__ = "outbox"
+
+    id          = Column(Integer, primary_key=True)
+    executor_id = Column(Integer, nullable=False)
+    user_id     = Column(Integer, nullable=False)
+    kind        = Column(String, nullable=False)          # text | document
+    payload     = Column(Text, nullable=False)            # JSON с аргументами отправки
+    priority    = Column(Integer, default=0)              # больше — раньше
+    attempts    = Column(Integer, default=0)
+    not_before  = Column(Integer, default=0)              # UNIX ts, раньше которого не отправлять
+    idem_key    = Column(String, nullable=False, unique=True)
+    status      = Column(String, nullable=False, default=PENDING)
+    last_error  = Column(String)
+    created_at  = Column(Integer, default=time.time)
+    updated_at  = Column(Integer, default=time.time)
+
+    __table_args__ = (
+        Index("ix_outbox_pending", "executor_id", "priority", "id", sqlite_where=(status == PENDING)),
+    )
+
+
+
+class OutboxRepo(BaseRepo):
+    def __init__(self, session):
+        super().__init__(session, Outbox)
+
+    # ===========================
+    # Queries
+    # ===========================
+
+    async def next_batch(self, executor_id: int, *, now: int = None, limit: int = 50) -> List[Outbox]:
+        """Готовые к отправке строки исполнителя: сначала приоритетные, внутри — по порядку постановки."""
+        now = int(time.time()) if now is None else now
+        m = self.model
+        stmt = (
+            select(m)
+            .where(m.executor_id == executor_id, m.status == PENDING, m.not_before <= now)
+            .order_by(m.priority.desc(), m.id.asc())
+            .limit(limit)
+        )
+        res = await self.session.scalars(stmt)
+        return list(res.all())
+
+
+    async def get_status(self, idem_key: str) -> Optional[str]:
+        return await self.session.scalar(select(self.model.status).where(self.model.idem_key == idem_key))
+
+
+    async def earliest_pending(self, executor_id: int) -> Optional[int]:
+        """Минимальный not_before среди неотправленных строк исполнителя (None — строк нет)."""
+        m = self.model
+        return await self.session.scalar(
+            select(func.min(m.not_before)).where(m.executor_id == executor_id, m.status == PENDING)
+        )
+
+
+    async def pending_executors(self) -> List[int]:
+        """Исполнители, у которых в outbox есть неотправленные строки."""
+        m = self.model
+        res = await self.session.scalars(select(m.executor_id).where(m.status == PENDING).distinct())
+        return list(res.all())
+
+
+    async def counts(self) -> dict:
+        m = self.model
+        res = await self.session.execute(select(m.status, func.count()).group_by(m.status))
+        return {status: n for status, n in res.all()}
+
+    # ===========================
+    # CRUD
+    # ===========================
+
+    async def enqueue(self, *, executor_id: int, user_id: int, kind: str, payload: str, idem_key: str,
+                      priority: int = 0, not_before: int = 0, status: str = PENDING) -> Optional[int]:
+        """
+        Ставит отправку в outbox и возвращает id строки.
+        None — строка с таким idem_key уже есть (отправка уже поставлена или ушла).
+        """
+        now = int(time.time())
+        stmt = sqlite_insert(self.model).values(
+            executor_id=executor_id, user_id=user_id, kind=kind, payload=payload, idem_key=idem_key,
+            priority=priority, not_before=int(not_before), status=status, attempts=int(status == SENDING),
+            created_at=now, updated_at=now,
+        ).on_conflict_do_nothing(index_elements=[self.model.idem_key]).returning(self.model.id)
+        row_id = await self.session.scalar(stmt)
+        await self.session.commit()
+        return row_id
+
+
+    async def claim(self, row_id: int) -> bool:
+        """pending -> sending. False — строку уже забрал кто-то другой."""
+        m = self.model
+        stmt = (
+            update(m)
+            .where(m.id == row_id, m.status == PENDING)
+            .values(status=SENDING, attempts=m.attempts + 1, updated_at=int(time.time()))
+        )
+        res = await self.session.execute(stmt)
+        await self.session.commit()
+        return bool(res.rowcount)
+
+
+    async def finish(self, row_id: int, status: str, error: str = None) -> None:
+        m = self.model
+        stmt = update(m).where(m.id == row_id).values(status=status, last_error=error, updated_at=int(time.time()))
+        await self.session.execute(stmt)
+        await self.session.commit()
+
+
+    async def release(self, row_id: int, *, not_before: int, error: str = None, max_attempts: int = 5) -> str:
+        """
+        Возвращает строку в очередь после неудачной попытки (исполнитель снова уснул).
+        После max_attempts попыток строка помечается failed. Возвращает новый статус.
+        """
+        m = self.model
+        attempts = await self.session.scalar(select(m.attempts).where(m.id == row_id))
+        status = FAILED if (attempts or 0) >= max_attempts else PENDING
+        stmt = (
+            update(m)
+            .where(m.id == row_id)
+            .values(status=status, not_before=int(not_before), last_error=error, updated_at=int(time.time()))
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+        return status
+
+
+    async def recover(self) -> int:
+        """
+        После падения строки в статусе sending имеют неизвестный исход.
+        Повторять их нельзя (сообщение могло уйти), поэтому помечаем failed.
+        """
+        m = self.model
+        stmt = (
+            update(m)
+            .where(m.status == SENDING)
+            .values(status=FAILED, last_error="interrupted", updated_at=int(time.time()))
+        )
+        res = await self.session.execute(stmt)
+        await self.session.commit()
+        return int(res.rowcount or 0)
+
+
+    async def drop_executor(self, executor_id: int) -> int:
+        """Снять неотправленные строки исполнителя (исполнитель удалён)."""
+        m = self.model
+        stmt = (
+            update(m)
+            .where(m.executor_id == executor_id, m.status == PENDING)
+            .values(status=FAILED, last_error="executor deleted", updated_at=int(time.time()))
+        )
+        res = await self.session.execute(stmt)
+        await self.session.commit()
+        return int(res.rowcount or 0)
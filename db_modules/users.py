@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, String, Text, Boolean, ForeignKey, UniqueConstraint, select, update, case, text
+    Column, Integer, String, Text, Boolean, ForeignKey, UniqueConstraint, Index, select, update, insert, case, text
 )
 from sqlalchemy.orm import declarative_base, relationship
 from pyrogram import Client, types
@@ -24,6 +24,11 @@ from sqlalchemy import select, update
 from .executors import Executor
 
 
+# Условие «можно приветствовать». Одна и та же строка и в частичном индексе, и в запросе,
+# иначе SQLite не поймёт, что индекс применим.
+GREET_CANDIDATE = "contact = 0 AND problem = 0 AND access_hash IS NOT NULL AND executor_id IS NOT NULL"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -42,8 +47,23 @@ class User(Base):
     last_message   = Column(Integer, default=time.time)
     problems_count = Column(Integer, default=0)
     problem        = Column(Boolean, default=False)
+    followup_at    = Column(Integer)                 # когда напомнить о себе, если клиент молчит
+    followup_first = Column(Boolean, default=False)  # слать напоминание как первый контакт (RAW API)
 
     executor = relationship("Executor", back_populates="users_list")
+
+    __table_args__ = (
+        Index(
+            "ix_users_greet_candidates",
+            "executor_id", "problems_count", "user_id",
+            sqlite_where=text(GREET_CANDIDATE),
+        ),
+        Index(
+            "ix_users_followup_due",
+            "followup_at", "user_id",
+            sqlite_where=text("followup_at IS NOT NULL"),
+        ),
+    )
     
     
 
@@ -79,6 +99,23 @@ class UsersRepo(BaseRepo):
             raise
     
     
+    async def add_users_bulk(self, rows: list[dict]) -> list[int]:
+        """
+        Вставка пачки пользователей одним INSERT OR IGNORE в одной транзакции.
+        Строки, упёршиеся в user_id или username, пропускаются.
+        Возвращает user_id реально вставленных.
+        """
+        if not rows:
+            return []
+        keys = sorted({k for row in rows for k in row if k in self._columns})
+        values = [{k: row.get(k) for k in keys} for row in rows]
+        stmt = insert(self.model).prefix_with("OR IGNORE").values(values).returning(self.model.user_id)
+        res = await self.session.execute(stmt)
+        inserted = [uid for (uid,) in res.all()]
+        await self.session.commit()
+        return inserted
+
+
     async def delete_user(self, *, user_id: int = None, username: str = None) -> bool:
         await self.unassign_executor(user_id)
         return (await self.delete_by_one_of(user_id=user_id, username=username)) > 0
@@ -135,6 +172,20 @@ class UsersRepo(BaseRepo):
     async def update_user_param(self, user_id: int, column: str, value):
         await self.update_param(key='user_id', target=user_id, column=column, value=value)
 
+
+    async def update_user_fields(self, user_id: int, **values) -> None:
+        """
+        Обновляет сразу несколько колонок пользователя одним UPDATE.
+        """
+        if not values:
+            return
+        bad = [c for c in values if c not in self._columns]
+        if bad:
+            raise ValueError(f"Недопустимое имя колонки: {bad}")
+        stmt = update(self.model).where(self.model.user_id == user_id).values(**values)
+        await self.session.execute(stmt)
+        await self.session.commit()
+
     
     async def rotate_user_down(self, user_id: int) -> None:
         stmt = (
@@ -183,105 +234,115 @@ class UsersRepo(BaseRepo):
 
     async def has_user(self, user_id: int) -> bool:
         return await self.exists_by(user_id=user_id)
+
+
+    async def get_access_hashes(self, user_ids: list[int]) -> dict[int, int]:
+        """
+        user_id -> access_hash одним запросом (только те, у кого он известен).
+        """
+        if not user_ids:
+            return {}
+        stmt = select(self.model.user_id, self.model.access_hash).where(
+            self.model.user_id.in_(user_ids), self.model.access_hash.is_not(None)
+        )
+        return {uid: ah for (uid, ah) in (await self.session.execute(stmt)).all()}
+
+
+    async def missing_ids(self, user_ids: list[int]) -> list[int]:
+        """
+        Те user_id из списка, которых ещё нет в users — одним запросом, в исходном порядке.
+        """
+        if not user_ids:
+            return []
+        stmt = select(self.model.user_id).where(self.model.user_id.in_(user_ids))
+        existing = set((await self.session.execute(stmt)).scalars().all())
+        return [uid for uid in dict.fromkeys(user_ids) if uid not in existing]
     
 
     async def get_user_param(self, user_id: int, column: str):
         return await self.get_param(key='user_id', target=user_id, column=column)
 
+
     
-    async def pop_users_to_greet(self, limit: int = 100) -> list[tuple[int, int, int]]:
+    async def pop_users_to_greet(self, limit: int = 100, per_executor: int = 1) -> list[tuple[int, int, int]]:
         """
         Возвращает до `limit` пользователей на приветствие в формате
-        (user_id, executor_id, access_hash), причём у каждого пользователя
-        уникальный executor_id (не более одного пользователя на одного исполнителя).
+        (user_id, executor_id, access_hash), не более `per_executor` на одного исполнителя.
+        Отбор делается внутри SQLite: на каждого исполнителя — короткий проход
+        по частичному индексу ix_users_greet_candidates с LIMIT.
+        Исполнители с медленным или мёртвым прокси (proxy_state != 'ok') пропускаются.
         """
+        stmt = text(f"""
+            SELECT u.user_id, u.executor_id, u.access_hash
+            FROM executors AS e
+            JOIN users AS u ON u.user_id IN (
+                SELECT user_id
+                FROM users INDEXED BY ix_users_greet_candidates
+                WHERE executor_id = e.executor_id AND {GREET_CANDIDATE}
+                ORDER BY problems_count, user_id
+                LIMIT :per_executor
+            )
+            WHERE COALESCE(e.proxy_state, 'ok') = 'ok'
+            ORDER BY u.problems_count, u.user_id
+            LIMIT :limit
+        """)
+        res = await self.session.execute(stmt, {"per_executor": per_executor, "limit": limit})
+        return [(uid, eid, ah) for (uid, eid, ah) in res.all()]
+
+
+    async def get_inactive_users(self, *, due_before: int = None, limit: int = 100,
+                                 after: tuple[int, int] = (0, 0)) -> list[User]:
+        """
+        Возвращает страницу пользователей, которым пора напомнить о себе
+        (followup_at <= due_before), по возрастанию (followup_at, user_id).
+        after — ключ последней строки предыдущей страницы.
+        """
+        due_before = int(time.time()) if due_before is None else int(due_before)
+        after_ts, after_uid = after
         stmt = (
-            select(self.model.user_id, self.model.executor_id, self.model.access_hash)
+            select(self.model)
             .where(
-                self.model.contact.is_(False),
-                self.model.problem.is_(False),
-                self.model.access_hash.is_not(None),
-                self.model.executor_id.is_not(None),
+                self.model.followup_at.is_not(None),
+                self.model.followup_at <= due_before,
+                (self.model.followup_at > after_ts)
+                | ((self.model.followup_at == after_ts) & (self.model.user_id > after_uid)),
+                self.model.banned.is_(False),
             )
-            .order_by(self.model.problems_count.asc(), self.model.user_id.asc())
+            .order_by(self.model.followup_at.asc(), self.model.user_id.asc())
+            .limit(limit)
         )
         res = await self.session.execute(stmt)
-
-        picked: list[tuple[int, int, int]] = []
-        seen_execs: set[int] = set()
-
-        for uid, eid, ah in res.all():
-            if eid in seen_execs:
-                continue
-            picked.append((uid, eid, ah))
-            seen_execs.add(eid)
-            if len(picked) >= limit:
-                break
-
-        return picked
+        return res.scalars().all()
 
 
-    async def get_inactive_users(self, interval_seconds: int) -> list[User]:
+    async def claim_followup(self, user_id: int, due_at: int) -> bool:
         """
-        Возвращает список пользователей, у которых last_message старше заданного интервала
+        Снимает напоминание, если оно всё ещё назначено на due_at.
+        False — его уже отменили или перенесли (клиент ответил).
         """
-        cutoff = int(time.time()) - interval_seconds
-        stmt = select(self.model).where(
-            (self.model.last_message.is_(None)) | (self.model.last_message < cutoff)
+        stmt = (
+            update(self.model)
+            .where(self.model.user_id == user_id, self.model.followup_at == due_at)
+            .values(followup_at=None)
         )
         res = await self.session.execute(stmt)
-        return res.scalars().all()
+        await self.session.commit()
+        return bool(res.rowcount)
 
     # ===========================
     # Executors
     # ===========================
 
-    async def assign_executor(self, user_id: int, executor_id: int = None, max_retries: int = 5, sleep: float = 0.5) -> int:
+    async def set_executor(self, user_id: int, executor_id: int) -> bool:
         """
-        Назначает пользователю исполнителя с минимальным active_users, если не указан конкретный.
-        Возвращает executor_id.
-        Гонку за «самого свободного» решаем оптимистически (CAS через WHERE active_users=expected).
+        Закрепляет за пользователем исполнителя (выбирает его ExecutorAllocator).
+        False — такого пользователя нет.
         """
-        user = await self.session.get(self.model, user_id)
-        if not user:
-            print(f"Пользователь {user_id} не найден")
-            return None
-
-        # Явное назначение конкретного исполнителя
-        if executor_id is not None:
-            if not await self.execs.has_executor(executor_id=executor_id):
-                print(f"Исполнитель с id={executor_id} не найден")
-                return None
-
-            # «Резервируем» исполнителя через CAS
-            expected = await self.session.scalar(
-                select(Executor.active_users).where(Executor.executor_id == executor_id)
-            )
-            if expected is None or not await self.execs.try_inc_active(executor_id, expected_active=expected):
-                print("Исполнитель уже занят (гонка).")
-                return None
-
-            # Назначаем через связь (ORM сам проставит FK)
-            user.executor_id = executor_id
-            return executor_id
-
-        # Автовыбор наименее загруженного (CAS-петля)
-        for _ in range(max_retries):
-            ex = await self.execs.pick_least_loaded()
-            if not ex:
-                print("Нет доступных исполнителей со статусом 'active'")
-                return None
-
-            expected = ex.active_users
-            if not await self.execs.try_inc_active(ex.executor_id, expected_active=expected):
-                await asyncio.sleep(sleep)
-                continue
-
-            user.executor_id = ex.executor_id
-            return ex.executor_id
-
-        print("Не удалось назначить исполнителя из-за гонки.")
-        return None
+        res = await self.session.execute(
+            update(self.model).where(self.model.user_id == user_id).values(executor_id=executor_id)
+        )
+        await self.session.commit()
+        return bool(res.rowcount)
 
 
     async def unassign_executor(self, user_id: int) -> None:
@@ -0,0 +1,37 @@
+import time
+from sqlalchemy import Column, Integer, String, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .base import BaseRepo, Base
+
+
+class Watermark(Base):
+    """
+    Отметка инкрементальной синхронизации: до какого rowid внешней таблицы всё уже забрано.
+    name — источник и таблица, например "/path/users.db#users".
+    """
+    __tablename__ = "watermarks"
+
+    name       = Column(String, primary_key=True)
+    value      = Column(Integer, nullable=False, default=0)
+    updated_at = Column(Integer, default=time.time)
+
+
+
+class WatermarksRepo(BaseRepo):
+    def __init__(self, session):
+        super().__init__(session, Watermark)
+
+
+    async def get_value(self, name: str) -> int:
+        value = await self.session.scalar(select(self.model.value).where(self.model.name == name))
+        return int(value or 0)
+
+
+    async def set_value(self, name: str, value: int) -> None:
+        stmt = sqlite_insert(self.model).values(name=name, value=int(value), updated_at=int(time.time()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.model.name],
+            set_={"value": stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
@@ -0,0 +1,159 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+from sqlalchemy import update, bindparam
+from .users import User
+from .executors import Executor
+
+
+# (table, id, column)
+Key = Tuple[str, int, str]
+
+# таблица -> (модель, первичный ключ)
+_TABLES = {
+    "users": (User, "user_id"),
+    "executors": (Executor, "executor_id"),
+}
+
+
+class WriteBehindBuffer:
+    """
+    Буфер отложенной записи отметок времени (last_message и т.п.).
+    Хранит только последнее значение на (table, id, column) и сбрасывает
+    всё накопленное одной транзакцией — по таймеру или при переполнении.
+    Пока значение не записано, его видно через get()/overlay().
+    """
+
+    def __init__(self, db, *, interval: float = 2.0, max_pending: int = 500):
+        self.db = db
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self._pending: Dict[Key, int] = {}
+        self._inflight: Dict[Key, int] = {}   # то, что сейчас пишется в БД
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # счётчики
+        self.puts = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+
+    def put(self, table: str, row_id: int, column: str, value: int) -> None:
+        model, _ = _TABLES[table]
+        if column not in model.__table__.columns.keys():
+            raise ValueError(f"Недопустимое имя колонки: {column}")
+
+        key = (table, row_id, column)
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = value
+        self.puts += 1
+
+        self._ensure_task()
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+
+    def get(self, table: str, row_id: int, column: str) -> Optional[int]:
+        """Ещё не записанное значение или None."""
+        key = (table, row_id, column)
+        if key in self._pending:
+            return self._pending[key]
+        return self._inflight.get(key)
+
+
+    def overlay(self, table: str, row: dict) -> dict:
+        """Накладывает незаписанные значения на строку из БД (read-your-writes)."""
+        if not row or not (self._pending or self._inflight):
+            return row
+        _, pk = _TABLES[table]
+        row_id = row.get(pk)
+        for column in row:
+            value = self.get(table, row_id, column)
+            if value is not None:
+                row[column] = value
+        return row
+
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "puts": self.puts,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[DB] [write-behind] flush failed: {e}")
+
+
+    async def flush(self) -> int:
+        """
+        Пишет всё накопленное одной транзакцией: один executemany на пару (table, column).
+        При ошибке значения возвращаются в буфер (не затирая более свежие).
+        """
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+
+            grouped: Dict[Tuple[str, str], list] = {}
+            for (table, row_id, column), value in batch.items():
+                grouped.setdefault((table, column), []).append({"b_id": row_id, "b_value": value})
+
+            async def write(s):
+                for (table, column), params in grouped.items():
+                    model, pk = _TABLES[table]
+                    t = model.__table__
+                    stmt = (
+                        update(t)
+                        .where(t.c[pk] == bindparam("b_id"))
+                        .values({column: bindparam("b_value")})
+                    )
+                    await s.execute(stmt, params)
+                await s.commit()
+
+            try:
+                await self.db.write(write)
+            except BaseException:
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+                raise
+            finally:
+                self._inflight = {}
+
+            self.flushes += 1
+            self.rows_written += len(batch)
+            return len(batch)
+
+
+    async def close(self) -> None:
+        """Останавливает фоновый сброс и дописывает остаток."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
@@ -0,0 +1,187 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+
+# Прагмы для всех соединений в режиме одного писателя
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA foreign_keys=OFF",
+)
+
+
+def tune_sqlite(engine: AsyncEngine, *, writer: bool = False, read_only: bool = False) -> None:
+    """
+    Навешивает на движок WAL и прочие прагмы.
+    Для писателя включает ручное управление транзакциями (BEGIN IMMEDIATE),
+    без которого у pysqlite/aiosqlite не работают SAVEPOINT.
+    read_only — соединения пула чтения: PRAGMA query_only, любая запись мимо SQLiteWriter
+    падает сразу («attempt to write a readonly database»), а не конкурирует с писателем за блокировку.
+    """
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        if writer:
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in _PRAGMAS:
+            cursor.execute(pragma)
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    if writer:
+        @event.listens_for(engine.sync_engine, "begin")
+        def _on_begin(conn):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+class _BatchSession(AsyncSession):
+    """
+    Сессия писателя. commit() внутри репозиториев превращается в flush,
+    rollback() откатывает только текущую операцию (её SAVEPOINT).
+    Настоящий COMMIT делает SQLiteWriter один раз на пачку.
+    """
+    _op = None
+
+    async def commit(self) -> None:
+        await self.flush()
+
+    async def rollback(self) -> None:
+        if self._op is not None and self._op.is_active:
+            await self._op.rollback()
+        self._op = await self.begin_nested()
+
+
+WriteOp = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class SQLiteWriter:
+    """
+    Единственный писатель в SQLite.
+    Операции записи приходят через очередь, собираются в пачку (до max_batch штук
+    или пока не истечёт max_delay с момента первой) и коммитятся одной транзакцией.
+    Каждая операция идёт в своём SAVEPOINT: ошибка одной не откатывает остальные.
+    """
+
+    def __init__(self, engine: AsyncEngine, *, max_batch: int = 200, max_delay: float = 0.005):
+        self.Session = async_sessionmaker(engine, expire_on_commit=False, class_=_BatchSession)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # счётчики
+        self.ops = 0
+        self.failed = 0
+        self.commits = 0
+        self.largest_batch = 0
+
+
+    async def submit(self, fn: WriteOp) -> Any:
+        """Поставить операцию в очередь и дождаться её коммита."""
+        fut = asyncio.get_running_loop().create_future()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._queue.put_nowait((fn, fut))
+        return await fut
+
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "ops": self.ops,
+            "failed": self.failed,
+            "commits": self.commits,
+            "largest_batch": self.largest_batch,
+        }
+
+
+    async def _collect(self) -> List[Tuple[WriteOp, asyncio.Future]]:
+        batch = []
+        loop = asyncio.get_running_loop()
+        item = await self._queue.get()
+        deadline = loop.time() + self.max_delay
+        while True:
+            if item[0] is None:          # сигнал остановки от close()
+                self._closing = True
+                break
+            batch.append(item)
+            if len(batch) >= self.max_batch:
+                break
+            try:
+                item = self._queue.get_nowait()
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+
+    async def _run(self) -> None:
+        self._closing = False
+        while not self._closing:
+            batch = await self._collect()
+            if not batch:
+                continue
+            try:
+                await self._commit_batch(batch)
+            except Exception as e:
+                print(f"[DB] [writer] batch failed: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+
+    async def _commit_batch(self, batch: List[Tuple[WriteOp, asyncio.Future]]) -> None:
+        results = []
+        async with self.Session() as s:
+            for fn, fut in batch:
+                if fut.done():
+                    continue
+                s._op = await s.begin_nested()
+                try:
+                    res = await fn(s)
+                    if s._op.is_active:
+                        await s._op.commit()
+                    results.append((fut, res, None))
+                except Exception as e:
+                    if s._op.is_active:
+                        await s._op.rollback()
+                    results.append((fut, None, e))
+            s._op = None
+            await AsyncSession.commit(s)
+
+        self.commits += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for fut, res, exc in results:
+            self.ops += 1
+            if fut.done():
+                continue
+            if exc is not None:
+                self.failed += 1
+                fut.set_exception(exc)
+            else:
+                fut.set_result(res)
+
+
+    async def close(self) -> None:
+        """Дописывает уже поставленные операции и останавливает писателя."""
+        if self._task is None or self._task.done():
+            return
+        self._queue.put_nowait((None, None))
+        await self._task
+        self._task = None
@@ -9,6 +9,10 @@ from telegram.botpool import BotPool
 from telegram.logic import build_logic
 from services.parser import group_parser
 from services.greeter import periodic_greeting
+from services.followup import inactivity_sweeper
+from services.crm_worker import crm_delivery_worker
+from services.proxy_health import proxy_health_loop
+from crm import CRMClient
 from assistant.gpt import Assistant
 import settings
 import state
@@ -29,7 +33,7 @@ async def main():
 
     settings.init_config("config.json")
 
-    db = DatabaseController("sqlite+aiosqlite:///data/new.db")
+    db = DatabaseController("sqlite+aiosqlite:///data/new.db", single_writer=True)
     await db.init_db()
 
     assistant = Assistant('gpt-4.1', db)
@@ -40,6 +44,13 @@ async def main():
 
     tasks = []
 
+    crm_client = CRMClient()
+    crm_task = asyncio.create_task(crm_delivery_worker(db, crm_client), name="crm_delivery")
+    tasks.append(crm_task)
+
+    proxy_task = asyncio.create_task(proxy_health_loop(db, pool), name="proxy_health")
+    tasks.append(proxy_task)
+
     external_db_path = "/home/appuser/parser/data/users.db"
     parser_task = asyncio.create_task(group_parser(db, pool, external_db_path=external_db_path), name="group_parser")
     tasks.append(parser_task)
@@ -49,6 +60,9 @@ async def main():
     greeter_task = asyncio.create_task(periodic_greeting(db, pool, handlers['handle_assistant_response']), name="periodic_greeting")
     tasks.append(greeter_task)
 
+    followup_task = asyncio.create_task(inactivity_sweeper(db, pool, handlers['handle_assistant_response']), name="inactivity_sweeper")
+    tasks.append(followup_task)
+
     try:
         await pool.activate()
     finally:
@@ -57,6 +71,9 @@ async def main():
         with suppress(Exception):
             await pool.shutdown()
 
+        with suppress(Exception):
+            await crm_client.aclose()
+
         with suppress(Exception):
             await db.engine.dispose()
 
@@ -1,14 +1,28 @@
 """
-Универсальная функция proxy_request(...) для выполнения запроса через HTTP-прокси.
-Зависимости: pip install requests
+Универсальная функция proxy_request(...) для выполнения запроса через HTTP-прокси
+и асинхронный AsyncProxyProber для регулярной проверки прокси исполнителей.
+Зависимости: pip install requests httpx
 """
 
+import asyncio
 import requests
+import httpx
 import base64
 import time
 import urllib.parse
+from contextlib import suppress
 from typing import Optional, Tuple, Dict, Any
 
+
+def build_proxy_url(proxy_hostport: str, user: Optional[str] = None, password: Optional[str] = None,
+                    use_header_auth: bool = False) -> str:
+    """proxy_url для клиента (URL-escape user/password, когда передаём их в URL)."""
+    if user and password and not use_header_auth:
+        u = urllib.parse.quote(user, safe='')
+        p = urllib.parse.quote(password, safe='')
+        return f"http://{u}:{p}@{proxy_hostport}"
+    return f"http://{proxy_hostport}"
+
 def proxy_request(
     method: str,
     url: str,
@@ -43,13 +57,7 @@ def proxy_request(
     # пользовательские заголовки перекроют дефолтный UA
     sess.headers.update(headers)
 
-    # формируем proxy_url (URL-escape user/password когда используем их в URL)
-    if user and password and not use_header_auth:
-        u = urllib.parse.quote(user, safe='')
-        p = urllib.parse.quote(password, safe='')
-        proxy_url = f"http://{u}:{p}@{proxy_hostport}"
-    else:
-        proxy_url = f"http://{proxy_hostport}"
+    proxy_url = build_proxy_url(proxy_hostport, user, password, use_header_auth)
 
     proxies = {"http": proxy_url, "https": proxy_url}
 
@@ -88,6 +96,74 @@ def proxy_request(
     return False, last_exc
 
 
+class AsyncProxyProber:
+    """
+    Асинхронная проверка прокси: на каждый прокси — свой httpx.AsyncClient,
+    который живёт между проверками (соединения переиспользуются).
+    probe() меряет отдельно TCP-подключение к прокси и полный запрос через него.
+    """
+
+    def __init__(self, url: str = "http://checkip.amazonaws.com/", timeout: Tuple[float, float] = (5.0, 8.0)):
+        self.url = url
+        self.connect_timeout, self.read_timeout = timeout
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+
+    def _client_for(self, proxy_url: str) -> httpx.AsyncClient:
+        cli = self._clients.get(proxy_url)
+        if cli is None:
+            cli = httpx.AsyncClient(
+                proxy=proxy_url,
+                trust_env=False,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=1),
+                headers={"User-Agent": "proxy-request/1.0"},
+            )
+            self._clients[proxy_url] = cli
+        return cli
+
+
+    async def probe(self, proxy_hostport: str, user: Optional[str] = None,
+                    password: Optional[str] = None) -> Tuple[bool, Optional[float], Optional[float], Optional[str]]:
+        """
+        Возвращает (ok, connect_s, read_s, error):
+        connect_s — TCP-подключение к самому прокси, read_s — запрос через прокси до конца ответа.
+        """
+        host, _, port = proxy_hostport.rpartition(":")
+        t0 = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), self.connect_timeout)
+        except Exception as e:
+            return False, None, None, f"connect: {type(e).__name__}: {e}"
+        connect_s = time.perf_counter() - t0
+        writer.close()
+        with suppress(Exception):
+            await writer.wait_closed()
+
+        cli = self._client_for(build_proxy_url(proxy_hostport, user, password))
+        t0 = time.perf_counter()
+        try:
+            resp = await cli.get(self.url)
+        except Exception as e:
+            return False, connect_s, None, f"request: {type(e).__name__}: {e}"
+        read_s = time.perf_counter() - t0
+        if resp.status_code >= 400:
+            return False, connect_s, read_s, f"HTTP {resp.status_code}"
+        return True, connect_s, read_s, None
+
+
+    async def forget(self, proxy_hostport: str, user: Optional[str] = None, password: Optional[str] = None) -> None:
+        cli = self._clients.pop(build_proxy_url(proxy_hostport, user, password), None)
+        if cli is not None:
+            await cli.aclose()
+
+
+    async def aclose(self) -> None:
+        for cli in self._clients.values():
+            await cli.aclose()
+        self._clients.clear()
+
+
 def check(port):
     ok, res = proxy_request(
         "GET",
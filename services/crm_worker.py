@@ -0,0 +1,64 @@
+from __future__ import annotations
+import asyncio
+import random
+import time
+
+from state import stop_crm
+from crm import CRMClient
+from db_modules.controller import DatabaseController
+from db_modules.crm_queue import CrmLead, FAILED
+
+
+def retry_delay(attempts: int, *, base: float = 30.0, cap: float = 3600.0) -> float:
+    """Экспоненциальная пауза перед повтором с разбросом ±20%."""
+    delay = min(cap, base * (2 ** max(0, attempts)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def _deliver_one(db: DatabaseController, client: CRMClient, lead: CrmLead) -> bool:
+    ok, error = await client.send(name=lead.name, phone=lead.phone, note=lead.note, telegram=lead.telegram)
+    if ok:
+        if await db.crm_delivered(lead.id, lead.user_id, lead.version):
+            print(f"[CRM] Заявка user {lead.user_id} принята")
+        else:
+            print(f"[CRM] Заявка user {lead.user_id} принята, но данные обновились во время отправки — отправим ещё раз")
+        return True
+
+    next_try_at = int(time.time() + retry_delay(lead.attempts or 0))
+    status = await db.crm_retry_later(lead.id, next_try_at=next_try_at, error=error, version=lead.version)
+    if status == FAILED:
+        print(f"[CRM] Заявка user {lead.user_id} не доставлена, попытки исчерпаны: {error}")
+    else:
+        print(f"[CRM] Заявка user {lead.user_id} не принята ({error}), повтор через {next_try_at - int(time.time())} сек")
+    return False
+
+
+async def deliver_due_leads(db: DatabaseController, client: CRMClient, *, batch: int = 20, concurrency: int = 4) -> int:
+    """Один проход по очереди: отправляет созревшие заявки. Возвращает число принятых."""
+    leads = await db.due_crm(limit=batch)
+    if not leads:
+        return 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(lead: CrmLead) -> bool:
+        async with sem:
+            return await _deliver_one(db, client, lead)
+
+    return sum(await asyncio.gather(*(run(lead) for lead in leads)))
+
+
+async def crm_delivery_worker(db: DatabaseController, client: CRMClient, *, period: float = 5.0,
+                              batch: int = 20, concurrency: int = 4) -> None:
+    """
+    Фоновая доставка заявок в amoCRM.
+    Очередь лежит в таблице crm_queue, поэтому недоставленное переживает перезапуск.
+    """
+    print(f"[CRM] Старт доставки заявок")
+
+    while not stop_crm.is_set():
+        try:
+            await deliver_due_leads(db, client, batch=batch, concurrency=concurrency)
+        except Exception as e:
+            print(f"[CRM] delivery error: {e}")
+
+        await asyncio.sleep(period)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+import asyncio
+import time
+
+from state import stop_followup
+from telegram.botpool import BotPool
+from db_modules.controller import DatabaseController
+from db_modules.users import User
+from assistant.gpt import FOLLOWUP, AdmissionRejected
+
+
+FOLLOWUP_PROMPT = "SYSTEM: Клиент долго не отвечает, напиши ему еще раз"
+RETRY_DELAY = 300   # через сколько секунд повторить напоминание, которое не удалось отправить сейчас
+
+
+async def _retry_later(db: DatabaseController, row: User) -> None:
+    """Вернуть забранное напоминание: повторим через RETRY_DELAY."""
+    await db.schedule_followup(row.user_id, int(time.time()) + RETRY_DELAY, first=bool(row.followup_first))
+
+
+async def _push_one(db: DatabaseController, pool: BotPool, handle_assistant_response, row: User) -> None:
+    user_id, executor_id = row.user_id, row.executor_id
+
+    # забираем напоминание себе; если клиент успел ответить — его уже сняли
+    if not await db.claim_followup(user_id, row.followup_at):
+        return
+    if executor_id is None:
+        return
+
+    bot = await pool.ensure_client(executor_id)
+    if not bot:
+        print(f"[FOLLOWUP] Не удалось подключить executor {executor_id}, напоминание user {user_id} перенесено")
+        await _retry_later(db, row)
+        return
+
+    user = await pool.connect_user(bot, user_id, row.access_hash, executor_id=executor_id)
+    if user is None:
+        print(f"[FOLLOWUP] connect_user вернул None для user {user_id}, напоминание перенесено")
+        await _retry_later(db, row)
+        return
+
+    try:
+        # одно напоминание (user_id, followup_at) уходит не больше одного раза
+        await handle_assistant_response(bot, user, FOLLOWUP_PROMPT, wait_after=False, first=bool(row.followup_first),
+                                        priority=FOLLOWUP, key=f"followup:{user_id}:{row.followup_at}")
+    except AdmissionRejected as e:
+        await _retry_later(db, row)
+        print(f"[FOLLOWUP] Напоминание user {user_id} перенесено: {e}")
+    except Exception as e:
+        print(f"[FOLLOWUP] Ошибка напоминания user {user_id}: {e}")
+
+
+async def sweep_due_followups(db: DatabaseController, pool: BotPool, handle_assistant_response, *,
+                              page_size: int = 100, concurrency: int = 10) -> int:
+    """
+    Один проход: постранично выбирает напоминания со сроком <= сейчас
+    и рассылает их, не больше `concurrency` одновременно.
+    Возвращает количество обработанных строк.
+    """
+    now = int(time.time())
+    sem = asyncio.Semaphore(concurrency)
+    after = (0, 0)
+    total = 0
+
+    async def run(row: User):
+        async with sem:
+            await _push_one(db, pool, handle_assistant_response, row)
+
+    while not stop_followup.is_set():
+        rows = await db.get_due_followups(due_before=now, limit=page_size, after=after)
+        if not rows:
+            break
+        await asyncio.gather(*(run(r) for r in rows))
+        total += len(rows)
+        after = (rows[-1].followup_at, rows[-1].user_id)
+
+    return total
+
+
+async def inactivity_sweeper(db: DatabaseController, pool: BotPool, handle_assistant_response, *,
+                             period: float = 30.0, page_size: int = 100, concurrency: int = 10) -> None:
+    """
+    Цикл напоминаний молчащим клиентам.
+    Срок хранится в users.followup_at, поэтому переживает перезапуск,
+    а память не растёт с числом ожидающих диалогов.
+    """
+    print(f"[FOLLOWUP] Старт сервиса напоминаний")
+
+    while not stop_followup.is_set():
+        try:
+            n = await sweep_due_followups(db, pool, handle_assistant_response,
+                                          page_size=page_size, concurrency=concurrency)
+            if n:
+                print(f"[FOLLOWUP] Отправлено напоминаний: {n}")
+        except Exception as e:
+            print(f"[FOLLOWUP] sweep error: {e}")
+
+        await asyncio.sleep(period)
+
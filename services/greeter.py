@@ -11,6 +11,7 @@ from settings import get
 from state import stop_greeter
 from telegram.botpool import BotPool
 from db_modules.controller import DatabaseController
+from assistant.gpt import GREETING, AdmissionRejected
 from .start_messages import generate_intro_message
 
 
@@ -82,10 +83,10 @@ async def _greet_one_user(db: DatabaseController, pool: BotPool, handle_assistan
         print(f"[GREETER] Не удалось подключить executor {executor_id}")
         return
     
-    me = await bot.get_me()
-    name = me.username
+    me = await pool.identity(bot)
+    name = me.username if me else None
 
-    user = await pool.connect_user(bot, user_id, access_hash)
+    user = await pool.connect_user(bot, user_id, access_hash, executor_id=executor_id)
 
     if user is None:
         await db.rotate_user_down(user_id)
@@ -94,12 +95,18 @@ async def _greet_one_user(db: DatabaseController, pool: BotPool, handle_assistan
 
     info = await db.get_user_param(user_id, "info") or ""
 
-    ok = await handle_assistant_response(
-        bot,
-        user,
-        f"CLIENT_INFO: {info}\n\nSTART_MESSAGE: {generate_intro_message()}",
-        first=get("SECOND_GREET"),
-    )
+    try:
+        ok = await handle_assistant_response(
+            bot,
+            user,
+            f"CLIENT_INFO: {info}\n\nSTART_MESSAGE: {generate_intro_message()}",
+            first=get("SECOND_GREET"),
+            priority=GREETING,
+        )
+    except AdmissionRejected as e:
+        # модель занята живыми диалогами — пользователь остаётся в очереди на следующий круг
+        print(f"[GREETER] Приветствие user {user_id} отложено: {e}")
+        return
     if ok:
         await db.update_user_param(user_id, "contact", True)
         await db.user_timestamp(user_id)
@@ -148,6 +155,12 @@ async def periodic_greeting(db: DatabaseController, pool: BotPool, handle_assist
             await asyncio.sleep(IDLE_SLEEP)
             continue
 
+        # пользователи всей пачки — пакетными GetUsers заранее, сами приветствия берут их из кеша пула
+        try:
+            await pool.resolve_users((executor_id, user_id) for user_id, executor_id, _ in batch)
+        except Exception as e:
+            print(f"[GREETER] resolve_users error: {e}")
+
         offsets = _build_schedule(len(batch), WINDOW_SEC, min_gap=MIN_GAP)
         start = time.monotonic()
 
@@ -0,0 +1,204 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from pyrogram.errors import FloodWait
+
+from settings import get
+from telegram.botpool import BotPool
+from telegram.ratelimit import TokenBucket
+
+
+@dataclass
+class Lead:
+    """Новый пользователь, которому нужно добыть access_hash, username и телефон."""
+    user_id: int
+    username: Optional[str] = None
+    phone: Optional[str] = None
+    info: Optional[str] = None
+    link: Optional[str] = None
+
+
+class OnboardingPipeline:
+    """
+    Параллельное дополнение новых пользователей данными из Telegram.
+    Исполнитель назначается сразу в submit, дальше лид попадает в очередь своего исполнителя.
+    У каждого исполнителя свои воркеры (concurrency штук) и своё ведро токенов (rate лидов в секунду),
+    так что исполнители работают одновременно, и ни один не превышает свой лимит.
+    Очереди ограничены (queue_size): если исполнитель не успевает, submit ждёт.
+    Воркер берёт из очереди сразу пачку (до batch_size) и разбирает ссылки пачки одним проходом
+    DiscussionResolver: лиды из одного обсуждения стоят один GetMessages.
+    """
+
+    def __init__(self, pool: BotPool, *, concurrency: int = None, rate: float = None,
+                 burst: float = 3, queue_size: int = 200, batch_size: int = 50, window: float = 300.0):
+        self.pool = pool
+        self.concurrency = concurrency or int(get("ONBOARD_CONCURRENCY") or 2)
+        self.rate = rate or float(get("ONBOARD_RATE") or 0.5)
+        self.burst = burst
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.window = window
+        self.sleep_poll = 5.0   # как часто проверять, проснулся ли исполнитель
+
+        self._queues: dict[int, asyncio.Queue] = {}
+        self._workers: dict[int, list[asyncio.Task]] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+        self._in_flight: dict[int, int] = {}
+
+        self._finished: deque[float] = deque()   # моменты завершения лидов за последние window секунд
+        self.resolved = 0      # access_hash получен
+        self.unresolved = 0    # записали, что смогли, но access_hash нет
+        self.failed = 0        # исключение в воркере
+        self.unassigned = 0    # не нашлось исполнителя
+
+
+    def _ensure_workers(self, executor_id: int) -> asyncio.Queue:
+        queue = self._queues.get(executor_id)
+        if queue is None:
+            queue = self._queues[executor_id] = asyncio.Queue(maxsize=self.queue_size)
+            self._buckets[executor_id] = TokenBucket(self.rate, self.burst)
+            self._in_flight[executor_id] = 0
+            self._workers[executor_id] = [
+                asyncio.create_task(self._worker(executor_id, queue), name=f"onboard_{executor_id}_{i}")
+                for i in range(self.concurrency)
+            ]
+        return queue
+
+
+    async def submit(self, lead: Lead) -> Optional[int]:
+        """Назначить исполнителя и поставить лида в его очередь. Возвращает executor_id."""
+        executor_id = await self.pool.db.assign_executor(lead.user_id)
+        if executor_id is None:
+            self.unassigned += 1
+            return None
+        await self._ensure_workers(executor_id).put(lead)
+        return executor_id
+
+
+    def _take_batch(self, first: Lead, queue: asyncio.Queue) -> list[Lead]:
+        """Первый лид и всё, что уже лежит в очереди, — до batch_size штук."""
+        batch = [first]
+        while len(batch) < self.batch_size and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+
+    async def _prefetch_hashes(self, executor_id: int, batch: list[Lead]) -> dict[int, int]:
+        """
+        access_hash по ссылкам всей пачки через DiscussionResolver исполнителя:
+        ссылки из одного обсуждения уходят одним GetMessages. user_id -> access_hash.
+        FloodWait усыпляет исполнителя, пачка остаётся без хэшей из ссылок.
+        """
+        links = [lead.link for lead in batch if lead.link]
+        if not links:
+            return {}
+        bot = await self.pool.ensure_client(executor_id)
+        if not bot:
+            return {}
+        await self._buckets[executor_id].acquire()
+        try:
+            refs = await self.pool.discussion(bot).resolve_many(links)
+        except FloodWait as e:
+            await self.pool.sleep_executor(executor_id, float(e.value))
+            print(f"[ONBOARD] [executor {executor_id}] FloodWait на разборе ссылок: ждём {e.value} сек")
+            return {}
+        return {
+            lead.user_id: refs[lead.link][1]
+            for lead in batch
+            if lead.link and refs[lead.link][0] == lead.user_id
+        }
+
+
+    async def _worker(self, executor_id: int, queue: asyncio.Queue) -> None:
+        bucket = self._buckets[executor_id]
+        while True:
+            batch = self._take_batch(await queue.get(), queue)
+            self._in_flight[executor_id] += len(batch)
+            try:
+                hashes = await self._prefetch_hashes(executor_id, batch)
+            except Exception as e:
+                print(f"[ONBOARD] [executor {executor_id}] prefetch error: {e}")
+                hashes = {}
+
+            for lead in batch:
+                try:
+                    # исполнитель поймал FloodWait — не дёргаем Telegram, пока не проснётся
+                    while self.pool.is_sleeping(executor_id):
+                        await asyncio.sleep(self.sleep_poll)
+                    await bucket.acquire()
+                    # ссылки пачки уже разобраны в _prefetch_hashes — повторно по одной не запрашиваем
+                    fields = await self.pool.resolve_user(
+                        user_id=lead.user_id, executor_id=executor_id, access_hash=hashes.get(lead.user_id),
+                        link=lead.link, username=lead.username, phone=lead.phone, info=lead.info,
+                        link_tried=True,
+                    )
+                    if fields.get('access_hash'):
+                        self.resolved += 1
+                    else:
+                        self.unresolved += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"[ONBOARD] [executor {executor_id}] [user {lead.user_id}] {e}")
+                finally:
+                    self._in_flight[executor_id] -= 1
+                    self._finished.append(time.monotonic())
+                    queue.task_done()
+
+
+    def backlog(self) -> dict[int, int]:
+        """executor_id -> сколько лидов ждут или обрабатываются."""
+        return {eid: q.qsize() + self._in_flight[eid] for eid, q in self._queues.items()}
+
+
+    def throughput(self) -> float:
+        """Лидов в минуту за последние window секунд."""
+        now = time.monotonic()
+        while self._finished and now - self._finished[0] > self.window:
+            self._finished.popleft()
+        if not self._finished:
+            return 0.0
+        span = max(now - self._finished[0], 1.0)
+        return len(self._finished) * 60.0 / span
+
+
+    def stats(self) -> dict:
+        backlog = self.backlog()
+        return {
+            "backlog": sum(backlog.values()),
+            "by_executor": {eid: n for eid, n in backlog.items() if n},
+            "leads_per_min": round(self.throughput(), 1),
+            "resolved": self.resolved,
+            "unresolved": self.unresolved,
+            "failed": self.failed,
+            "unassigned": self.unassigned,
+        }
+
+
+    async def join(self, *, report_every: float = 60.0) -> None:
+        """Дождаться, пока все очереди опустеют, печатая прогресс раз в report_every секунд."""
+        while True:
+            pending = [asyncio.create_task(q.join()) for q in self._queues.values()]
+            if not pending:
+                return
+            done, not_done = await asyncio.wait(pending, timeout=report_every)
+            for t in not_done:
+                t.cancel()
+            if not not_done:
+                return
+            print(f"[ONBOARD] {self.stats()}")
+
+
+    async def close(self) -> None:
+        for tasks in self._workers.values():
+            for t in tasks:
+                t.cancel()
+        for tasks in self._workers.values():
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+        self._buckets.clear()
+        self._in_flight.clear()
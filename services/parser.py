@@ -1,17 +1,19 @@
 from __future__ import annotations
 import asyncio
-import sqlite3
+import time
+import aiosqlite
 import datetime as dt
 from zoneinfo import ZoneInfo
-from typing import Optional, Tuple
+from typing import AsyncIterator, Optional, Tuple
 
 from settings import get
 from state import stop_group_parser
 from db_modules.controller import DatabaseController
 from telegram.botpool import BotPool
+from .onboarding import OnboardingPipeline, Lead
 
-# (user_id, username, telephone, info, source_link)
-ExtRow = Tuple[int, Optional[str], Optional[str], Optional[str], Optional[str]]
+# (user_id, username, telephone, name, info, source_link)
+ExtRow = Tuple[int, Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]
 
 
 def _now_tz():
@@ -34,82 +36,226 @@ def _is_night() -> bool:
     # return True
 
 
-def _fetch_targets_with_last_link(external_db_path: str) -> list[ExtRow]:
+# Пользователи партии + последний source_link каждого — одним проходом по messages (оконная функция)
+_TARGETS_SQL = """
+    WITH batch AS ({batch}),
+    last_link AS (
+        SELECT m.user_id,
+               m.source_link,
+               ROW_NUMBER() OVER (PARTITION BY m.user_id ORDER BY m.created_at DESC) AS rn
+        FROM messages m
+        WHERE m.user_id IN (SELECT user_id FROM batch)
+            AND m.source_link IS NOT NULL
+            AND TRIM(m.source_link) <> ''
+    )
+    SELECT u.rowid AS rid,
+           u.user_id,
+           u.username,
+           u.telephone,
+           u.name,
+           u.info,
+           l.source_link
+    FROM users u
+    JOIN batch b ON b.user_id = u.user_id
+    LEFT JOIN last_link l ON l.user_id = u.user_id AND l.rn = 1
+    WHERE u.target = 1
+    ORDER BY u.rowid
+"""
+
+# новые пользователи: следующая страница после отметки по rowid (keyset-пагинация)
+_NEW_USERS_BATCH = "SELECT user_id FROM users WHERE rowid > :after AND target = 1 ORDER BY rowid LIMIT :limit"
+
+# пользователи, у которых появились новые сообщения (могла появиться ссылка)
+_NEW_MESSAGES_BATCH = "SELECT DISTINCT user_id FROM messages WHERE rowid > :after AND rowid <= :upto"
+
+MESSAGES_STEP = 5000   # окно rowid сообщений за один запрос
+
+
+def _connect_external(external_db_path: str):
+    """Асинхронное соединение только на чтение (запросы идут в потоке aiosqlite, не в цикле событий)."""
+    return aiosqlite.connect(f"file:{external_db_path}?mode=ro", uri=True)
+
+
+async def _query_external(conn: aiosqlite.Connection, sql: str, params: dict, *, label: str) -> list[tuple]:
     """
-    Достаем всех пользователей из внешней БД с target=1 и к каждому — последний source_link из messages.
+    Один короткий запрос: результат читается целиком, курсор сразу закрывается,
+    так что транзакция чтения на внешней БД не висит, пока мы обрабатываем строки.
     """
-    conn = sqlite3.connect(external_db_path)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT u.user_id,
-               u.username,
-               u.telephone,
-               u.name,
-               u.info,
-               (
-                    SELECT m.source_link
-                    FROM messages m
-                    WHERE m.user_id = u.user_id
-                        AND m.source_link IS NOT NULL
-                        AND TRIM(m.source_link) <> ''
-                    ORDER BY m.created_at DESC
-                    LIMIT 1
-                ) AS source_link
-        FROM users u
-        WHERE u.target = 1
-    """)
-    rows = cur.fetchall()
-    conn.close()
-    return [(r["user_id"], r["username"], r["telephone"], r['name'], r["info"], r["source_link"]) for r in rows]
+    t0 = time.perf_counter()
+    rows = list(await conn.execute_fetchall(sql, params))
+    print(f"[PARSER] [{label}] {len(rows)} строк за {(time.perf_counter() - t0) * 1000:.1f} мс")
+    return rows
 
 
-async def group_parser(db: DatabaseController, pool: BotPool, *, external_db_path: str) -> None:
+async def iter_external(external_db_path: str, sql: str, params: dict, *,
+                        chunk_size: int = 500, label: str = "query") -> AsyncIterator[list[tuple]]:
     """
-    Берёт пользователей из внешней БД и заносит их в основную.
-    1. pool.add_user(user_id, info, phone, username)
-    2. если есть source_link — добываем access_hash внутри add_user
+    Читает внешнюю БД страницами по chunk_size строк (keyset-пагинация).
+    sql должен принимать :after и :limit и отдавать строки по возрастанию ключа в первом столбце.
+    Каждая страница — отдельный запрос, между страницами открытого чтения нет:
+    пока потребитель обрабатывает страницу, парсер спокойно пишет в свою БД.
     """
-    period = int(get("UPDATE_BD_PERIOD") or 100)
+    after = params.get("after", 0)
+    async with _connect_external(external_db_path) as conn:
+        while True:
+            rows = await _query_external(conn, sql, {**params, "after": after, "limit": chunk_size}, label=label)
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1][0]
 
-    await asyncio.sleep(200)
 
-    print(f"[PARSER] Старт сервиса парсинга внешней БД")
+async def _external_max_rowids(external_db_path: str) -> tuple[int, int]:
+    """Текущие максимальные rowid таблиц users и messages внешней БД."""
+    async with _connect_external(external_db_path) as conn:
+        rows = await _query_external(
+            conn,
+            "SELECT (SELECT IFNULL(MAX(rowid), 0) FROM users), (SELECT IFNULL(MAX(rowid), 0) FROM messages)",
+            {}, label="max_rowid",
+        )
+    users_max, messages_max = rows[0]
+    return int(users_max), int(messages_max)
 
-    while not stop_group_parser.is_set():
-        if not _is_night():
-            await asyncio.sleep(3600)
-            continue
 
+def _iter_new_users(external_db_path: str, after: int, chunk_size: int) -> AsyncIterator[list[tuple]]:
+    """target-пользователи с rowid > after страницами: (rowid, *ExtRow)."""
+    sql = _TARGETS_SQL.format(batch=_NEW_USERS_BATCH)
+    return iter_external(external_db_path, sql, {"after": after}, chunk_size=chunk_size, label="users")
+
+
+async def _fetch_users_with_new_messages(external_db_path: str, after: int, upto: int) -> list[tuple]:
+    """target-пользователи с сообщениями в окне rowid (after, upto]: (rowid, *ExtRow). Окно ограничено MESSAGES_STEP."""
+    sql = _TARGETS_SQL.format(batch=_NEW_MESSAGES_BATCH)
+    async with _connect_external(external_db_path) as conn:
+        return await _query_external(conn, sql, {"after": after, "upto": upto}, label="messages")
+
+
+async def _ingest(db: DatabaseController, pipeline: OnboardingPipeline, ext_rows: list[ExtRow]) -> int:
+    """
+    Заносит в основную БД тех, кого там ещё нет. Возвращает число добавленных.
+    Разница с users — одним запросом, новые строки — одним INSERT OR IGNORE,
+    дальше каждый уходит в конвейер дополнения данными из Telegram (OnboardingPipeline).
+    """
+    by_id = {row[0]: row for row in ext_rows}
+    missing = await db.missing_users(list(by_id))
+    if not missing:
+        return 0
+
+    inserted = await db.add_users_bulk([
+        {
+            "user_id": uid,
+            "username": by_id[uid][1] or None,
+            "phone": by_id[uid][2] or None,
+            "name": by_id[uid][3] or None,
+            "info": by_id[uid][4] or "",
+        }
+        for uid in missing
+    ])
+    if len(inserted) < len(missing):
+        print(f"[PARSER] Пропущено при вставке (конфликт username): {sorted(set(missing) - set(inserted))}")
+
+    for user_id in inserted:
+        _, username, telephone, name, info, source_link = by_id[user_id]
         try:
-            ext_rows = _fetch_targets_with_last_link(external_db_path)
-            print(f"[PARSER] Найдено {len(ext_rows)} пользователей во внешней БД")
+            eid = await pipeline.submit(Lead(
+                user_id = user_id,
+                username = username or None,
+                phone = telephone or None,
+                info = info or "",
+                link = source_link,
+            ))
+            print(f"[PARSER] Добавлен пользоваатель {user_id, username} c исполнителем {eid}")
+
         except Exception as e:
-            print(f"[PARSER] external DB read error: {e}")
-            await asyncio.sleep(period)
-            continue
+            print(f"[PARSER] failed uid={user_id}: {e}")
+    return len(inserted)
 
-        for user_id, username, telephone, name, info, source_link in ext_rows:
-            try:
-                async with db.users() as users_repo:
-                    if await users_repo.has_user(user_id):
-                        continue
 
-                eid = await pool.add_user(
-                    user_id = user_id,
-                    username = username or None,
-                    phone = telephone or None,
-                    info = info or "",
-                    name = name or None,
-                    link = source_link,
-                )
+async def sync_external(db: DatabaseController, pool: BotPool, external_db_path: str, *, chunk_size: int = 500,
+                        pipeline: OnboardingPipeline = None) -> int:
+    """
+    Инкрементальная синхронизация с внешней БД.
+    Отметки (rowid users и messages) хранятся в таблице watermarks:
+    читаются только строки после них, отметка двигается после каждой обработанной страницы.
+    Внешняя БД читается короткими запросами по страницам (iter_external) и не блокирует цикл событий;
+    пока страница обрабатывается, на внешней БД нет открытой транзакции чтения.
+    Новые пользователи дополняются параллельно по исполнителям (pipeline), синхронизация ждёт конца.
+    Возвращает число добавленных пользователей.
+    """
+    users_key, messages_key = f"{external_db_path}#users", f"{external_db_path}#messages"
+    users_wm = await db.get_watermark(users_key)
+    messages_wm = await db.get_watermark(messages_key)
+
+    users_max, messages_max = await _external_max_rowids(external_db_path)
+    if users_max < users_wm or messages_max < messages_wm:
+        print(f"[PARSER] Внешняя БД пересоздана (rowid меньше отметки) — синхронизация с нуля")
+        users_wm = messages_wm = 0
+
+    if users_wm == 0:
+        # полный проход по users и так берёт последние ссылки — старые сообщения пропускаем
+        messages_wm = messages_max
+        await db.set_watermark(messages_key, messages_wm)
+
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = OnboardingPipeline(pool)
+
+    added = 0
+    seen = 0
+    try:
+        # 1. новые пользователи
+        async for rows in _iter_new_users(external_db_path, users_wm, chunk_size):
+            seen += len(rows)
+            added += await _ingest(db, pipeline, [tuple(r[1:]) for r in rows])
+            users_wm = rows[-1][0]
+            await db.set_watermark(users_key, users_wm)
+            if stop_group_parser.is_set():
+                break
+
+        # 2. уже известные пользователи с новыми сообщениями (например, появилась ссылка)
+        while messages_wm < messages_max and not stop_group_parser.is_set():
+            upto = min(messages_max, messages_wm + MESSAGES_STEP)
+            rows = await _fetch_users_with_new_messages(external_db_path, messages_wm, upto)
+            seen += len(rows)
+            for i in range(0, len(rows), chunk_size):
+                added += await _ingest(db, pipeline, [tuple(r[1:]) for r in rows[i:i + chunk_size]])
+            messages_wm = upto
+            await db.set_watermark(messages_key, messages_wm)
+
+        await pipeline.join()
+    finally:
+        if own_pipeline:
+            await pipeline.close()
+
+    print(f"[PARSER] Новых строк во внешней БД: {seen}, добавлено: {added}, дополнение: {pipeline.stats()}")
+    return added
+
 
-                ename = (await db.get_executor(executor_id=eid))['name']
+async def group_parser(db: DatabaseController, pool: BotPool, *, external_db_path: str) -> None:
+    """
+    Берёт новых пользователей из внешней БД и заносит их в основную (см. sync_external).
+    Новые пользователи вставляются пачкой и дополняются через OnboardingPipeline; если есть source_link — access_hash добывается через него
+    """
+    period = int(get("UPDATE_BD_PERIOD") or 100)
 
-                print(f"[PARSER] Добавлен пользоваатель {user_id, username} c исполнителем {eid, ename}")
+    await asyncio.sleep(200)
+    pipeline = OnboardingPipeline(pool)
 
+    print(f"[PARSER] Старт сервиса парсинга внешней БД")
+
+    try:
+        while not stop_group_parser.is_set():
+            if not _is_night():
+                await asyncio.sleep(3600)
+                continue
+
+            try:
+                await sync_external(db, pool, external_db_path, pipeline=pipeline)
             except Exception as e:
-                print(f"[PARSER] failed uid={user_id}: {e}")
+                print(f"[PARSER] external DB sync error: {e}")
 
-        await asyncio.sleep(period)
+            await asyncio.sleep(period)
+    finally:
+        await pipeline.close()
@@ -0,0 +1,119 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from state import stop_proxy_health
+from proxy import AsyncProxyProber
+from telegram.botpool import BotPool
+from db_modules.controller import DatabaseController
+
+
+SLOW_CONNECT_MS = 1500   # p95 подключения к прокси, выше — прокси медленный
+SLOW_READ_MS = 4000      # p95 запроса через прокси, выше — прокси медленный
+DEAD_STREAK = 3          # столько неудачных проверок подряд — прокси мёртв
+WINDOW = 20              # по скольким последним проверкам считаем перцентили
+
+# executor_id -> {"connect": deque[мс], "read": deque[мс]}
+_samples: dict[int, dict[str, deque]] = {}
+
+
+def _percentile(values, q: float) -> Optional[int]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return int(ordered[idx])
+
+
+def _classify(streak: int, connect_p95: Optional[int], read_p95: Optional[int]) -> str:
+    if streak >= DEAD_STREAK:
+        return "dead"
+    if streak > 0:
+        return "slow"   # уже не отвечает, но ещё не мёртв — новых клиентов не даём
+    if (connect_p95 or 0) > SLOW_CONNECT_MS or (read_p95 or 0) > SLOW_READ_MS:
+        return "slow"
+    return "ok"
+
+
+async def check_executor_proxy(db: DatabaseController, pool: BotPool, prober: AsyncProxyProber, row: dict, *,
+                               period: float = 60.0) -> str:
+    """Одна проверка прокси исполнителя: пишет перцентили, серию неудач и состояние в executors."""
+    executor_id = row["executor_id"]
+    hostport = f"{row['proxy_ip']}:{row['proxy_port']}"
+    ok, connect_s, read_s, error = await prober.probe(hostport, row.get("proxy_user"), row.get("proxy_pass"))
+
+    samples = _samples.setdefault(executor_id, {"connect": deque(maxlen=WINDOW), "read": deque(maxlen=WINDOW)})
+    if connect_s is not None:
+        samples["connect"].append(connect_s * 1000)
+    if read_s is not None:
+        samples["read"].append(read_s * 1000)
+
+    streak = 0 if ok else (row.get("proxy_fail_streak") or 0) + 1
+    connect_p95 = _percentile(samples["connect"], 0.95)
+    read_p95 = _percentile(samples["read"], 0.95)
+    state = _classify(streak, connect_p95, read_p95)
+
+    await db.update_executor_fields(
+        executor_id,
+        proxy_state=state,
+        proxy_fail_streak=streak,
+        proxy_connect_p50=_percentile(samples["connect"], 0.5),
+        proxy_connect_p95=connect_p95,
+        proxy_read_p50=_percentile(samples["read"], 0.5),
+        proxy_read_p95=read_p95,
+        proxy_checked_at=int(time.time()),
+    )
+
+    prev = row.get("proxy_state") or "ok"
+    if state != prev:
+        print(f"[PROXY] [executor {executor_id}] {hostport}: {prev} -> {state}" + (f" ({error})" if error else ""))
+
+    if state == "dead":
+        # до следующей проверки не шлём через этот прокси: ответы уходят в outbox
+        await pool.sleep_executor(executor_id, period * 1.5)
+    return state
+
+
+async def check_all_proxies(db: DatabaseController, pool: BotPool, prober: AsyncProxyProber, *,
+                            concurrency: int = 20, period: float = 60.0) -> dict[int, str]:
+    """Проверяет прокси всех исполнителей параллельно. Возвращает executor_id -> состояние."""
+    async with db.executors() as executors_repo:
+        rows = await executors_repo.get_executors()
+    rows = [r for r in rows if r.get("proxy_ip") and r.get("proxy_port")]
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(row: dict):
+        async with sem:
+            try:
+                return row["executor_id"], await check_executor_proxy(db, pool, prober, row, period=period)
+            except Exception as e:
+                print(f"[PROXY] [executor {row['executor_id']}] check error: {e}")
+                return row["executor_id"], None
+
+    return dict(await asyncio.gather(*(run(r) for r in rows)))
+
+
+async def proxy_health_loop(db: DatabaseController, pool: BotPool, *, period: float = 60.0, concurrency: int = 20) -> None:
+    """
+    Регулярная проверка прокси исполнителей.
+    Медленные и мёртвые прокси помечаются в executors.proxy_state:
+    greeter и выдача новых клиентов их пропускают, мёртвый исполнитель усыпляется.
+    """
+    print(f"[PROXY] Старт проверки прокси")
+    prober = AsyncProxyProber()
+    try:
+        while not stop_proxy_health.is_set():
+            try:
+                states = await check_all_proxies(db, pool, prober, concurrency=concurrency, period=period)
+                bad = {eid: st for eid, st in states.items() if st and st != "ok"}
+                if bad:
+                    print(f"[PROXY] Проверено {len(states)}, проблемные: {bad}")
+            except Exception as e:
+                print(f"[PROXY] check round error: {e}")
+
+            await asyncio.sleep(period)
+    finally:
+        await prober.aclose()
@@ -20,6 +20,16 @@ _DEFAULTS: Dict[str, Any] = {
     "MORNING": 9,
     "NIGHT": 21,
     "SECOND_GREET": True,
+    "OPENAI_CONCURRENCY": 8,
+    "OPENAI_RPM": 500,
+    "OPENAI_TPM": 200000,
+    "OPENAI_STREAM": True,
+    "ONBOARD_CONCURRENCY": 2,
+    "ONBOARD_RATE": 0.5,
+    "RESOLVE_CHUNK": 100,
+    "RESOLVE_PAUSE": 1.0,
+    "CONNECT_CONCURRENCY": 10,
+    "CONNECT_TIMEOUT": 30.0,
 }
 _TYPES: Dict[str, type] = {
     "BUFFER_TIME": float,
@@ -33,6 +43,16 @@ _TYPES: Dict[str, type] = {
     "MORNING": int,
     "NIGHT": int,
     "SECOND_GREET": bool,
+    "OPENAI_CONCURRENCY": int,
+    "OPENAI_RPM": int,
+    "OPENAI_TPM": int,
+    "OPENAI_STREAM": bool,
+    "ONBOARD_CONCURRENCY": int,
+    "ONBOARD_RATE": float,
+    "RESOLVE_CHUNK": int,
+    "RESOLVE_PAUSE": float,
+    "CONNECT_CONCURRENCY": int,
+    "CONNECT_TIMEOUT": float,
 }
 
 # ---- Состояние ----
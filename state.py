@@ -1,7 +1,8 @@
 """
 Глобальное состояние рантайма бота:
 - буферы сообщений и отметки времени
-- задачи обработки пользователя и задачи «пуша при неактивности»
+- таймеры тишины (debounce) перед обработкой буфера
+- задачи обработки пользователя
 - флаги остановки фоновых воркеров
 """
 
@@ -9,12 +10,15 @@ from __future__ import annotations
 import asyncio
 import time
 from collections import defaultdict
-from typing import DefaultDict, Dict, List, Optional
+from typing import Awaitable, Callable, DefaultDict, Dict, List, Optional
 
 
 # --- Флаги остановки фоновых циклов ---
 stop_group_parser = asyncio.Event()
 stop_greeter = asyncio.Event()
+stop_followup = asyncio.Event()
+stop_crm = asyncio.Event()
+stop_proxy_health = asyncio.Event()
 
 # Активные задачи
 _group_parser_task: Optional[asyncio.Task] = None
@@ -23,19 +27,22 @@ _greeter_task: Optional[asyncio.Task] = None
 # --- Буферы и задачи по пользователям ---
 message_buffers: DefaultDict[int, List[str]] = defaultdict(list)
 last_message_times: Dict[int, float] = {}
+last_message_ids: Dict[int, int] = {}   # id последнего входящего — ключ идемпотентности ответа
 
 # Задача «собрать буфер и ответить» для пользователя
 user_tasks: Dict[int, asyncio.Task] = {}
 
-# Задача «пинг при неактивности» для пользователя
-inactivity_tasks: Dict[int, asyncio.Task] = {}
+# Таймер тишины: срабатывает, когда пользователь перестал писать
+debounce_timers: Dict[int, asyncio.TimerHandle] = {}
 
 
 # --- Утилиты ---
 
-def touch_user(uid: int) -> None:
-    """Обновить отметку последнего сообщения пользователя."""
+def touch_user(uid: int, message_id: int = None) -> None:
+    """Обновить отметку (и id) последнего сообщения пользователя."""
     last_message_times[uid] = time.time()
+    if message_id is not None:
+        last_message_ids[uid] = message_id
 
 
 def append_to_buffer(uid: int, text: str) -> None:
@@ -55,10 +62,28 @@ def cancel_user_task(uid: int) -> None:
     cancel_task_safe(task)
 
 
-def cancel_inactivity_task(uid: int) -> None:
-    """Отменить и убрать задачу неактивности конкретного пользователя."""
-    task = inactivity_tasks.pop(uid, None)
-    cancel_task_safe(task)
+def cancel_debounce(uid: int) -> None:
+    """Снять таймер тишины пользователя, если он взведён."""
+    handle = debounce_timers.pop(uid, None)
+    if handle is not None:
+        handle.cancel()
+
+
+def debounce(uid: int, delay: float, factory: Callable[[], Awaitable]) -> None:
+    """
+    (Пере)взводит таймер тишины пользователя на delay секунд.
+    Каждое новое сообщение сдвигает дедлайн; когда он наступает,
+    factory() ровно один раз запускается как задача обработки (user_tasks[uid]).
+    """
+    cancel_debounce(uid)
+    loop = asyncio.get_running_loop()
+    debounce_timers[uid] = loop.call_later(delay, _fire_debounce, uid, factory)
+
+
+def _fire_debounce(uid: int, factory: Callable[[], Awaitable]) -> None:
+    debounce_timers.pop(uid, None)
+    cancel_user_task(uid)
+    user_tasks[uid] = asyncio.create_task(factory())
 
 
 def last_gap(uid: int) -> float:
@@ -70,12 +95,6 @@ def last_gap(uid: int) -> float:
     return time.time() - last_message_times.get(uid, 0)
 
 
-def set_inactivity_task(uid: int, task: asyncio.Task) -> None:
-    """Ставит новый таймер неактивности для пользователя, отменяя старый."""
-    cancel_inactivity_task(uid)
-    inactivity_tasks[uid] = task
-
-
 def pop_buffer(uid: int) -> str:
     """
     Извлекает и очищает буфер сообщений пользователя.
@@ -92,20 +111,21 @@ def clear_user_state(uid: int, *, cancel_tasks: bool = True) -> None:
     буфер, таймстемп, задачи (опционально).
     """
     if cancel_tasks:
+        cancel_debounce(uid)
         cancel_user_task(uid)
-        cancel_inactivity_task(uid)
     message_buffers.pop(uid, None)
     last_message_times.pop(uid, None)
+    last_message_ids.pop(uid, None)
 
 
 async def cancel_all_tasks() -> None:
     """Отменить все пользовательские задачи (аккуратно пройтись по копии словарей)."""
+    for handle in list(debounce_timers.values()):
+        handle.cancel()
+    debounce_timers.clear()
     for task in list(user_tasks.values()):
         cancel_task_safe(task)
-    for task in list(inactivity_tasks.values()):
-        cancel_task_safe(task)
     user_tasks.clear()
-    inactivity_tasks.clear()
 
 
 def set_group_parser_task(task: asyncio.Task) -> None:
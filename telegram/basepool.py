@@ -5,6 +5,8 @@ import time
 import signal
 from typing import Dict, Optional, Awaitable, Callable
 
+from .ratelimit import SendPacer
+
 
 class BasePool:
     def __init__(self, *,
@@ -20,12 +22,18 @@ class BasePool:
         # sleep/queue/drainer state
         self._sleep_until: Dict[int, float] = {}           # executor_id -> timestamp until (sleep)
         self._sleep_events: Dict[int, asyncio.Event] = {}  # executor_id -> Event (set when awake)
-        self._queues: Dict[int, asyncio.Queue] = {}        # executor_id -> Queue[Awaitable]
+        self._queues: Dict[int, asyncio.Queue] = {}        # executor_id -> Queue[Callable[[], Awaitable]]
         self._drainers: Dict[int, asyncio.Task] = {}       # executor_id -> background drainer task
 
+        # темп исходящих: executor_id -> SendPacer (скорости подстраиваются под флуд-ограничения)
+        self._pacers: Dict[int, SendPacer] = {}
+
         # per-executor locks
         self._locks: Dict[int, asyncio.Lock] = {}
 
+        # фоновые задачи «выстрелил и забыл» (держим ссылки, чтобы их не собрал GC)
+        self._bg_tasks: set[asyncio.Task] = set()
+
         # ---- stop ----
         self._stop = asyncio.Event()     # общий флаг остановки для всех фоновых задач пула
         self._closed = False
@@ -84,9 +92,9 @@ class BasePool:
             # аккуратно доисполнить, игнорируя новые слипы
             for exec_id, q in list(self._queues.items()):
                 while not q.empty():
-                    coro = await q.get()
+                    factory = await q.get()
                     try:
-                        await coro
+                        await factory()
                     except Exception as e:
                         print(f"[BasePool] error draining queue exec={exec_id}: {e}")
         else:
@@ -105,10 +113,58 @@ class BasePool:
         cur = self._backoffs.get(executor_id, self._initial_backoff)
         nxt = min(cur * self._backoff_factor, self._max_backoff)
         self._backoffs[executor_id] = nxt
+        self._limits_changed(executor_id)
 
 
     def _reset_backoff(self, executor_id: int) -> None:
         self._backoffs.pop(executor_id, None)
+        self._limits_changed(executor_id)
+
+    # ---- persistence hooks ----
+    def _limits_changed(self, executor_id: int) -> None:
+        """
+        Хук: у исполнителя изменился сон, backoff или выученный темп отправок (SendPacer).
+        Переопределяется в BotPool (сохраняет в БД, чтобы пережить перезапуск).
+        """
+        return None
+
+
+    def restore_limits(self, executor_id: int, *, sleep_until: float = None, backoff: float = None,
+                       pacing: dict = None) -> bool:
+        """
+        Восстановить сон, ступень backoff и выученный темп отправок (SendPacer.snapshot) после перезапуска.
+        Если сон ещё не кончился — исполнитель снова спит, поднят дрейнер. Возвращает True в этом случае.
+        """
+        if pacing:
+            self._pacer_for(executor_id).restore(pacing)
+        if backoff:
+            self._backoffs[executor_id] = min(float(backoff), self._max_backoff)
+        if sleep_until and float(sleep_until) > self._now():
+            self._sleep_until[executor_id] = float(sleep_until)
+            self._event_for(executor_id).clear()
+            self._ensure_drainer(executor_id)
+            return True
+        return False
+
+    # ---- outbound pacing ----
+    def _pacer_for(self, executor_id: int) -> SendPacer:
+        pacer = self._pacers.get(executor_id)
+        if pacer is None:
+            pacer = self._pacers[executor_id] = SendPacer()
+            pacer.on_change = lambda: self._limits_changed(executor_id)
+        return pacer
+
+
+    async def pace(self, executor_id: int, *, first: bool = False, user_id: int = None) -> float:
+        """
+        Дождаться очереди на отправку у исполнителя (см. SendPacer).
+        Через это проходят все исходящие. Возвращает время ожидания, с.
+        """
+        return await self._pacer_for(executor_id).acquire(first=first, user_id=user_id)
+
+
+    def pacing_stats(self) -> Dict[int, dict]:
+        return {executor_id: pacer.stats() for executor_id, pacer in self._pacers.items()}
 
     # ---- time / event / queue utils ----
     def _now(self) -> float:
@@ -140,18 +196,44 @@ class BasePool:
         return lock
 
 
+    def spawn(self, coro: Awaitable) -> asyncio.Task:
+        """
+        Запускает корутину в фоне, не блокируя вызывающего.
+        Задачи отменяются при shutdown.
+        """
+        task = asyncio.create_task(coro)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
+        return task
+
+
     def is_sleeping(self, executor_id: int) -> bool:
         ts = self._sleep_until.get(executor_id, 0.0)
         return self._now() < ts
 
 
-    def defer_for_executor(self, executor_id: int, coro: Awaitable) -> None:
+    def defer_for_executor(self, executor_id: int, factory: Callable[[], Awaitable]) -> None:
         """
-        Кладём отложенную корутину (awaitable) в очередь исполнителя,
-        которая будет выполнена после пробуждения.
+        Кладём в очередь исполнителя фабрику корутины (вызывается после пробуждения).
+        Корутина создаётся только в момент выполнения — неисполненные не висят в памяти.
+        Очередь живёт в памяти; отправки, которые должны пережить перезапуск, идут в outbox (см. _replay_outbox).
         """
         q = self._queue_for(executor_id)
-        q.put_nowait(coro)
+        q.put_nowait(factory)
+
+
+    async def _replay_outbox(self, executor_id: int) -> None:
+        """
+        Хук дрейнера: доотправить сохранённые в БД отложенные сообщения исполнителя.
+        Вызывается после пробуждения, до очереди в памяти. Переопределяется в BotPool.
+        """
+        return None
+
+
+    def _ensure_drainer(self, executor_id: int) -> None:
+        """Поднять дрейнер исполнителя, если его ещё нет."""
+        if executor_id not in self._drainers or self._drainers[executor_id].done():
+            self._drainers[executor_id] = asyncio.create_task(self._drain_after_wakeup(executor_id))
 
 
     async def sleep_executor(self, executor_id: int, seconds: float) -> None:
@@ -163,10 +245,10 @@ class BasePool:
         self._sleep_until[executor_id] = until
         ev = self._event_for(executor_id)
         ev.clear()
+        self._limits_changed(executor_id)
 
         # поднимаем дрейнер, если ещё нет
-        if executor_id not in self._drainers or self._drainers[executor_id].done():
-            self._drainers[executor_id] = asyncio.create_task(self._drain_after_wakeup(executor_id))
+        self._ensure_drainer(executor_id)
 
 
     async def _drain_after_wakeup(self, executor_id: int) -> None:
@@ -190,12 +272,18 @@ class BasePool:
                 self._sleep_until[executor_id] = 0.0
                 self._event_for(executor_id).set()
 
+                # сначала сохранённые в БД отправки, в порядке постановки
+                try:
+                    await self._replay_outbox(executor_id)
+                except Exception as e:
+                    print(f"[BasePool] outbox replay error exec={executor_id}: {e}")
+
                 q = self._queue_for(executor_id)
                 # выполняем очередь пока не введён новый сон
                 while not q.empty() and not self.is_sleeping(executor_id) and not self._stop.is_set():
-                    coro = await q.get()
+                    factory = await q.get()
                     try:
-                        await coro
+                        await factory()
                     except Exception as e:
                         print(f"[BasePool] deferred task error exec={executor_id}: {e}")
 
@@ -1,4 +1,5 @@
-import asyncio, time
+import asyncio, time, json, uuid
+from dataclasses import dataclass
 from typing import Optional, Dict, List, Tuple
 from pydantic import BaseModel
 from pyrogram import Client
@@ -6,14 +7,31 @@ from pyrogram.errors import FloodWait, PeerFlood, UserIsBlocked, RPCError
 from pyrogram.handlers import MessageHandler
 from pyrogram import filters
 from contextlib import suppress
+from tabulate import tabulate
 
 from db_modules.controller import DatabaseController
+from db_modules.cache import TTLCache
+from settings import get
+from db_modules import outbox
 from telegram.senders import send_message, send_document
 from .basepool import BasePool
-from .botpool_users import add_user, connect_user, get_access_hash, get_username_by_id, get_phone_by_id
+from .botpool_utils import DiscussionResolver
+from .botpool_users import add_user, enrich_user, resolve_user, connect_user, forget_peer, resolve_users, get_access_hash, get_username_by_id, get_phone_by_id
 from .botpool_executors import connect_executor, create_session, add_executor, reload_executor, delete_executor
 
 
+# исход попытки отправки: исполнитель уснул, повторить после пробуждения
+DEFERRED = "deferred"
+
+# Ошибки, после которых закешированный пользователь больше не годится для отправки
+_PEER_ERRORS = {
+    "PEER_ID_INVALID",
+    "USER_ID_INVALID",
+    "INPUT_USER_DEACTIVATED",
+    "USER_DEACTIVATED",
+}
+
+
 class BotSlot:
     def __init__(self, name: str, client: Client):
         self.name = name
@@ -32,6 +50,14 @@ class BotSlot:
         return time.time() >= (self.disabled_until or 0.0)
 
 
+@dataclass(frozen=True)
+class ExecutorIdentity:
+    """Кто стоит за клиентом: заполняется одним get_me() при подключении."""
+    executor_id: int
+    username: Optional[str]
+    is_premium: bool
+
+
 class BotPool(BasePool):
     def __init__(self, db: DatabaseController, *, main_executor: int = None, initial_backoff: float = 60.0,
                  backoff_factor: float = 2.0, max_backoff: float = 24*3600.0):
@@ -45,8 +71,26 @@ class BotPool(BasePool):
         self._clients: Dict[int, Client] = {}      # кеш клиентов: executor_id -> Client
         self._handlers: List = []                  # общие хэндлеры (навешиваются на каждый клиент при connect_executor)
 
+        # реестр «клиент -> исполнитель», чтобы не звать get_me() на каждое сообщение
+        self._identities: Dict[Client, ExecutorIdentity] = {}
+        self._identity_hits = 0    # сколько вызовов get_me() сэкономлено
+        self._identity_misses = 0  # сколько раз всё-таки пришлось спросить Telegram
+
+        # клиент -> кеш каналов и обсуждений для ссылок из парсера
+        self._discussions: Dict[Client, DiscussionResolver] = {}
+
+        # выдача новых пользователей учитывает сон и backoff исполнителей
+        db.allocator.penalty = self._allocation_penalty
+
+        # (executor_id, user_id) -> пользователь, готовый к отправке: connect_user не ходит в Telegram повторно
+        self._peers = TTLCache(maxsize=20000, ttl=6*3600.0)
+
     add_user = add_user
+    enrich_user = enrich_user
+    resolve_user = resolve_user
     connect_user = connect_user
+    forget_peer = forget_peer
+    resolve_users = resolve_users
     get_access_hash = get_access_hash
     get_username_by_id = get_username_by_id
     get_phone_by_id = get_phone_by_id
@@ -61,11 +105,18 @@ class BotPool(BasePool):
     async def activate(self):
         self._install_signal_handlers()
         
+        # строки outbox, отправка которых оборвалась при остановке: исход неизвестен, не повторяем
+        interrupted = await self.db.recover_outbox()
+        if interrupted:
+            print(f"[POOL] [outbox] прервано при остановке (не повторяем): {interrupted}")
+
+        # сон и backoff, пережившие перезапуск: спящие досыпают, остальные подключаются как обычно
+        await self._restore_limits()
+
         async with self.db.executors() as executors_repo:
             executors = await executors_repo.get_ids()
-        for executor_id in executors:
-            await self.ensure_client(executor_id)
-        
+        await self.connect_all(executors)
+
         print("Все клиенты активированы.")
 
         await self._stop.wait()
@@ -73,6 +124,51 @@ class BotPool(BasePool):
         await self.shutdown()
 
     
+    async def _restore_limits(self) -> None:
+        async with self.db.executors() as executors_repo:
+            rows = await executors_repo.get_executors()
+        sleeping = {}
+        for row in rows:
+            pacing = None
+            if row.get("send_rate") or row.get("first_rate") or row.get("flood_hours"):
+                try:
+                    hours = json.loads(row["flood_hours"]) if row.get("flood_hours") else {}
+                except ValueError:
+                    hours = {}
+                pacing = {"rate": row.get("send_rate"), "first_rate": row.get("first_rate"), "hours": hours}
+            if self.restore_limits(row["executor_id"], sleep_until=row.get("sleep_until"), backoff=row.get("flood_backoff"),
+                                   pacing=pacing):
+                sleeping[row["executor_id"]] = int(row["sleep_until"] - self._now())
+        if sleeping:
+            print(f"[POOL] Спят после перезапуска (executor: сек): {sleeping}")
+
+
+    def _limits_changed(self, executor_id: int) -> None:
+        self.spawn(self._save_limits(executor_id))
+
+
+    async def _save_limits(self, executor_id: int) -> None:
+        """
+        Сохранить текущие сон, backoff и выученный темп отправок исполнителя
+        (значения берутся в момент записи — порядок задач не важен).
+        """
+        until = self._sleep_until.get(executor_id, 0.0)
+        backoff = self._backoffs.get(executor_id)
+        values = dict(
+            sleep_until=int(until) if until > self._now() else None,
+            flood_backoff=int(backoff) if backoff else None,
+        )
+        pacer = self._pacers.get(executor_id)
+        if pacer is not None:
+            state = pacer.snapshot()
+            values.update(send_rate=state["rate"], first_rate=state["first_rate"],
+                          flood_hours=json.dumps(state["hours"]) if state["hours"] else None)
+        try:
+            await self.db.update_executor_fields(executor_id, **values)
+        except Exception as e:
+            print(f"[POOL] [executor {executor_id}] не удалось сохранить сон/backoff/темп: {e}")
+
+
     async def shutdown(self):
         """
         Полное завершение пула:
@@ -103,6 +199,11 @@ class BotPool(BasePool):
             except Exception as e:
                 print(f"Ошибка при отключении клиента {executor_id}: {e}")
 
+        try:
+            await self.db.flush()
+        except Exception as e:
+            print(f"Ошибка при сбросе отложенных записей в БД: {e}")
+
         try:
             await self.db.close()
         except Exception as e:
@@ -121,11 +222,12 @@ class BotPool(BasePool):
             cli.add_handler(handler)
 
 
-    async def ensure_client(self, executor_id: int) -> Optional[Client]:
+    async def ensure_client(self, executor_id: int, *, timeout: float = None) -> Optional[Client]:
         """
         Возвращает подключённый Client для executor_id.
         Берёт через db.connect_executor(executor_id) и кеширует.
         Подвешивает заранее добавленные хэндлеры.
+        timeout — сколько ждать start() (медленный прокси не держит остальных).
         """
         if executor_id in self._clients:
             return self._clients[executor_id]
@@ -140,12 +242,17 @@ class BotPool(BasePool):
             
             if not cli.is_connected:
                 try:
-                    await cli.start()
+                    await asyncio.wait_for(cli.start(), timeout)
+                except asyncio.TimeoutError:
+                    print(f"[POOL] [ensure_client] [executor_id = {executor_id}] start() не уложился в {timeout} сек")
+                    with suppress(Exception):
+                        await cli.disconnect()
                 except Exception as e:
                     print(f"[POOL] [ensure_client] [executor_id = {executor_id}] {e}")
 
             if cli.is_connected:
                 await self.db.update_executor_param(executor_id, 'status', 'active')
+                await self._refresh_identity(cli)
             else :
                 await self.db.update_executor_param(executor_id, 'status', 'disconected')
 
@@ -157,125 +264,340 @@ class BotPool(BasePool):
             return cli
 
 
+    async def _connect_timed(self, executor_id: int, timeout: float) -> Tuple[bool, float, Optional[str]]:
+        """Одно подключение с замером. Возвращает (подключён, секунды, ошибка)."""
+        cli = self._clients.get(executor_id)
+        if cli is not None and not cli.is_connected:
+            # неудачный клиент с прошлой попытки — собираем заново
+            self._clients.pop(executor_id, None)
+            self.forget_identity(cli)
+
+        t0 = time.perf_counter()
+        try:
+            cli = await self.ensure_client(executor_id, timeout=timeout)
+            error = None if cli and cli.is_connected else "не подключён"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        return error is None, time.perf_counter() - t0, error
+
+
+    async def connect_all(self, executor_ids: List[int], *, concurrency: int = None,
+                          timeout: float = None) -> Dict[int, Tuple[bool, float, Optional[str]]]:
+        """
+        Параллельно подключает исполнителей (не больше concurrency одновременно, на каждого — timeout).
+        Подключившийся сразу обслуживает входящие и доотправляет свой outbox;
+        неудачные переподключаются в фоне (_retry_connect). Печатает отчёт о задержках старта.
+        """
+        concurrency = concurrency or int(get("CONNECT_CONCURRENCY") or 10)
+        timeout = timeout or float(get("CONNECT_TIMEOUT") or 30)
+        with_outbox = set(await self.db.outbox_executors())
+        sem = asyncio.Semaphore(concurrency)
+        t0 = time.perf_counter()
+
+        async def one(executor_id: int):
+            async with sem:
+                result = await self._connect_timed(executor_id, timeout)
+            if result[0]:
+                if executor_id in with_outbox:
+                    self._ensure_drainer(executor_id)
+            else:
+                self.spawn(self._retry_connect(executor_id, timeout=timeout, with_outbox=executor_id in with_outbox))
+            return executor_id, result
+
+        results = dict(await asyncio.gather(*(one(eid) for eid in executor_ids)))
+        self._print_startup_report(results, time.perf_counter() - t0)
+        return results
+
+
+    async def _retry_connect(self, executor_id: int, *, timeout: float, with_outbox: bool = False,
+                             delay: float = 30.0, max_delay: float = 1800.0) -> None:
+        """Фоновое переподключение исполнителя с растущей паузой, пока не получится или пул не остановят."""
+        while not self._stop.is_set():
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stop.wait(), delay)
+            if self._stop.is_set():
+                return
+            if await self.db.get_executor(executor_id=executor_id) is None:
+                return   # исполнителя удалили
+            ok, elapsed, error = await self._connect_timed(executor_id, timeout)
+            if ok:
+                print(f"[POOL] [startup] [executor {executor_id}] подключён повторно за {elapsed:.2f} сек")
+                if with_outbox:
+                    self._ensure_drainer(executor_id)
+                return
+            print(f"[POOL] [startup] [executor {executor_id}] повторное подключение не удалось: {error}")
+            delay = min(max_delay, delay * 2)
+
+
+    @staticmethod
+    def _print_startup_report(results: Dict[int, Tuple[bool, float, Optional[str]]], total: float) -> None:
+        rows = sorted(results.items(), key=lambda kv: -kv[1][1])
+        table = [[eid, "ok" if ok else "ошибка", f"{elapsed:.2f}", error or ""] for eid, (ok, elapsed, error) in rows]
+        print(tabulate(table, headers=["executor", "статус", "сек", "ошибка"], tablefmt="grid"))
+        connected = sum(ok for ok, _, _ in results.values())
+        slowest = rows[0][1][1] if rows else 0.0
+        print(f"[POOL] [startup] подключено {connected}/{len(results)} за {total:.2f} сек (самый медленный {slowest:.2f} сек)")
+
+
     def get_client_cached(self, executor_id: int) -> Optional[Client]:
         """Только из кеша, без подключения"""
         return self._clients.get(executor_id)
+
+
+    async def _refresh_identity(self, bot: Client) -> Optional[ExecutorIdentity]:
+        """
+        Один раз спрашивает у Telegram, кто владелец клиента, и кладёт в реестр.
+        """
+        try:
+            me = await bot.get_me()
+        except Exception as e:
+            print(f"[POOL] [identity] get_me failed: {e}")
+            return None
+        ident = ExecutorIdentity(executor_id=me.id, username=me.username, is_premium=bool(me.is_premium))
+        self._identities[bot] = ident
+        return ident
+
+
+    async def identity(self, bot: Client) -> Optional[ExecutorIdentity]:
+        """
+        Возвращает ExecutorIdentity клиента из реестра.
+        get_me() вызывается только для клиентов, которых реестр ещё не видел.
+        """
+        ident = self._identities.get(bot)
+        if ident is not None:
+            self._identity_hits += 1
+            return ident
+        self._identity_misses += 1
+        return await self._refresh_identity(bot)
+
+
+    def forget_identity(self, bot: Client) -> None:
+        self._identities.pop(bot, None)
+        self._discussions.pop(bot, None)
+
+
+    def discussion(self, bot: Client) -> DiscussionResolver:
+        """DiscussionResolver клиента (создаётся при первом обращении)."""
+        resolver = self._discussions.get(bot)
+        if resolver is None:
+            resolver = self._discussions[bot] = DiscussionResolver(bot)
+        return resolver
+
+
+    def identity_stats(self) -> Dict[str, int]:
+        return {
+            "get_me_saved": self._identity_hits,
+            "get_me_calls": self._identity_misses,
+            "registered": len(self._identities),
+        }
+
+
+    def _allocation_penalty(self, executor_id: int) -> float:
+        """
+        Штраф для ExecutorAllocator (множитель нагрузки): спящий после FloodWait/PeerFlood исполнитель
+        и исполнитель с выросшим backoff получают новых пользователей реже.
+        """
+        if self.is_sleeping(executor_id):
+            return 4.0
+        backoff = self._backoffs.get(executor_id)
+        if not backoff:
+            return 1.0
+        return min(4.0, max(1.0, backoff / self._initial_backoff))
+
+
+    def peer_stats(self) -> Dict[str, int]:
+        return self._peers.stats()
     
 
-    async def send_text(self, user_id: int, text: str, reply_to: int = None, first: bool = False, bot: Client = None) -> bool:
+    async def send_text(self, user_id: int, text: str, reply_to: int = None, first: bool = False, bot: Client = None,
+                        key: str = None) -> bool:
         """
         Шлёт текст через закреплённого за пользователем исполнителя.
         Явного исполнителя может указывать хэндлер.
         Использует готовую функцию send_message(bot, user, ...).
+        key — ключ идемпотентности: отправка с уже использованным ключом второй раз не уходит.
+        """
+        payload = {"text": text, "reply_to": reply_to, "first": first}
+        return await self._send("text", user_id, payload, bot=bot, key=key)
+
+
+    async def send_document(self, user_id: int, path: str, caption: str = "", first: bool = False, bot: Client = None,
+                            key: str = None) -> bool:
         """
+        Шлёт документ через закреплённого за пользователем исполнителя.
+        Использует готовую функцию send_document(bot, user, ...).
+        key — ключ идемпотентности, как в send_text.
+        """
+        payload = {"path": path, "caption": caption, "first": first}
+        return await self._send("document", user_id, payload, bot=bot, key=key)
+
+
+    async def _send(self, kind: str, user_id: int, payload: dict, *, bot: Client = None, key: str = None) -> bool:
+        """
+        Общий путь отправки. Если исполнитель спит или ловит флуд — отправка уходит в outbox
+        и будет доотправлена дрейнером после пробуждения (в том числе после перезапуска).
+        """
+        tag = f"send_{kind}"
         if bot is None:
             executor_id = await self.db.get_user_param(user_id, 'executor_id')
             if executor_id is None:
-                print(f"[POOL] [send_text] [user {user_id}] has no executor_id")
+                print(f"[POOL] [{tag}] [user {user_id}] has no executor_id")
                 return False
 
             bot = await self.ensure_client(executor_id)
             if not bot:
-                print(f"[POOL] executor '{executor_id}' not connected")
+                print(f"[POOL] [{tag}] [user {user_id}] executor '{executor_id}' not connected")
                 return False
         else:
-            me = await bot.get_me()
-            executor_id = me.id
+            ident = await self.identity(bot)
+            if ident is not None:
+                executor_id = ident.executor_id
+            else:
+                # get_me не прошёл (сбой сети) — берём закреплённого за пользователем исполнителя
+                executor_id = await self.db.get_user_param(user_id, 'executor_id')
+                if executor_id is None:
+                    print(f"[POOL] [{tag}] [user {user_id}] identity unavailable and no executor_id")
+                    return False
+
+        priority = 0 if payload.get("first") else 1   # ответы в живых диалогах — раньше первых контактов
 
         if self.is_sleeping(executor_id):
-            self.defer_for_executor(executor_id, self.send_text(user_id, text, reply_to, first=first))
-            return False
+            return await self._defer_send(executor_id, user_id, kind, payload, key=key, priority=priority)
 
-        user = await self.connect_user(bot, user_id)
+        row_id = None
+        if key is not None:
+            # резервируем ключ до отправки: параллельный повтор увидит строку и не отправит дубль
+            row_id = await self.db.enqueue_outbox(executor_id=executor_id, user_id=user_id, kind=kind,
+                                                  payload=json.dumps(payload), idem_key=key,
+                                                  priority=priority, status=outbox.SENDING)
+            if row_id is None:
+                return await self.db.outbox_status(key) == outbox.SENT
 
-        try:
-            ok = await send_message(bot, user, text=text, reply=reply_to, first=first)
-            await self.db.executor_timestamp(executor_id)
-            return ok
-        
-        except FloodWait as e:
-            await self.sleep_executor(executor_id, float(e.value))
-            self.defer_for_executor(executor_id, self.send_text(user_id, text, reply_to, first=first))
-            print(f"[POOL] [send_text] [executor {executor_id} -> user {user_id}] FloodWait: ждём {e.value} сек")
-            return False
-        
-        except PeerFlood as e:
-            await self.sleep_executor(executor_id, self._current_backoff(executor_id))
-            self._increase_backoff(executor_id)
-            self.defer_for_executor(executor_id, self.send_text(user_id, text, reply_to, first=first))
-            print(f"[POOL] [send_text] [executor {executor_id} -> user {user_id}] Telegram ограничил отправку: {e}")
-            return False
+        status, error = await self._deliver(bot, executor_id, user_id, kind, payload)
 
-        except UserIsBlocked as e:
-            await self.db.update_user_param(user_id, 'banned', True)
-            print(f"[POOL] [send_text] [executor {executor_id} -> user {user_id}] Исполнитель заблокирован пользователем: {e}")
-            return False
-        
-        except RPCError as e:
-            if e.ID == "PRIVACY_PREMIUM_REQUIRED" or "PRIVACY_PREMIUM_REQUIRED" in e.MESSAGE:
-                await self.db.rotate_user_down(user_id)
-                print(f"[POOL] [send_text] [executor {executor_id} -> user {user_id}] Telegram требует от исполнителя Telegram Premium для действия: {e}")
-        
-        except Exception as e:
-            await self.db.rotate_user_down(user_id)
-            print(f"[POOL] [send_text] [executor {executor_id} -> user {user_id}]: {e}")
-            return False
+        if row_id is not None:
+            if status == DEFERRED:
+                await self.db.release_outbox(row_id, not_before=self._sleep_until.get(executor_id, 0.0), error=error)
+            else:
+                await self.db.finish_outbox(row_id, status, error)
+        elif status == DEFERRED:
+            await self._defer_send(executor_id, user_id, kind, payload, priority=priority)
+
+        return status == outbox.SENT
 
 
-    async def send_document(self, user_id: int, path: str, caption: str = "", first: bool = False, bot: Client = None) -> bool:
+    async def _defer_send(self, executor_id: int, user_id: int, kind: str, payload: dict, *,
+                          key: str = None, priority: int = 0) -> bool:
         """
-        Шлёт документ через закреплённого за пользователем исполнителя.
-        Использует готовую функцию send_document(bot, user, ...).
+        Кладёт отправку в outbox исполнителя и поднимает дрейнер.
+        Возвращает True, только если отправка с этим ключом уже ушла раньше.
         """
-        if bot is None:
-            executor_id = await self.db.get_user_param(user_id, 'executor_id')
-            if executor_id is None:
-                print(f"[POOL] [send_document] [user {user_id}] has no executor_id")
-                return False
+        row_id = await self.db.enqueue_outbox(executor_id=executor_id, user_id=user_id, kind=kind,
+                                              payload=json.dumps(payload), idem_key=key or uuid.uuid4().hex,
+                                              priority=priority, not_before=int(self._sleep_until.get(executor_id, 0.0)))
+        if row_id is None:
+            return await self.db.outbox_status(key) == outbox.SENT
+        self._ensure_drainer(executor_id)
+        return False
 
-            bot = await self.ensure_client(executor_id)
-            if not bot:
-                print(f"[POOL] [send_document] [user {user_id}] executor '{executor_id}' not connected")
-                return False
-        else:
-            me = await bot.get_me()
-            executor_id = me.id
 
+    async def _deliver(self, bot: Client, executor_id: int, user_id: int, kind: str, payload: dict) -> Tuple[str, Optional[str]]:
+        """
+        Одна попытка отправки. Возвращает (статус, ошибка):
+        sent — доставлено, failed — не доставлено и повторять не нужно,
+        deferred — исполнитель ушёл в сон, отправку надо повторить после пробуждения.
+        """
+        tag = f"send_{kind}"
+        first = bool(payload.get("first", False))
+        pacer = self._pacer_for(executor_id)
+
+        waited = await self.pace(executor_id, first=first, user_id=user_id)
         if self.is_sleeping(executor_id):
-            self.defer_for_executor(executor_id, self.send_document(user_id, path, caption, first=first))
-            return False
+            # пока ждали очереди, исполнитель поймал ограничение на другой отправке
+            return DEFERRED, f"sleeping after {waited:.0f}s pacing"
 
-        user = await self.connect_user(bot, user_id)
+        user = await self.connect_user(bot, user_id, executor_id=executor_id)
 
         try:
-            ok = await send_document(bot, user, path=path, caption=caption, first=first)
+            if kind == "text":
+                ok = await send_message(bot, user, text=payload["text"], reply=payload.get("reply_to"),
+                                        first=payload.get("first", False))
+            else:
+                ok = await send_document(bot, user, path=payload["path"], caption=payload.get("caption", ""),
+                                         first=payload.get("first", False), db=self.db, executor_id=executor_id)
             await self.db.executor_timestamp(executor_id)
-            return ok
-        
+            if ok:
+                pacer.on_success(first=first)
+            return (outbox.SENT, None) if ok else (outbox.FAILED, None)
+
         except FloodWait as e:
+            pacer.on_flood_wait(float(e.value), first=first)
             await self.sleep_executor(executor_id, float(e.value))
-            self.defer_for_executor(executor_id, self.send_document(user_id, path, caption, first=first))
-            print(f"[POOL] [send_document] [executor {executor_id} -> user {user_id}] FloodWait: ждём {e.value} сек")
-            return False
-        
+            print(f"[POOL] [{tag}] [executor {executor_id} -> user {user_id}] FloodWait: ждём {e.value} сек")
+            return DEFERRED, f"FloodWait {e.value}"
+
         except PeerFlood as e:
+            pacer.on_peer_flood()
             await self.sleep_executor(executor_id, self._current_backoff(executor_id))
             self._increase_backoff(executor_id)
-            self.defer_for_executor(executor_id, self.send_document(user_id, path, caption, first=first))
-            print(f"[POOL] [send_document] [executor {executor_id} -> user {user_id}] Telegram ограничил отправку: {e}")
-            return False
+            print(f"[POOL] [{tag}] [executor {executor_id} -> user {user_id}] Telegram ограничил отправку: {e}")
+            return DEFERRED, "PeerFlood"
 
         except UserIsBlocked as e:
             await self.db.update_user_param(user_id, 'banned', True)
-            print(f"[POOL] [send_document] [executor {executor_id} -> user {user_id}] Исполнитель заблокирован пользователем: {e}")
-            return False
-        
+            print(f"[POOL] [{tag}] [executor {executor_id} -> user {user_id}] Исполнитель заблокирован пользователем: {e}")
+            return outbox.FAILED, "UserIsBlocked"
+
         except RPCError as e:
+            if e.ID in _PEER_ERRORS:
+                self.forget_peer(executor_id, user_id)
             if e.ID == "PRIVACY_PREMIUM_REQUIRED" or "PRIVACY_PREMIUM_REQUIRED" in e.MESSAGE:
                 await self.db.rotate_user_down(user_id)
-                print(f"[POOL] [send_document] [executor {executor_id} -> user {user_id}] Telegram требует от исполнителя Telegram Premium для действия: {e}")
+                print(f"[POOL] [{tag}] [executor {executor_id} -> user {user_id}] Telegram требует от исполнителя Telegram Premium для действия: {e}")
+            return outbox.FAILED, str(e.ID)
 
         except Exception as e:
+            if isinstance(e, (KeyError, ValueError)):
+                self.forget_peer(executor_id, user_id)   # так pyrogram сообщает «Peer id invalid»
             await self.db.rotate_user_down(user_id)
-            print(f"[POOL] [send_document] [executor {executor_id} -> user {user_id}]: {e}")
-            return False
+            print(f"[POOL] [{tag}] [executor {executor_id} -> user {user_id}]: {e}")
+            return outbox.FAILED, str(e)
+
+
+    async def _replay_outbox(self, executor_id: int, *, page_size: int = 50) -> None:
+        """
+        Доотправляет outbox исполнителя по порядку (приоритет, затем время постановки).
+        Останавливается, как только исполнитель снова уснул.
+        """
+        earliest = await self.db.outbox_earliest(executor_id)
+        if earliest is None:
+            return
+        if earliest > self._now():
+            # сон был до перезапуска — досыпаем, дрейнер вернётся сюда после пробуждения
+            await self.sleep_executor(executor_id, earliest - self._now())
+            return
+
+        bot = await self.ensure_client(executor_id)
+        if not bot:
+            print(f"[POOL] [outbox] executor '{executor_id}' not connected")
+            return
+
+        sent = 0
+        while not self.is_sleeping(executor_id) and not self._stop.is_set():
+            rows = await self.db.next_outbox(executor_id, limit=page_size)
+            if not rows:
+                break
+            for row in rows:
+                if self.is_sleeping(executor_id) or self._stop.is_set():
+                    break
+                if not await self.db.claim_outbox(row.id):
+                    continue
+                status, error = await self._deliver(bot, executor_id, row.user_id, row.kind, json.loads(row.payload))
+                if status == DEFERRED:
+                    await self.db.release_outbox(row.id, not_before=self._sleep_until.get(executor_id, 0.0), error=error)
+                    break
+                await self.db.finish_outbox(row.id, status, error)
+                sent += status == outbox.SENT
+
+        if sent:
+            print(f"[POOL] [outbox] [executor {executor_id}] доотправлено: {sent}")
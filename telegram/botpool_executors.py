@@ -121,8 +121,7 @@ async def add_executor(self, *, name: str, api_id: int, api_hash: str, phone: st
                 eid = me.id
                 phone = me.phone_number
             
-            async with self.db.executors() as executors_repo:
-                await executors_repo.add_executor(name, api_id, api_hash, executor_id=eid, phone=phone, session_string=session_string, proxy_port=port, **kwargs)
+            await self.db.add_executor(name, api_id, api_hash, executor_id=eid, phone=phone, session_string=session_string, proxy_port=port, **kwargs)
 
         except Exception as e:
             print("Failed to connect with provided session_string:", e)
@@ -136,8 +135,7 @@ async def add_executor(self, *, name: str, api_id: int, api_hash: str, phone: st
 
     eid, session_string = await self.create_session(phone=phone, api_id=api_id, api_hash=api_hash, name=name, proxy_port=port)
 
-    async with self.db.executors() as executors_repo:
-        await executors_repo.add_executor(name, api_id, api_hash, executor_id=eid, phone=phone, session_string=session_string, proxy_port=port, **kwargs)
+    await self.db.add_executor(name, api_id, api_hash, executor_id=eid, phone=phone, session_string=session_string, proxy_port=port, **kwargs)
 
     return eid
 
@@ -191,6 +189,7 @@ async def reload_executor(
 
         old_cli = self._clients.pop(executor_id, None)
         if old_cli is not None:
+            self.forget_identity(old_cli)
             with contextlib.suppress(Exception):
                 if getattr(old_cli, "is_connected", False) or getattr(old_cli, "is_initialized", False):
                     await old_cli.stop()
@@ -221,6 +220,7 @@ async def delete_executor(self, *, executor_id=None, name=None) -> bool:
 
     client = self._clients.pop(executor_id, None)
     if client is not None:
+        self.forget_identity(client)
         with suppress(Exception):
             if getattr(client, "is_connected", False) or getattr(client, "is_initialized", False):
                 await client.stop()
@@ -236,8 +236,6 @@ async def delete_executor(self, *, executor_id=None, name=None) -> bool:
         with suppress(Exception):
             while not q.empty():
                 _ = q.get_nowait()
-                if isinstance(_, asyncio.Task):
-                    _.cancel()
 
     evt = self._sleep_events.pop(executor_id, None)
     if evt is not None:
@@ -250,5 +248,8 @@ async def delete_executor(self, *, executor_id=None, name=None) -> bool:
 
     self._locks.pop(executor_id, None)
 
-    async with self.db.executors() as executors_repo:
-        deleted = await executors_repo.delete_executor(executor_id=executor_id)
\ No newline at end of file
+    with suppress(Exception):
+        await self.db.drop_outbox(executor_id)
+
+    deleted = await self.db.delete_executor(executor_id=executor_id)
+    return deleted
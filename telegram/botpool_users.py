@@ -1,65 +1,116 @@
 # Методы botpool для работы с пользователями
 
 import asyncio
+from typing import Dict, Iterable, List, Tuple
 from pyrogram import Client
+from pyrogram.errors import FloodWait, RPCError
 from pyrogram.types import User as PyroUser
 from pyrogram.raw.types import User as RawUser
 from pyrogram.raw.types import InputUser
 from pyrogram.raw.functions.users import GetUsers
-from .botpool_utils import get_hash_via_discussion, get_access_hash_from_user_id
+from sqlalchemy.exc import IntegrityError
+from settings import get
+from .botpool_utils import get_access_hash_from_user_id
 
 
 async def add_user(self, *, user_id: int, executor_id: int = None, 
                     access_hash: int = None, link: str = None,
-                    info: str = None, **kwargs) -> int:
+                    info: str = None, **kwargs) -> int | None:
     """
-    Добавляет пользователя в БД (через UsersRepo.add_user),
-    назначает исполнителя, получает username/phone/access_hash через Pyrogram
-    и обновляет запись в БД.
+    Добавляет пользователя в БД (через UsersRepo.add_user) и дополняет запись (см. enrich_user).
     Возвращает executor_id назначенного исполнителя.
     """
     await self.db.add_user(user_id=user_id, executor_id=executor_id, access_hash=access_hash, info=info, **kwargs)
+    return await self.enrich_user(user_id=user_id, executor_id=executor_id, access_hash=access_hash, link=link,
+                                  username=kwargs.get('username'), phone=kwargs.get('phone'), info=info)
 
-    assigned_executor = executor_id
-    assigned_executor = await self.db.assign_executor(user_id, executor_id)
 
+async def enrich_user(self, *, user_id: int, executor_id: int = None, access_hash: int = None,
+                      link: str = None, username: str = None, phone: str = None, info: str = None) -> int | None:
+    """
+    Для уже вставленного пользователя: назначает исполнителя и дополняет запись (см. resolve_user).
+    Возвращает executor_id назначенного исполнителя (None — назначить не удалось).
+    """
+    assigned_executor = await self.db.assign_executor(user_id, executor_id)
     if assigned_executor is None:
-        return user_id
+        return None
+    await self.resolve_user(user_id=user_id, executor_id=assigned_executor, access_hash=access_hash,
+                            link=link, username=username, phone=phone, info=info)
+    return assigned_executor
 
-    bot = await self.ensure_client(assigned_executor)
-    if not bot:
-        await self.db.update_user_param(target=user_id, column='executor_id', value=assigned_executor)
-        return user_id
 
-    try:
-        access_hash = access_hash or await self.get_access_hash(bot, user_id, link=link)
-        username = kwargs.get('username') or await self.get_username_by_id(bot, user_id, access_hash)
-        phone = kwargs.get('phone') or await self.get_phone_by_id(bot, user_id, access_hash)
-
-        await self.db.update_user_param(user_id, 'executor_id', assigned_executor)
-        if username:
-            await self.db.update_user_param(user_id, 'username', username)
-        if phone:
-            await self.db.update_user_param(user_id, 'phone', phone)
-        if access_hash:
-            await self.db.update_user_param(user_id, 'access_hash', access_hash)
+async def resolve_user(self, *, user_id: int, executor_id: int, access_hash: int = None,
+                       link: str = None, username: str = None, phone: str = None, info: str = None,
+                       link_tried: bool = False) -> dict:
+    """
+    Пользователь уже назначен исполнителю executor_id: получает username/phone/access_hash
+    через его клиента и пишет всё одним UPDATE. Возвращает записанные поля.
+    link_tried — ссылку уже разбирали пачкой (DiscussionResolver.resolve_many), повторно не запрашиваем.
+    """
+    fields = {'executor_id': executor_id}
+    bot = await self.ensure_client(executor_id)
+    if bot:
+        try:
+            access_hash = access_hash or await self.get_access_hash(bot, user_id, link=None if link_tried else link)
+            if not (username and phone):
+                # username и телефон из одного запроса
+                user = await self.connect_user(bot, user_id, access_hash, executor_id=executor_id)
+                username = username or _username_of(user, user_id)
+                phone = phone or _phone_of(user)
 
-        if phone:
-            more = f"\n\nTG phone NUMBER: {phone}"
-            cur_info = await self.db.get_user_param(user_id, 'info') or ""
-            await self.db.update_user_param(user_id, 'info', (cur_info + more))
+            if username:
+                fields['username'] = username
+            if phone:
+                fields['phone'] = phone
+            if access_hash:
+                fields['access_hash'] = access_hash
 
-    except Exception as e:
-        print(f"[POOL] [add_user] [user {user_id}] {e}")
+            if phone:
+                cur_info = info if info is not None else await self.db.get_user_param(user_id, 'info')
+                fields['info'] = (cur_info or "") + f"\n\nTG phone NUMBER: {phone}"
 
-    return assigned_executor
+        except FloodWait as e:
+            await self.sleep_executor(executor_id, float(e.value))
+            print(f"[POOL] [resolve_user] [executor {executor_id}] FloodWait: ждём {e.value} сек")
+        except Exception as e:
+            print(f"[POOL] [add_user] [user {user_id}] {e}")
+
+    try:
+        await self.db.update_user_fields(user_id, **fields)
+    except IntegrityError as e:
+        if 'username' not in fields:
+            raise
+        # username уже занят другим пользователем (UNIQUE) — теряем только его, исполнитель и access_hash пишем
+        print(f"[POOL] [resolve_user] [user {user_id}] username {fields['username']!r} занят, пишем без него: {e.orig}")
+        fields.pop('username')
+        await self.db.update_user_fields(user_id, **fields)
+    return fields
 
 
-async def connect_user(self, bot: Client, user_id: int, access_hash: int = None) -> PyroUser | RawUser:
+async def connect_user(self, bot: Client, user_id: int, access_hash: int = None, *,
+                       executor_id: int = None) -> PyroUser | RawUser:
     """
     Возвращает pyrogram.types.User при наличии доступа.
     Возвращает pyrogram.raw.types.User при отсутствии доступа, если есть access_hash.
+    Найденный пользователь кешируется по (executor_id, user_id): повторно в Telegram не ходим,
+    пока запись не устарела или не сброшена через forget_peer.
     """
+    if executor_id is None:
+        ident = await self.identity(bot)
+        executor_id = ident.executor_id if ident else None
+
+    if executor_id is not None:
+        cached = self._peers.get((executor_id, user_id))
+        if cached is not None:
+            return cached
+
+    user = await _fetch_user(self, bot, user_id, access_hash)
+    if user is not None and executor_id is not None:
+        self._peers.set((executor_id, user_id), user)
+    return user
+
+
+async def _fetch_user(self, bot: Client, user_id: int, access_hash: int = None) -> PyroUser | RawUser:
     if access_hash is None:
         access_hash = await self.db.get_user_param(user_id, 'access_hash')
 
@@ -84,22 +135,103 @@ async def connect_user(self, bot: Client, user_id: int, access_hash: int = None)
     return None
 
 
+def forget_peer(self, executor_id: int, user_id: int) -> None:
+    """Сбросить закешированного пользователя (например, после PEER_ID_INVALID)."""
+    self._peers.pop((executor_id, user_id))
+
+
+async def resolve_users(self, pairs: Iterable[Tuple[int, int]], *, chunk_size: int = None,
+                        pause: float = None) -> Dict[Tuple[int, int], RawUser | PyroUser]:
+    """
+    Пакетно получает пользователей: пары (executor_id, user_id) группируются по исполнителю,
+    у каждого — запросы users.GetUsers по chunk_size id с паузой pause между ними.
+    Исполнители работают параллельно. Результат попадает в кеш connect_user.
+    Возвращает (executor_id, user_id) -> пользователь; кого получить не удалось — в словаре нет.
+    """
+    by_executor: Dict[int, List[int]] = {}
+    for executor_id, user_id in pairs:
+        by_executor.setdefault(executor_id, []).append(user_id)
+
+    results = await asyncio.gather(*(
+        _resolve_for_executor(self, executor_id, user_ids, chunk_size=chunk_size, pause=pause)
+        for executor_id, user_ids in by_executor.items()
+    ))
+    return {
+        (executor_id, user_id): user
+        for executor_id, found in zip(by_executor, results)
+        for user_id, user in found.items()
+    }
+
+
+async def _resolve_for_executor(self, executor_id: int, user_ids: List[int], *, chunk_size: int = None,
+                                pause: float = None) -> Dict[int, RawUser | PyroUser]:
+    chunk_size = chunk_size or int(get("RESOLVE_CHUNK") or 100)
+    pause = float(get("RESOLVE_PAUSE") or 1.0) if pause is None else pause
+
+    found: Dict[int, RawUser | PyroUser] = {}
+    todo: List[int] = []
+    for user_id in dict.fromkeys(user_ids):
+        cached = self._peers.get((executor_id, user_id))
+        if cached is not None:
+            found[user_id] = cached
+        else:
+            todo.append(user_id)
+    if not todo:
+        return found
+
+    bot = await self.ensure_client(executor_id)
+    if not bot:
+        print(f"[POOL] [resolve_users] executor '{executor_id}' not connected")
+        return found
+
+    hashes = await self.db.access_hashes(todo)
+    inputs = []
+    for user_id in todo:
+        access_hash = hashes.get(user_id)
+        if access_hash is None:
+            try:
+                access_hash = (await bot.resolve_peer(user_id)).access_hash
+            except Exception:
+                continue
+        inputs.append(InputUser(user_id=user_id, access_hash=access_hash))
+
+    for i in range(0, len(inputs), chunk_size):
+        if i and pause:
+            await asyncio.sleep(pause)
+        if self.is_sleeping(executor_id):
+            break
+        try:
+            users = await bot.invoke(GetUsers(id=inputs[i:i + chunk_size]))
+        except FloodWait as e:
+            await self.sleep_executor(executor_id, float(e.value))
+            print(f"[POOL] [resolve_users] [executor {executor_id}] FloodWait: ждём {e.value} сек")
+            break
+        except RPCError as e:
+            print(f"[POOL] [resolve_users] [executor {executor_id}] {e}")
+            continue
+        for user in users:
+            if isinstance(user, RawUser):
+                found[user.id] = user
+                self._peers.set((executor_id, user.id), user)
+
+    return found
+
+
 async def get_access_hash(self, bot: Client, user_id: int, *, link: str | None = None) -> int | None:
     """
     Возвращает access_hash.
     Порядок получения:
-    1. Если указана ссылка на сообщение в чате, то получает через нее.
+    1. Если указана ссылка на сообщение в чате, то получает через нее (DiscussionResolver клиента).
     2. Поиск в БД
     3. resolve_peer, если пользователь написал боту
     """
     if link:
-        uid, access_hash = await get_hash_via_discussion(bot, link)
-
-    if uid != user_id:
-        print(f"[POOL] [get_access_hash] [user {user_id}] не совпали требуемый и найденный user_id = {uid}")
-        return None
-    if access_hash:
-        return access_hash
+        uid, access_hash = await self.discussion(bot).resolve(link)
+        if uid is not None and uid != user_id:
+            print(f"[POOL] [get_access_hash] [user {user_id}] не совпали требуемый и найденный user_id = {uid}")
+            return None
+        if access_hash:
+            return access_hash
 
     access_hash = await self.db.get_user_param(user_id, 'access_hash')
     if access_hash:
@@ -109,30 +241,34 @@ async def get_access_hash(self, bot: Client, user_id: int, *, link: str | None =
     return access_hash
 
 
+def _username_of(user: PyroUser | RawUser | None, user_id: int) -> str:
+    if isinstance(user, PyroUser):
+        return user.username or (f"+{user.phone_number}" if user.phone_number else f"User_id_{user.id}")
+    if isinstance(user, RawUser):
+        return user.username or (f"+{user.phone}" if user.phone else f"User_id_{user.id}")
+    return f"User_id_{user_id}"
+
+
+def _phone_of(user: PyroUser | RawUser | None) -> str | None:
+    if isinstance(user, PyroUser):
+        return f"+{user.phone_number}" if user.phone_number else None
+    if isinstance(user, RawUser):
+        return f"+{user.phone}" if user.phone else None
+    return None
+
+
 async def get_username_by_id(self, bot: Client, user_id: int, access_hash: int = None) -> str:
     """
     Получает username по user_id. Если его нет, вернёт телефон или "User_id_xxx"
     """
     try:
-        user = await self.connect_user(bot, user_id, access_hash)
-        if not user:
-            return f"User_id_{user_id}"
-        if isinstance(user, PyroUser):
-            return user.username or (f"+{user.phone_number}" if user.phone_number else f"User_id_{user.id}")
-        if isinstance(user, RawUser):
-            return user.username or (f"+{user.phone}" if user.phone else f"User_id_{user.id}")
+        return _username_of(await self.connect_user(bot, user_id, access_hash), user_id)
     except Exception:
         return f"User_id_{user_id}"
 
 
 async def get_phone_by_id(self, bot: Client, user_id: int, access_hash: int = None) -> str | None:
     try:
-        user = await self.connect_user(bot, user_id, access_hash)
-        if not user:
-            return None
-        if isinstance(user, PyroUser):
-            return f"+{user.phone_number}" if user.phone_number else None
-        if isinstance(user, RawUser):
-            return f"+{user.phone}" if user.phone else None
+        return _phone_of(await self.connect_user(bot, user_id, access_hash))
     except Exception:
-        return None
\ No newline at end of file
+        return None
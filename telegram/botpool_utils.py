@@ -8,74 +8,188 @@ from pyrogram import Client, errors
 from pyrogram.raw import functions, types
 from pyrogram.raw.types import ChannelParticipantsRecent, InputChannel, Message, User as RawUser
 
+from db_modules.cache import TTLCache
 
-async def get_hash_via_discussion(app: Client, link: str) -> tuple[Optional[int], Optional[int]]:
+
+Ref = tuple[Optional[int], Optional[int]]   # (user_id, access_hash) автора или (None, None)
+
+_NOT_FOUND = object()   # отрицательный результат в кеше (канал/обсуждение не найдены)
+
+
+def parse_message_link(link: str) -> Optional[tuple[str, int, Optional[int]]]:
     """
-    Возвращает (user_id, access_hash) автора сообщения или комментария.
-    Поддерживает:
-      - https://t.me/<username>/<msg_id>
-      - https://t.me/<username>/<post_id>?comment=<comment_id>
+    https://t.me/<username>/<msg_id>[?comment=<comment_id>] -> (username, msg_id, comment_id).
+    None — ссылка не распознана.
     """
     try:
         url = urlparse(link)
         parts = url.path.strip("/").split("/")
         if len(parts) < 2:
-            return None, None
-
-        username = parts[0]
-        primary_id = int(parts[1])
+            return None
         q = parse_qs(url.query)
         comment_id = int(q.get("comment", [0])[0]) if "comment" in q else None
+        return parts[0], int(parts[1]), comment_id or None
+    except Exception:
+        return None
+
+
+class DiscussionResolver:
+    """
+    Авторы сообщений и комментариев по ссылкам t.me — через один клиент (исполнителя).
+    Кеширует peer каналов и соответствие «пост -> чат обсуждения»,
+    ссылки на один и тот же чат собирает в один channels.GetMessages (до batch_size id).
+    """
 
-        if comment_id:
-            discussion_msg = await app.get_discussion_message(username, primary_id)
-            if not discussion_msg or not discussion_msg.chat:
-                return None, None
+    def __init__(self, app: Client, *, ttl: float = 6*3600.0, negative_ttl: float = 600.0, batch_size: int = 100):
+        self.app = app
+        self.negative_ttl = negative_ttl
+        self.batch_size = batch_size
+        self._channels = TTLCache(maxsize=2000, ttl=ttl)       # username -> peer канала
+        self._discussions = TTLCache(maxsize=10000, ttl=ttl)   # (username, post_id) -> peer чата обсуждения
 
-            discussion_peer = await app.resolve_peer(discussion_msg.chat.id)
+        # счётчики запросов к Telegram
+        self.links = 0
+        self.get_messages_calls = 0
+        self.discussion_calls = 0
+        self.resolve_calls = 0
 
-            res = await app.invoke(
-                functions.channels.GetMessages(
-                    channel=discussion_peer,
-                    id=[types.InputMessageID(id=comment_id)]
-                )
-            )
-        else:
-            chat_peer = await app.resolve_peer(username)
-            res = await app.invoke(
-                functions.channels.GetMessages(
-                    channel=chat_peer,
-                    id=[types.InputMessageID(id=primary_id)]
-                )
+
+    async def _channel_peer(self, username: str):
+        peer = self._channels.get(username, None)
+        if peer is None:
+            self.resolve_calls += 1
+            try:
+                peer = await self.app.resolve_peer(username)
+            except errors.FloodWait:
+                raise
+            except Exception as e:
+                logging.debug(f"[discussion] resolve_peer({username}) error={e}")
+                peer = _NOT_FOUND
+            self._channels.set(username, peer, ttl=self.negative_ttl if peer is _NOT_FOUND else None)
+        return None if peer is _NOT_FOUND else peer
+
+
+    async def _discussion_peer(self, username: str, post_id: int):
+        key = (username, post_id)
+        peer = self._discussions.get(key, None)
+        if peer is None:
+            self.discussion_calls += 1
+            try:
+                discussion_msg = await self.app.get_discussion_message(username, post_id)
+                if not discussion_msg or not discussion_msg.chat:
+                    peer = _NOT_FOUND
+                else:
+                    peer = await self.app.resolve_peer(discussion_msg.chat.id)
+            except errors.FloodWait:
+                raise
+            except Exception as e:
+                logging.debug(f"[discussion] get_discussion_message({username}, {post_id}) error={e}")
+                peer = _NOT_FOUND
+            self._discussions.set(key, peer, ttl=self.negative_ttl if peer is _NOT_FOUND else None)
+        return None if peer is _NOT_FOUND else peer
+
+
+    async def _fetch_authors(self, peer, msg_ids: list[int]) -> dict[int, Ref]:
+        """msg_id -> (user_id, access_hash) автора; сообщения одного чата — одним запросом."""
+        self.get_messages_calls += 1
+        res = await self.app.invoke(
+            functions.channels.GetMessages(
+                channel=peer,
+                id=[types.InputMessageID(id=msg_id) for msg_id in msg_ids]
             )
+        )
+        hashes = {
+            u.id: u.access_hash
+            for u in getattr(res, "users", None) or []
+            if isinstance(u, types.User) and getattr(u, "access_hash", None)
+        }
 
-        if not getattr(res, "messages", None):
-            return None, None
+        authors: dict[int, Ref] = {}
+        for msg in getattr(res, "messages", None) or []:
+            if not isinstance(msg, types.Message):
+                continue
+            from_id = getattr(msg.from_id, "user_id", None)
+            if not from_id:
+                continue
+            access_hash = hashes.get(from_id)
+            if access_hash is None:
+                try:
+                    input_peer = await self.app.resolve_peer(from_id)
+                    if isinstance(input_peer, types.InputPeerUser):
+                        access_hash = input_peer.access_hash
+                except Exception:
+                    pass
+            if access_hash:
+                authors[msg.id] = (int(from_id), int(access_hash))
+        return authors
 
-        msg = res.messages[0]
-        if not isinstance(msg, types.Message):
-            return None, None
 
-        from_id = getattr(msg.from_id, "user_id", None)
-        if not from_id:
-            return None, None
+    async def resolve_many(self, links: list[str]) -> dict[str, Ref]:
+        """
+        Авторы для пачки ссылок: link -> (user_id, access_hash), (None, None) — не удалось.
+        Ссылки группируются по чату (канал или его обсуждение), на чат — GetMessages по batch_size id.
+        FloodWait пробрасывается вызывающему: исполнителя надо усыпить (BotPool.sleep_executor),
+        а не добивать оставшиеся ссылки по одной.
+        """
+        result: dict[str, Ref] = {link: (None, None) for link in links}
+        groups: dict[int, tuple[object, dict[int, list[str]]]] = {}   # id чата -> (peer, msg_id -> ссылки)
 
-        if getattr(res, "users", None):
-            for u in res.users:
-                if isinstance(u, types.User) and u.id == from_id and getattr(u, "access_hash", None):
-                    return int(u.id), int(u.access_hash)
+        for link in result:
+            self.links += 1
+            parsed = parse_message_link(link)
+            if parsed is None:
+                continue
+            username, primary_id, comment_id = parsed
+            if comment_id:
+                peer, msg_id = await self._discussion_peer(username, primary_id), comment_id
+            else:
+                peer, msg_id = await self._channel_peer(username), primary_id
+            if peer is None:
+                continue
+            chat = getattr(peer, "channel_id", None) or id(peer)
+            groups.setdefault(chat, (peer, {}))[1].setdefault(msg_id, []).append(link)
 
-        try:
-            peer = await app.resolve_peer(from_id)
-            if isinstance(peer, types.InputPeerUser) and getattr(peer, "access_hash", None):
-                return int(from_id), int(peer.access_hash)
-        except Exception:
-            pass
+        for peer, by_msg in groups.values():
+            msg_ids = list(by_msg)
+            for i in range(0, len(msg_ids), self.batch_size):
+                try:
+                    authors = await self._fetch_authors(peer, msg_ids[i:i + self.batch_size])
+                except errors.FloodWait:
+                    raise
+                except Exception as e:
+                    logging.debug(f"[discussion] GetMessages error={e}")
+                    continue
+                for msg_id, author in authors.items():
+                    for link in by_msg.get(msg_id, ()):
+                        result[link] = author
 
-        return None, None
+        return result
 
-    except Exception:
-        return None, None
+
+    async def resolve(self, link: str) -> Ref:
+        return (await self.resolve_many([link]))[link]
+
+
+    def stats(self) -> dict:
+        return {
+            "links": self.links,
+            "get_messages": self.get_messages_calls,
+            "get_discussion_message": self.discussion_calls,
+            "resolve_peer": self.resolve_calls,
+            "channels_cached": len(self._channels),
+            "discussions_cached": len(self._discussions),
+        }
+
+
+async def get_hash_via_discussion(app: Client, link: str) -> Ref:
+    """
+    Возвращает (user_id, access_hash) автора сообщения или комментария.
+    Поддерживает:
+      - https://t.me/<username>/<msg_id>
+      - https://t.me/<username>/<post_id>?comment=<comment_id>
+    Без кеша; для потока ссылок — DiscussionResolver исполнителя (BotPool.discussion).
+    """
+    return await DiscussionResolver(app).resolve(link)
     
 
 async def get_access_hash_from_user_id(bot: Client, user_id: int) -> int | None:
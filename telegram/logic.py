@@ -13,7 +13,7 @@ from pyrogram.raw.types import User as RawUser
 # from assistant.gpt import get_assistant_response_
 from db_modules.controller import DatabaseController
 from telegram.botpool import BotPool
-from assistant.gpt import Assistant
+from assistant.gpt import Assistant, LIVE
 
 
 def build_logic(pool: BotPool, db: DatabaseController, assistant: Assistant, state, settings):
@@ -28,36 +28,37 @@ def build_logic(pool: BotPool, db: DatabaseController, assistant: Assistant, sta
             return
         uid = user.id
 
-        async with db.users() as users_repo:
-            if not await users_repo.has_user(uid):
-                return  # Неизвестный пользователь
-            if await users_repo.get_user_param(uid, 'banned'):
-                return  # Не отвечаем забаненным пользователям
-            
-            await db.user_timestamp(uid)
-            
-            executor_id = await users_repo.get_user_param(uid, 'executor_id')
-            me = await bot.get_me()
-            if me.id != executor_id:  # Проверка, что написали закрепленному исполнителю
-                return
-            
-            access_hash = await users_repo.get_user_param(uid, 'access_hash')
-            if access_hash is None:
-                await pool.connect_user(bot, uid)
-                
+        gate = await db.inbound_gate(uid)
+        if gate is None:
+            return  # Неизвестный пользователь
+        if gate['banned']:
+            return  # Не отвечаем забаненным пользователям
+
+        executor_id = gate['executor_id']
+        me = await pool.identity(bot)
+        if me is None or me.executor_id != executor_id:  # Проверка, что написали закрепленному исполнителю
+            return
+
+        # отметка времени пишется отложенно и не задерживает ответ
+        await db.user_timestamp(uid)
+
+        if gate['access_hash'] is None:
+            await pool.connect_user(bot, uid)
+
         # если спит — только буферизуем и уходим
         if pool.is_sleeping(executor_id):
             state.append_to_buffer(uid, f"[MESSAGE_ID: {message.id}]\n{message.text}")
-            state.touch_user(uid)
+            state.touch_user(uid, message.id)
             # можно отложить обработку буфера до пробуждения
-            pool.defer_for_executor(executor_id, handle_user_buffer(bot, user))
+            pool.defer_for_executor(executor_id, lambda: handle_user_buffer(bot, user))
             return
 
         state.append_to_buffer(uid, f"[MESSAGE_ID: {message.id}]\n{message.text}")
-        state.touch_user(uid)
+        state.touch_user(uid, message.id)
         state.cancel_user_task(uid)
-        state.cancel_inactivity_task(uid)
-        state.user_tasks[uid] = asyncio.create_task(handle_user_buffer(bot, user))
+        await db.cancel_followup(uid)
+        # ответ уйдёт ровно через BUFFER_TIME после последнего сообщения
+        state.debounce(uid, settings.get('BUFFER_TIME'), lambda: handle_user_buffer(bot, user))
 
 
     async def handle_user_buffer(bot: Client, user: PyroUser | RawUser):
@@ -68,8 +69,7 @@ def build_logic(pool: BotPool, db: DatabaseController, assistant: Assistant, sta
         typing_active = True
         typing_task = None
 
-        async with db.users() as users_repo:
-            executor_id = await users_repo.get_user_param(uid, "executor_id")
+        executor_id = await db.get_user_param(uid, "executor_id")
 
         async def typing_loop():
             while typing_active:
@@ -83,21 +83,20 @@ def build_logic(pool: BotPool, db: DatabaseController, assistant: Assistant, sta
                 await asyncio.sleep(5)
 
         try:
-            # Ожидание нескольких сообщений подряд
-            while True:
-                await asyncio.sleep(1)
-                if state.last_gap(uid) >= settings.get('BUFFER_TIME'):
-                    break
+            # пауза на «несколько сообщений подряд» уже выдержана таймером state.debounce
             try:
                 await bot.read_chat_history(uid)
             except Exception:
                 pass
 
+            # ответ на одну и ту же пачку входящих уходит один раз, даже если обработка буфера запустилась дважды
+            last_id = state.last_message_ids.get(uid)
             combined_input = state.pop_buffer(uid)
             await asyncio.sleep(random.randint(0, settings.get('DELAY')))   # "В сети"
 
             typing_task = asyncio.create_task(typing_loop())
-            await handle_assistant_response(bot, user, combined_input)
+            await handle_assistant_response(bot, user, combined_input,
+                                            key=f"reply:{uid}:{last_id}" if last_id is not None else None)
 
         except asyncio.CancelledError:
             pass
@@ -116,11 +115,15 @@ def build_logic(pool: BotPool, db: DatabaseController, assistant: Assistant, sta
     #         reset_inactivity_timer(bot, user, first)
 
 
-    async def handle_assistant_response(bot: Client, user: PyroUser | RawUser, message: str, wait_after=True, first=False) -> bool:
+    async def handle_assistant_response(bot: Client, user: PyroUser | RawUser, message: str, wait_after=True, first=False,
+                                        priority: int = LIVE, key: str = None) -> bool:
         """
         Вызывает и обрабатывает ответ ассистента. Посылает ответ.
+        priority — класс запроса к модели; для FOLLOWUP/GREETING возможен AdmissionRejected.
+        key — ключ идемпотентности ответа: текст и файл с тем же ключом второй раз не уходят.
         """
-        response = await assistant.get_assistant_response(message, user.id)
+        response = await assistant.get_assistant_response(message, user.id, priority=priority)
+        first_token_at = getattr(response, "first_token_at", None)
         response = response.output_text
 
         data = json.loads(response)
@@ -130,20 +133,26 @@ def build_logic(pool: BotPool, db: DatabaseController, assistant: Assistant, sta
         need_wait = data['wait']
         reply_id = data['reply']
 
-        await asyncio.sleep(min(len(answer) * settings.get('TYPING_DELAY'), 10.0))
+        typing = min(len(answer) * settings.get('TYPING_DELAY'), 10.0)
+        if first_token_at is not None:
+            # «печать» идёт с первого токена, параллельно генерации
+            typing -= time.monotonic() - first_token_at
+        await asyncio.sleep(max(0.0, typing))
 
         ok = False
 
         try:
             if send_msg:
-                ok = await pool.send_text(bot=bot, user_id=user.id, text=answer, reply_to=reply_id, first=first)
+                ok = await pool.send_text(bot=bot, user_id=user.id, text=answer, reply_to=reply_id, first=first,
+                                          key=f"{key}:text" if key else None)
             
             if send_pdf:
                 file_path = f"data/catalog.pdf"
-                ok = await pool.send_document(bot=bot, user_id=user.id, path=file_path, caption='', first=first)
+                ok = await pool.send_document(bot=bot, user_id=user.id, path=file_path, caption='', first=first,
+                                              key=f"{key}:file" if key else None)
 
             if need_wait and wait_after:
-                reset_inactivity_timer(bot, user, first)
+                await reset_inactivity_timer(user, first)
         
         except Exception as e:
             print(f"[handle_assistant_response] {e}")
@@ -153,26 +162,13 @@ def build_logic(pool: BotPool, db: DatabaseController, assistant: Assistant, sta
         return ok
 
 
-    async def inactivity_push(bot: Client, user: PyroUser | RawUser, first: bool):
-        try:
-            await asyncio.sleep(settings.get('INACTIVITY_TIMEOUT'))
-            await handle_assistant_response(
-                bot, user, "SYSTEM: Клиент долго не отвечает, напиши ему еще раз",
-                wait_after=False, first=first
-                )
-        except asyncio.CancelledError:
-            pass
-        finally:
-            state.cancel_inactivity_task(user.id)
-
-
-    def reset_inactivity_timer(bot: Client, user: PyroUser | RawUser, first: bool):
+    async def reset_inactivity_timer(user: PyroUser | RawUser, first: bool):
         """
-        Сбрасывает (перезапускает) таймер неактивности пользователя.
-        Если старая задача была — отменяем её.
+        Назначает (переназначает) напоминание молчащему клиенту.
+        Срок хранится в БД (users.followup_at), рассылает services.followup.inactivity_sweeper.
         """
-        task = asyncio.create_task(inactivity_push(bot, user, first))
-        state.set_inactivity_task(user.id, task)
+        due_at = int(time.time() + settings.get('INACTIVITY_TIMEOUT'))
+        await db.schedule_followup(user.id, due_at, first=first)
 
 
     return {
@@ -0,0 +1,227 @@
+# Ограничение частоты запросов исполнителя к Telegram
+
+import asyncio
+import time
+import datetime as dt
+from zoneinfo import ZoneInfo
+from typing import Callable, Optional
+
+from settings import get
+
+
+class TokenBucket:
+    """
+    Ведро токенов: в среднем rate запросов в секунду, всплеск до capacity.
+    acquire() ждёт, пока наберётся нужное число токенов; ожидающие обслуживаются по очереди.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Забрать токены без ожидания. False — ведро пусто."""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Сколько секунд ждать, пока наберётся tokens токенов."""
+        self._refill()
+        if self._tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Дождаться и забрать токены. Возвращает, сколько секунд пришлось ждать."""
+        waited = 0.0
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                pause = max(self.delay(tokens), 0.001)
+                await asyncio.sleep(pause)
+                waited += pause
+        return waited
+
+
+class SendPacer:
+    """
+    Темп исходящих сообщений одного исполнителя: ограничиваемся заранее, а не после FloodWait.
+    Два ведра: общее (все отправки) и первых контактов (написать незнакомому — самое рискованное).
+    Скорости подстраиваются по опыту:
+    - FloodWait режет общую скорость вдвое (и скорость первых контактов, если флуд на первом контакте);
+    - PeerFlood режет вдвое скорость первых контактов;
+    - каждые success_window удачных отправок подряд скорость плавно растёт (до потолка).
+    Ограничения запоминаются по часам суток (с затуханием): в «опасные» часы темп ниже.
+    Часы считаются в поясе TIMEZONE. Выученное состояние (snapshot/restore) переживает перезапуск:
+    on_change вызывается при каждом его изменении, пул сохраняет его в executors.
+    """
+
+    def __init__(self, *, rate: float = 0.5, first_rate: float = 1/60,
+                 min_rate: float = 1/120, max_rate: float = 1.0,
+                 min_first_rate: float = 1/3600, max_first_rate: float = 1/15,
+                 burst: float = 3, increase: float = 1.1, success_window: int = 20,
+                 hour_half_life: float = 3*24*3600.0):
+        self.rate = rate
+        self.first_rate = first_rate
+        self.min_rate, self.max_rate = min_rate, max_rate
+        self.min_first_rate, self.max_first_rate = min_first_rate, max_first_rate
+        self.increase = increase
+        self.success_window = success_window
+        self.hour_half_life = hour_half_life
+
+        self._all = TokenBucket(rate, burst)
+        self._first = TokenBucket(first_rate, 1)
+        self._streak = 0
+        self._first_streak = 0
+        self._hours = [(0.0, 0.0)] * 24   # час -> (штраф, когда обновлён)
+        self._contacted: dict[int, float] = {}   # user_id -> когда списан токен первого контакта
+        self.contact_window = 600.0               # сообщения одного приветствия — один первый контакт
+        self.on_change: Optional[Callable[[], None]] = None
+
+        # счётчики
+        self.sent = 0
+        self.first_sent = 0
+        self.floods = 0
+        self.waited = 0.0
+
+
+    @staticmethod
+    def _hour() -> int:
+        tz = get("TIMEZONE") or "Europe/Moscow"
+        try:
+            return dt.datetime.now(ZoneInfo(tz)).hour
+        except Exception:
+            return dt.datetime.utcnow().hour
+
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change()
+
+
+    def snapshot(self) -> dict:
+        """Выученное состояние: скорости и штрафы часов (только ненулевые)."""
+        return {
+            "rate": self.rate,
+            "first_rate": self.first_rate,
+            "hours": {hour: [value, updated] for hour, (value, updated) in enumerate(self._hours) if value},
+        }
+
+
+    def restore(self, state: dict) -> None:
+        """Вернуть состояние из snapshot (после перезапуска). Скорости зажимаются в допустимые пределы."""
+        if state.get("rate"):
+            self.rate = min(self.max_rate, max(self.min_rate, float(state["rate"])))
+        if state.get("first_rate"):
+            self.first_rate = min(self.max_first_rate, max(self.min_first_rate, float(state["first_rate"])))
+        for hour, (value, updated) in (state.get("hours") or {}).items():
+            hour = int(hour)
+            if 0 <= hour < 24:
+                self._hours[hour] = (float(value), float(updated))
+
+
+    def _hour_penalty(self, hour: int) -> float:
+        value, updated = self._hours[hour]
+        if not value:
+            return 0.0
+        return value * 0.5 ** ((time.time() - updated) / self.hour_half_life)
+
+
+    def _remember_hour(self, weight: float = 1.0) -> None:
+        hour = self._hour()
+        self._hours[hour] = (self._hour_penalty(hour) + weight, time.time())
+
+
+    def hour_factor(self) -> float:
+        """Множитель скорости для текущего часа: 1.0 — ограничений в этот час не было."""
+        return 1.0 / (1.0 + self._hour_penalty(self._hour()))
+
+
+    def _new_contact(self, user_id: Optional[int]) -> bool:
+        """Первый контакт с user_id ещё не списан (несколько сообщений приветствия считаются одним)."""
+        if user_id is None:
+            return True
+        now = time.monotonic()
+        if len(self._contacted) > 1000:
+            self._contacted = {uid: ts for uid, ts in self._contacted.items() if now - ts < self.contact_window}
+        ts = self._contacted.get(user_id)
+        if ts is not None and now - ts < self.contact_window:
+            return False
+        self._contacted[user_id] = now
+        return True
+
+
+    async def acquire(self, *, first: bool = False, user_id: int = None) -> float:
+        """Дождаться права на отправку. Возвращает, сколько секунд пришлось ждать."""
+        factor = self.hour_factor()
+        self._all.rate = self.rate * factor
+        self._first.rate = self.first_rate * factor
+
+        waited = 0.0
+        if first and self._new_contact(user_id):
+            waited += await self._first.acquire()
+        waited += await self._all.acquire()
+        self.waited += waited
+        return waited
+
+
+    def on_success(self, *, first: bool = False) -> None:
+        self.sent += 1
+        self._streak += 1
+        if self._streak >= self.success_window:
+            self._streak = 0
+            self.rate = min(self.max_rate, self.rate * self.increase)
+            self._changed()
+        if first:
+            self.first_sent += 1
+            self._first_streak += 1
+            if self._first_streak >= self.success_window:
+                self._first_streak = 0
+                self.first_rate = min(self.max_first_rate, self.first_rate * self.increase)
+                self._changed()
+
+
+    def on_flood_wait(self, seconds: float, *, first: bool = False) -> None:
+        self.floods += 1
+        self._streak = self._first_streak = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+        if first:
+            self.first_rate = max(self.min_first_rate, self.first_rate / 2)
+        # длинный FloodWait — сильный сигнал, что этот час опасен
+        self._remember_hour(min(3.0, 1.0 + seconds / 600))
+        self._changed()
+
+
+    def on_peer_flood(self) -> None:
+        self.floods += 1
+        self._first_streak = 0
+        self.first_rate = max(self.min_first_rate, self.first_rate / 2)
+        self._remember_hour(2.0)
+        self._changed()
+
+
+    def stats(self) -> dict:
+        factor = self.hour_factor()
+        return {
+            "per_hour": round(self.rate * factor * 3600),
+            "first_per_hour": round(self.first_rate * factor * 3600, 1),
+            "hour_factor": round(factor, 2),
+            "sent": self.sent,
+            "first_sent": self.first_sent,
+            "floods": self.floods,
+            "waited_sec": round(self.waited, 1),
+        }
@@ -1,6 +1,9 @@
 import asyncio
+import hashlib
 import mimetypes
+import os
 from pyrogram import Client
+from pyrogram.errors import RPCError
 from pyrogram.raw import functions, types
 from pyrogram.types import User as PyroUser
 from pyrogram.raw.types import User as RawUser
@@ -30,44 +33,122 @@ async def send_message(bot: Client, user: PyroUser | RawUser, text: str = "", re
         
 
 
-async def send_document(bot: Client, user: PyroUser | RawUser, path: str, caption: str = "", first: bool = False) -> bool:
+# path -> (mtime_ns, size, sha256): не перечитываем файл, пока он не изменился
+_file_hashes: dict[str, tuple[int, int, str]] = {}
+
+# Ошибки, после которых сохранённая ссылка на документ больше не годится
+_STALE_MEDIA_ERRORS = {
+    "FILE_REFERENCE_EXPIRED",
+    "FILE_REFERENCE_INVALID",
+    "FILE_REFERENCE_EMPTY",
+    "MEDIA_EMPTY",
+    "MEDIA_INVALID",
+}
+
+
+def file_hash(path: str) -> str:
+    """
+    sha256 содержимого файла. Пересчитывается только при смене mtime/размера.
+    """
+    st = os.stat(path)
+    cached = _file_hashes.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _file_hashes[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def _extract_document(updates) -> types.Document | None:
+    """
+    Достаёт загруженный документ из ответа messages.SendMedia.
+    """
+    for upd in getattr(updates, "updates", None) or []:
+        msg = getattr(upd, "message", None)
+        media = getattr(msg, "media", None)
+        doc = getattr(media, "document", None)
+        if isinstance(doc, types.Document):
+            return doc
+    return None
+
+
+async def _send_media(bot: Client, peer, media, caption: str):
+    return await bot.invoke(
+        functions.messages.SendMedia(
+            peer=peer,
+            media=media,
+            message=caption,
+            random_id=bot.rnd_id()
+        )
+    )
+
+
+async def send_document(bot: Client, user: PyroUser | RawUser, path: str, caption: str = "", first: bool = False,
+                        *, db=None, executor_id: int = None) -> bool:
     """
     Отправляет документ указанным исполнителем.
     При первом контакте пробует RAW API, если есть access_hash.
+    Если переданы db и executor_id, файл загружается в Telegram один раз на исполнителя:
+    дальше отправляется сохранённая ссылка (InputDocument) из таблицы media_cache.
     """
+    if first and isinstance(user, RawUser):
+        peer = types.InputPeerUser(user_id=user.id, access_hash=user.access_hash)
+    else:
+        peer = await bot.resolve_peer(user.id)
+
+    use_cache = db is not None and executor_id is not None
+    digest = file_hash(path) if use_cache else None
+
+    if use_cache:
+        cached = await db.get_media(executor_id, path, digest)
+        if cached:
+            media = types.InputMediaDocument(
+                id=types.InputDocument(
+                    id=cached["doc_id"],
+                    access_hash=cached["access_hash"],
+                    file_reference=cached["file_reference"],
+                )
+            )
+            try:
+                await _send_media(bot, peer, media, caption)
+                return True
+            except RPCError as e:
+                if e.ID not in _STALE_MEDIA_ERRORS:
+                    print(f"[send_document cached] failed: {e}")
+                    raise
+                print(f"[send_document cached] [executor {executor_id}] ссылка устарела ({e.ID}), загружаем заново")
+                await db.drop_media(executor_id, path)
+
     input_file = await bot.save_file(path)
-    
+
     mime_type, _ = mimetypes.guess_type(path)
     if mime_type is None:
         mime_type = "application/pdf"
 
-    if first and isinstance(user, RawUser):
-        try:
-            input_user = types.InputPeerUser(user_id=user.id, access_hash=user.access_hash)
-            await bot.invoke(
-                functions.messages.SendMedia(
-                    peer=input_user,
-                    media=types.InputMediaUploadedDocument(
-                        file=input_file,
-                        mime_type=mime_type,
-                        attributes=[types.DocumentAttributeFilename(file_name=path.split("/")[-1])]
-                    ),
-                    message=caption,
-                    random_id=bot.rnd_id()
-                )
+    media = types.InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=mime_type,
+        attributes=[types.DocumentAttributeFilename(file_name=path.split("/")[-1])]
+    )
+    try:
+        updates = await _send_media(bot, peer, media, caption)
+    except Exception as e:
+        print(f"[send_document] failed: {e}")
+        raise
+
+    if use_cache:
+        doc = _extract_document(updates)
+        if doc is not None:
+            await db.save_media(
+                executor_id, path, digest,
+                doc_id=doc.id, access_hash=doc.access_hash, file_reference=doc.file_reference,
             )
-            return True
-        except Exception as e:
-            print(f"[send_document raw] failed: {e}")
-            raise
-    else:
-        try:
-            await bot.send_document(chat_id=user.id, document=path, caption=caption)
-            return True
-        except Exception as e:
-            print(f"[send_document] failed: {e}")
-            raise
-    return False
+    return True
 
 
 